@@ -0,0 +1,156 @@
+"""
+In-memory stand-ins for RabbitMQ.
+
+They accept what the gateway publishes and feed the billing consumer the
+way pika does, so the services' own code paths are measured without a
+broker. The broker's own latency is, of course, not part of the numbers.
+"""
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+
+class MemoryPublisher:
+    """Takes the place of the gateway's pooled RabbitPublisher; every publish is confirmed at once."""
+
+    def __init__(self):
+        self.published = 0
+        self._lock = threading.Lock()
+
+    def publish(self, body, properties=None):
+        with self._lock:
+            self.published += 1
+
+    def publish_batch(self, bodies, properties=None):
+        with self._lock:
+            self.published += len(bodies)
+        return [None] * len(bodies)
+
+    def close(self, timeout=0):
+        pass
+
+
+class MemoryAsyncPublisher:
+    """Takes the place of the async gateway's AsyncRabbitPublisher."""
+
+    def __init__(self):
+        self.published = 0
+
+    async def start(self):
+        return self
+
+    async def close(self):
+        pass
+
+    async def publish(self, body, headers=None, message_id=None):
+        self.published += 1
+
+    async def publish_batch(self, bodies, headers=None, message_ids=None):
+        self.published += len(bodies)
+        return [None] * len(bodies)
+
+
+def install_memory_publishers():
+    """Make the gateway (in this process) publish to memory instead of RabbitMQ."""
+    import os
+    from app import publisher
+    from app import async_app
+
+    publisher._publisher = MemoryPublisher()
+    publisher._publisher_pid = os.getpid()
+    async_app.create_async_publisher = MemoryAsyncPublisher
+    return publisher._publisher
+
+
+class Delivery:
+    __slots__ = ('delivery_tag',)
+
+    def __init__(self, delivery_tag):
+        self.delivery_tag = delivery_tag
+
+
+class MemoryConnection:
+    """
+    The parts of a pika BlockingConnection the consumer uses: timers.
+
+    Timers fire from process_data_events(), on the consuming thread, as
+    they do with pika.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self._timers = []
+        self._ids = itertools.count()
+        self._cancelled = set()
+
+    def call_later(self, delay, callback):
+        timer = next(self._ids)
+        heapq.heappush(self._timers, (time.monotonic() + delay, timer, callback))
+        return timer
+
+    def remove_timeout(self, timer):
+        self._cancelled.add(timer)
+
+    def next_deadline(self):
+        while self._timers and self._timers[0][1] in self._cancelled:
+            self._cancelled.discard(heapq.heappop(self._timers)[1])
+        return self._timers[0][0] if self._timers else None
+
+    def process_data_events(self, time_limit=0.1):
+        """Deliver queued messages and fire due timers for up to time_limit seconds."""
+        until = time.monotonic() + time_limit
+        while True:
+            deadline = self.next_deadline()
+            now = time.monotonic()
+            if deadline is not None and deadline <= now:
+                _, timer, callback = heapq.heappop(self._timers)
+                callback()
+                continue
+            wait = min(until, deadline) - now if deadline is not None else until - now
+            if wait <= 0:
+                return
+            if not self.channel.deliver_one(wait):
+                if time.monotonic() >= until:
+                    return
+
+
+class MemoryChannel:
+    """
+    A queue plus the channel calls the consumer makes.
+
+    Producers call publish() from any thread; acks are counted, and
+    messages the consumer republishes (retries, dead letters) are kept by
+    routing key.
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._tags = itertools.count(1)
+        self._callback = None
+        self.acked = 0
+        self.republished = {}
+
+    def basic_consume(self, queue, on_message_callback):
+        self._callback = on_message_callback
+
+    def publish(self, properties, body):
+        self._queue.put((properties, body))
+
+    def deliver_one(self, timeout):
+        try:
+            properties, body = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        self._callback(self, Delivery(next(self._tags)), properties, body)
+        return True
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.acked += 1
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.republished.setdefault(routing_key, []).append((properties, body))
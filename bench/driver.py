@@ -0,0 +1,408 @@
+"""
+Run one benchmark workload against one service.
+
+Started by run.py with the service's directory (srcs/<service>) as the
+working directory, so the service's own `app` package is importable. Reads
+a JSON spec on stdin and prints the JSON result as the last line of
+stdout. Each service is its own `app` package, which is why every
+workload runs in a fresh process.
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import quote
+
+sys.path.insert(0, os.getcwd())
+
+from loadgen import LoadRunner, summarize
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRCS_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'srcs')
+
+ADJECTIVES = ['silent', 'crimson', 'lost', 'electric', 'hidden', 'broken', 'golden', 'last', 'wild', 'frozen']
+NOUNS = ['river', 'empire', 'garden', 'signal', 'horizon', 'machine', 'harbor', 'kingdom', 'mirror', 'storm']
+
+
+def movie_title(index):
+    return f'The {ADJECTIVES[index % 10]} {NOUNS[index // 10 % 10]} {index}'
+
+
+# Clients: the same calls in-process (Flask test client) or over HTTP
+
+class InProcessClient:
+    """Calls a Flask app directly, without sockets; one test client per thread."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        return self.app.test_client()
+
+    def call(self, session, method, path, json_body=None):
+        response = session.open(path, method=method, json=json_body)
+        try:
+            # Streamed bodies are produced while they are read
+            body = response.get_data()
+            return response.status_code, body
+        finally:
+            response.close()
+
+
+class HttpClient:
+    """Calls a service over HTTP with one keep-alive session per thread."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def session(self):
+        import requests
+        return requests.Session()
+
+    def call(self, session, method, path, json_body=None):
+        response = session.request(method, self.base_url + path, json=json_body, timeout=60)
+        return response.status_code, response.content
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """A service started with serve.py, stopped when the workload ends."""
+
+    def __init__(self, service, env, server='sync', memory_broker=False):
+        self.port = free_port()
+        command = [sys.executable, os.path.join(BENCH_DIR, 'serve.py'), '--port', str(self.port), '--server', server]
+        if memory_broker:
+            command.append('--memory-broker')
+        self.process = subprocess.Popen(command, cwd=os.path.join(SRCS_DIR, service), env=env)
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.wait_ready()
+
+    def wait_ready(self, timeout=60):
+        import requests
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Server on port {self.port} exited with code {self.process.returncode}')
+            try:
+                if requests.get(self.base_url + '/health', timeout=1).status_code == 200:
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f'Server on port {self.port} did not become ready')
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def service_env(spec, database_uri=None):
+    env = dict(os.environ)
+    env.update(spec['env'])
+    if database_uri is not None:
+        env['DATABASE_URI'] = database_uri
+    return env
+
+
+# Seeding: reuses existing data, so a persistent database is seeded once
+
+def seed_movies(client, count):
+    """Make sure at least count movies exist; returns their ids."""
+    session = client.session()
+    status, body = client.call(session, 'GET', '/api/movies?fields=id')
+    ids = [row['id'] for row in json.loads(body)] if status == 200 else []
+    chunk = 5000
+    for start in range(len(ids), count, chunk):
+        movies = [
+            {'title': movie_title(index), 'description': f'Benchmark movie number {index}'}
+            for index in range(start, min(start + chunk, count))
+        ]
+        status, body = client.call(session, 'POST', '/api/movies/bulk', movies)
+        if status >= 300:
+            raise RuntimeError(f'Seeding movies failed with {status}: {body[:200]!r}')
+    if len(ids) < count:
+        status, body = client.call(session, 'GET', '/api/movies?fields=id')
+        ids = [row['id'] for row in json.loads(body)]
+    return ids
+
+
+def seed_orders(app, orders, users):
+    """Make sure at least `orders` orders spread over `users` users exist."""
+    from app.models import db, Order
+    from app.aggregates import store_orders
+
+    with app.app_context():
+        existing = db.session.execute(db.select(db.func.count(Order.id))).scalar()
+        chunk = 5000
+        for start in range(existing, orders, chunk):
+            store_orders([
+                {
+                    'user_id': f'user-{index % users}',
+                    'number_of_items': index % 7 + 1,
+                    'total_amount': round((index % 500) * 1.25 + 5, 2),
+                    'message_id': str(uuid.uuid4())
+                }
+                for index in range(start, min(start + chunk, orders))
+            ])
+            db.session.commit()
+
+
+# Workloads
+
+def http_workload(spec, client, operation):
+    runner = LoadRunner(
+        operation,
+        concurrency=spec['concurrency'],
+        duration=spec['duration'],
+        warmup=spec['warmup'],
+        seed=spec['seed'],
+        make_state=client.session
+    )
+    return runner.run()
+
+
+def expect(client, session, method, path, statuses, json_body=None):
+    status, _ = client.call(session, method, path, json_body)
+    return status in statuses
+
+
+def inventory_client(spec, servers):
+    if spec['mode'] == 'process':
+        server = Server('inventory-app', service_env(spec, spec['inventory_database']))
+        servers.append(server)
+        return HttpClient(server.base_url)
+    os.environ['DATABASE_URI'] = spec['inventory_database']
+    from app import create_app
+    return InProcessClient(create_app())
+
+
+def run_inventory(spec, servers):
+    client = inventory_client(spec, servers)
+    ids = seed_movies(client, spec['movies'])
+    name = spec['workload']
+
+    if name == 'movies-get':
+        def operation(rng, session):
+            return expect(client, session, 'GET', f'/api/movies/{rng.choice(ids)}', (200,))
+    elif name == 'movies-page':
+        def operation(rng, session):
+            return expect(client, session, 'GET', f'/api/movies?limit=50&after_id={rng.choice(ids)}', (200,))
+    elif name == 'movies-search':
+        def operation(rng, session):
+            word = rng.choice(ADJECTIVES) + ' ' + rng.choice(NOUNS) if rng.random() < 0.5 else rng.choice(NOUNS)
+            return expect(client, session, 'GET', f'/api/movies?title={quote(word)}', (200,))
+    else:  # movies-write: 80% updates, 20% inserts
+        def operation(rng, session):
+            if rng.random() < 0.8:
+                movie_id = rng.choice(ids)
+                return expect(client, session, 'PUT', f'/api/movies/{movie_id}', (200,),
+                              {'title': movie_title(movie_id), 'description': f'Updated {rng.random()}'})
+            return expect(client, session, 'POST', '/api/movies', (201,),
+                          {'title': movie_title(rng.randrange(10 ** 6)), 'description': 'Benchmark insert'})
+
+    return http_workload(spec, client, operation)
+
+
+def run_billing(spec, servers):
+    os.environ['DATABASE_URI'] = spec['billing_database']
+    from app import create_app
+    app = create_app()
+    seed_orders(app, spec['orders'], spec['users'])
+    if spec['mode'] == 'process':
+        server = Server('billing-app', service_env(spec, spec['billing_database']))
+        servers.append(server)
+        client = HttpClient(server.base_url)
+    else:
+        client = InProcessClient(app)
+    users = spec['users']
+
+    if spec['workload'] == 'orders-page':
+        def operation(rng, session):
+            return expect(client, session, 'GET', f'/api/orders?user_id=user-{rng.randrange(users)}&limit=50', (200,))
+    else:  # user-summary
+        def operation(rng, session):
+            return expect(client, session, 'GET', f'/api/users/user-{rng.randrange(users)}/summary', (200,))
+
+    return http_workload(spec, client, operation)
+
+
+def run_gateway(spec, servers):
+    # The gateway always proxies to a separate inventory process
+    inventory = Server('inventory-app', service_env(spec, spec['inventory_database']))
+    servers.append(inventory)
+    os.environ['INVENTORY_API_URL'] = inventory.base_url
+    memory_broker = spec['broker'] == 'memory'
+
+    if spec['mode'] == 'process':
+        env = service_env(spec)
+        env['INVENTORY_API_URL'] = inventory.base_url
+        gateway = Server('api-gateway', env, server=spec['server'], memory_broker=memory_broker)
+        servers.append(gateway)
+        client = HttpClient(gateway.base_url)
+    else:
+        from app import create_app
+        if memory_broker:
+            from brokers import install_memory_publishers
+            install_memory_publishers()
+        client = InProcessClient(create_app())
+
+    if spec['workload'] == 'gateway-movies':
+        ids = seed_movies(HttpClient(inventory.base_url), spec['movies'])
+
+        def operation(rng, session):
+            return expect(client, session, 'GET', f'/api/movies/{rng.choice(ids)}', (200,))
+    else:  # billing-publish
+        def operation(rng, session):
+            order = {
+                'user_id': f'user-{rng.randrange(spec["users"])}',
+                'number_of_items': rng.randrange(1, 8),
+                'total_amount': round(rng.uniform(5, 500), 2)
+            }
+            return expect(client, session, 'POST', '/api/billing', (200,), order)
+
+    return http_workload(spec, client, operation)
+
+
+def run_consume(spec, servers):
+    """
+    Billing consumer throughput curve: orders/s and publish-to-stored lag
+    for each batch size, with messages shaped as the gateway publishes them.
+    """
+    os.environ['DATABASE_URI'] = spec['billing_database']
+    import pika
+    import consumer
+    from app import create_app
+    from app.config import Config
+    from app.retry import retry_delays
+
+    consumer.app = create_app()
+
+    class LagRecordingConsumer(consumer.BatchConsumer):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.lags = []
+
+        def observe_lag(self, deliveries):
+            now_ms = time.time() * 1000
+            for _, properties, _ in deliveries:
+                self.lags.append((now_ms - properties.headers[consumer.PUBLISHED_AT_HEADER]) / 1000.0)
+            super().observe_lag(deliveries)
+
+    def message(index):
+        order = {'user_id': f'user-{index % spec["users"]}', 'number_of_items': index % 7 + 1,
+                 'total_amount': round((index % 500) * 1.25 + 5, 2)}
+        properties = pika.BasicProperties(
+            delivery_mode=2,
+            message_id=str(uuid.uuid4()),
+            headers={consumer.PUBLISHED_AT_HEADER: time.time() * 1000}
+        )
+        return properties, json.dumps(order).encode('utf-8')
+
+    def produce(publish):
+        interval = 1.0 / spec['rate'] if spec['rate'] else 0
+        started = time.perf_counter()
+        for index in range(spec['messages']):
+            if interval:
+                delay = started + index * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            properties, body = message(index)
+            publish(properties, body)
+
+    curve = []
+    for batch_size in spec['batch_sizes']:
+        if spec['broker'] == 'memory':
+            from brokers import MemoryChannel, MemoryConnection
+            channel = MemoryChannel()
+            connection = MemoryConnection(channel)
+            publisher = None
+            publish = channel.publish
+        else:
+            connection, channel = consumer.setup_rabbitmq_connection()
+            channel.queue_purge(Config.RABBITMQ_QUEUE)
+            channel.basic_qos(prefetch_count=max(Config.CONSUMER_PREFETCH_COUNT, batch_size))
+            publisher = pika.BlockingConnection(pika.ConnectionParameters(
+                host=Config.RABBITMQ_HOST,
+                port=Config.RABBITMQ_PORT,
+                credentials=pika.PlainCredentials(Config.RABBITMQ_USER, Config.RABBITMQ_PASSWORD)
+            ))
+            publish_channel = publisher.channel()
+
+            def publish(properties, body, publish_channel=publish_channel):
+                publish_channel.basic_publish(exchange='', routing_key=Config.RABBITMQ_QUEUE,
+                                              body=body, properties=properties)
+
+        batch_consumer = LagRecordingConsumer(
+            connection, channel,
+            batch_size=batch_size,
+            batch_timeout=Config.CONSUMER_BATCH_TIMEOUT_MS / 1000.0,
+            recent_ids=consumer.RecentIds(Config.CONSUMER_DEDUP_CACHE_SIZE),
+            queue=Config.RABBITMQ_QUEUE,
+            retry_delays=retry_delays(Config),
+            worker='bench'
+        )
+        channel.basic_consume(queue=Config.RABBITMQ_QUEUE, on_message_callback=batch_consumer.on_message)
+
+        producer = threading.Thread(target=produce, args=(publish,), daemon=True)
+        started = time.perf_counter()
+        producer.start()
+        deadline = time.monotonic() + spec['consume_timeout']
+        while time.monotonic() < deadline:
+            settled = batch_consumer.stored + batch_consumer.duplicates + batch_consumer.dead_lettered
+            if settled >= spec['messages']:
+                break
+            connection.process_data_events(time_limit=0.05)
+        elapsed = time.perf_counter() - started
+        producer.join()
+        if publisher is not None:
+            publisher.close()
+            connection.close()
+
+        point = summarize(batch_consumer.lags, elapsed, errors=spec['messages'] - batch_consumer.stored)
+        point['batch_size'] = batch_size
+        curve.append(point)
+        print(f"  batch_size={batch_size}: {point['throughput']} orders/s, "
+              f"lag p99 {point['latency_ms']['p99']} ms", file=sys.stderr)
+
+    # The headline numbers are those of the best batch size
+    best = max(curve, key=lambda point: point['throughput'])
+    return dict(best, curve=curve)
+
+
+RUNNERS = {
+    'inventory-app': run_inventory,
+    'billing-app': run_billing,
+    'api-gateway': run_gateway,
+    'billing-consumer': run_consume,
+}
+
+
+def main():
+    spec = json.load(sys.stdin)
+    os.environ.update(spec['env'])
+    servers = []
+    try:
+        result = RUNNERS[spec['runner']](spec, servers)
+    finally:
+        for server in servers:
+            server.stop()
+    print(json.dumps(result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
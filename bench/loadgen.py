@@ -0,0 +1,101 @@
+import math
+import random
+import threading
+import time
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """
+    Throughput and latency percentiles of one run.
+
+    latencies are in seconds; the summary reports milliseconds.
+    """
+    values = sorted(latencies)
+    count = len(values)
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'requests': count,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput': round(count / elapsed, 1) if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'p50': ms(percentile(values, 0.50)),
+            'p95': ms(percentile(values, 0.95)),
+            'p99': ms(percentile(values, 0.99)),
+            'mean': ms(sum(values) / count) if count else None,
+            'max': ms(values[-1]) if values else None
+        }
+    }
+
+
+class LoadRunner:
+    """
+    Closed-loop load: `concurrency` threads each run operations back to back.
+
+    An operation is a callable taking the thread's random.Random and its
+    per-thread state (see make_state) and returning True on success.
+    Operations finished during the warmup are not counted. Each thread
+    records into its own list, so the runner adds no contention of its own.
+    """
+
+    def __init__(self, operation, concurrency=8, duration=10.0, warmup=2.0, seed=1, make_state=None):
+        self.operation = operation
+        self.concurrency = concurrency
+        self.duration = duration
+        self.warmup = warmup
+        self.seed = seed
+        self.make_state = make_state or (lambda: None)
+
+    def run(self):
+        start_at = time.perf_counter() + self.warmup
+        stop_at = start_at + self.duration
+        results = [None] * self.concurrency
+        ready = threading.Barrier(self.concurrency + 1)
+
+        def worker(index):
+            rng = random.Random(self.seed * 1000 + index)
+            state = self.make_state()
+            latencies = []
+            errors = 0
+            ready.wait()
+            while True:
+                started = time.perf_counter()
+                if started >= stop_at:
+                    break
+                try:
+                    ok = self.operation(rng, state)
+                except Exception:
+                    ok = False
+                finished = time.perf_counter()
+                if started < start_at:
+                    continue
+                if ok:
+                    latencies.append(finished - started)
+                else:
+                    errors += 1
+            results[index] = (latencies, errors)
+
+        threads = [
+            threading.Thread(target=worker, args=(index,), name=f'load-{index}', daemon=True)
+            for index in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        ready.wait()
+        for thread in threads:
+            thread.join()
+
+        latencies = [value for thread_latencies, _ in results for value in thread_latencies]
+        errors = sum(thread_errors for _, thread_errors in results)
+        return summarize(latencies, self.duration, errors)
@@ -0,0 +1,254 @@
+"""
+Offline benchmarks for the gateway, inventory and billing services.
+
+    python bench/run.py                              # every workload, in-process, SQLite
+    python bench/run.py movies-get movies-search --mode process --concurrency 16
+    python bench/run.py --save before                # keep the results as a baseline
+    python bench/run.py --compare before             # compare with it, flag regressions
+
+Nothing but the services themselves is needed: databases default to fresh
+SQLite files and RabbitMQ is replaced by an in-memory stand-in (see
+bench/README.md for Postgres and a local broker).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SRCS_DIR = os.path.join(ROOT_DIR, 'srcs')
+BASELINE_DIR = os.path.join(BENCH_DIR, 'baselines')
+
+# name: (runner, working directory under srcs/, what it measures)
+WORKLOADS = {
+    'movies-get': ('inventory-app', 'inventory-app', 'GET /api/movies/<id>'),
+    'movies-page': ('inventory-app', 'inventory-app', 'GET /api/movies?limit=50&after_id=<id>'),
+    'movies-search': ('inventory-app', 'inventory-app', 'GET /api/movies?title=<words>'),
+    'movies-write': ('inventory-app', 'inventory-app', '80% PUT /api/movies/<id>, 20% POST /api/movies'),
+    'orders-page': ('billing-app', 'billing-app', 'GET /api/orders?user_id=<user>&limit=50'),
+    'user-summary': ('billing-app', 'billing-app', 'GET /api/users/<user>/summary'),
+    'gateway-movies': ('api-gateway', 'api-gateway', 'GET /api/movies/<id> through the gateway'),
+    'billing-publish': ('api-gateway', 'api-gateway', 'POST /api/billing through the gateway'),
+    'billing-consume': ('billing-consumer', 'billing-app', 'consumer orders/s and lag per batch size'),
+}
+
+# Relative change beyond which compare() reports a regression
+DEFAULT_TOLERANCE = 0.10
+# Options that make results incomparable when they differ from the baseline's
+COMPARABLE_OPTIONS = ('mode', 'server', 'broker', 'concurrency', 'movies', 'orders', 'users', 'messages', 'rate', 'env')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the services offline")
+    parser.add_argument('workloads', nargs='*', metavar='workload',
+                        help=f"workloads to run (default: all): {', '.join(WORKLOADS)}")
+    parser.add_argument('--list', action='store_true', help="list the workloads and exit")
+    parser.add_argument('--mode', choices=['inprocess', 'process'], default='inprocess',
+                        help="call create_app() in-process, or serve it as a local process over HTTP")
+    parser.add_argument('--server', choices=['sync', 'async'], default='sync',
+                        help="gateway flavour in process mode")
+    parser.add_argument('--concurrency', type=int, default=8, help="client threads")
+    parser.add_argument('--duration', type=float, default=10.0, help="measured seconds per workload")
+    parser.add_argument('--warmup', type=float, default=2.0, help="unmeasured seconds before that")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the request mix")
+    parser.add_argument('--movies', type=int, default=10000, help="movies to seed")
+    parser.add_argument('--orders', type=int, default=100000, help="orders to seed")
+    parser.add_argument('--users', type=int, default=1000, help="distinct users of the orders")
+    parser.add_argument('--messages', type=int, default=20000, help="messages per billing-consume batch size")
+    parser.add_argument('--batch-sizes', default='1,10,50,100,250,500',
+                        help="billing-consume batch sizes, comma-separated")
+    parser.add_argument('--rate', type=float, default=0,
+                        help="billing-consume publish rate in messages/s (0: as fast as possible)")
+    parser.add_argument('--consume-timeout', type=float, default=300, help="seconds per billing-consume point")
+    parser.add_argument('--broker', choices=['memory', 'rabbitmq'], default='memory',
+                        help="in-memory stand-in, or the RabbitMQ at RABBITMQ_HOST")
+    parser.add_argument('--inventory-database', help="database URI (default: a fresh SQLite file)")
+    parser.add_argument('--billing-database', help="database URI (default: a fresh SQLite file)")
+    parser.add_argument('-e', '--env', action='append', default=[], metavar='KEY=VALUE',
+                        help="setting passed to every service, e.g. -e INVENTORY_CACHE_ENABLED=False")
+    parser.add_argument('--save', metavar='NAME', help=f"save the results as {BASELINE_DIR}/NAME.json")
+    parser.add_argument('--compare', metavar='NAME', help="compare with a saved baseline (name or path)")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="relative change counted as a regression (default 0.10)")
+    parser.add_argument('--fail-on-regression', action='store_true', help="exit with 1 on any regression")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.workloads if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"unknown workload(s): {', '.join(unknown)}")
+    if args.server == 'async' and args.mode != 'process':
+        parser.error("--server async needs --mode process")
+    for setting in args.env:
+        if '=' not in setting:
+            parser.error(f"-e expects KEY=VALUE, got {setting!r}")
+    return args
+
+
+def base_env(args):
+    """Settings that keep benchmark runs quiet and self-contained."""
+    env = {
+        'TRACE_EXPORTER': 'none',
+        'CONSUMER_METRICS_PORT': '0',
+        'RABBITMQ_QUEUE': 'bench_billing_queue',
+        'SPOOL_DIR': os.path.join(tempfile.gettempdir(), 'bench-spool'),
+    }
+    env.update(setting.split('=', 1) for setting in args.env)
+    return env
+
+
+def run_workload(name, args, scratch):
+    runner, service, _ = WORKLOADS[name]
+    # Fresh SQLite files per workload, so no workload sees another's writes
+    spec = {
+        'workload': name,
+        'runner': runner,
+        'mode': args.mode,
+        'server': args.server,
+        'broker': args.broker,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'seed': args.seed,
+        'movies': args.movies,
+        'orders': args.orders,
+        'users': args.users,
+        'messages': args.messages,
+        'batch_sizes': [int(size) for size in args.batch_sizes.split(',') if size],
+        'rate': args.rate,
+        'consume_timeout': args.consume_timeout,
+        'inventory_database': args.inventory_database or f"sqlite:///{os.path.join(scratch, name + '-inventory.db')}",
+        'billing_database': args.billing_database or f"sqlite:///{os.path.join(scratch, name + '-billing.db')}",
+        'env': base_env(args),
+    }
+    completed = subprocess.run(
+        [sys.executable, os.path.join(BENCH_DIR, 'driver.py')],
+        cwd=os.path.join(SRCS_DIR, service),
+        input=json.dumps(spec),
+        stdout=subprocess.PIPE,
+        text=True
+    )
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        raise RuntimeError(f"{name} failed with exit code {completed.returncode}")
+    return json.loads(lines[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def format_row(name, result):
+    latency = result['latency_ms']
+    return (f"{name:<16} {result['throughput']:>10.1f} {_ms(latency['p50']):>9} "
+            f"{_ms(latency['p95']):>9} {_ms(latency['p99']):>9} {result['errors']:>7}")
+
+
+def _ms(value):
+    return '-' if value is None else f'{value:.2f}'
+
+
+def print_results(results):
+    print(f"{'workload':<16} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, result in results.items():
+        print(format_row(name, result))
+        for point in result.get('curve', []):
+            print(format_row(f"  batch {point['batch_size']}", point))
+
+
+def load_baseline(name):
+    path = name if name.endswith('.json') else os.path.join(BASELINE_DIR, name + '.json')
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, results, options, tolerance):
+    """
+    Print each workload's change against the baseline.
+
+    Returns the regressions: throughput down, or p95/p99 latency up, by
+    more than tolerance.
+    """
+    regressions = []
+    differing = [
+        key for key in COMPARABLE_OPTIONS
+        if baseline['meta']['options'].get(key) != options.get(key)
+    ]
+    if differing:
+        print(f"\nWarning: the baseline ran with different {', '.join(differing)}", file=sys.stderr)
+    print(f"\nCompared with {baseline['meta'].get('name')} ({baseline['meta'].get('commit')}, "
+          f"{baseline['meta'].get('created')}):")
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:<16} not in the baseline")
+            continue
+        changes = [('throughput', before['throughput'], result['throughput'], -1)]
+        for key in ('p95', 'p99'):
+            changes.append((key, before['latency_ms'][key], result['latency_ms'][key], 1))
+        parts = []
+        for label, old, new, worse in changes:
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            flag = ''
+            if change * worse > tolerance:
+                flag = ' REGRESSION'
+                regressions.append((name, label, change))
+            parts.append(f"{label} {change:+.1%}{flag}")
+        print(f"{name:<16} " + ', '.join(parts))
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.list:
+        for name, (_, service, description) in WORKLOADS.items():
+            print(f"{name:<16} {service:<14} {description}")
+        return 0
+
+    names = args.workloads or list(WORKLOADS)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='bench-') as scratch:
+        for name in names:
+            print(f"Running {name} ({args.mode})...", file=sys.stderr)
+            results[name] = run_workload(name, args, scratch)
+
+    print_results(results)
+
+    meta = {
+        'name': args.save,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'options': {key: value for key, value in vars(args).items()
+                    if key not in ('workloads', 'list', 'save', 'compare', 'fail_on_regression')}
+    }
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, args.save + '.json')
+        with open(path, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+        print(f"\nSaved {path}", file=sys.stderr)
+
+    if args.compare:
+        regressions = compare(load_baseline(args.compare), results, meta['options'], args.tolerance)
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
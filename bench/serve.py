@@ -0,0 +1,52 @@
+"""
+Serve one service for a process-mode benchmark.
+
+    cd srcs/<service> && python ../../bench/serve.py --port 18080 [--server sync|async] [--memory-broker]
+
+Runs the service's create_app() on a threaded WSGI server bound to
+127.0.0.1 (or the async gateway with --server async). --memory-broker
+makes the gateway publish to memory instead of RabbitMQ.
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.getcwd())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a service for benchmarking")
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--server', choices=['sync', 'async'], default='sync')
+    parser.add_argument('--memory-broker', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.memory_broker:
+        from brokers import install_memory_publishers
+        install_memory_publishers()
+
+    if args.server == 'async':
+        from aiohttp import web
+        from app.async_app import create_async_app
+        web.run_app(create_async_app(), host='127.0.0.1', port=args.port, print=None, access_log=None)
+        return 0
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    # One log line per request would dominate the measurement
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    from app import create_app
+
+    class RequestHandler(WSGIRequestHandler):
+        # Keep-alive, as production servers and the gateway's pooled client
+        # expect, without Nagle delaying the body written after the headers
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+    server = make_server('127.0.0.1', args.port, create_app(), threaded=True, request_handler=RequestHandler)
+    server.serve_forever()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,14 @@
 from flask import Flask
 from flask_cors import CORS
 from app.config import Config
+from app.metrics import init_metrics
+from app.tracing import init_tracing
 
 def create_app():
     app = Flask(__name__)
     CORS(app)
+    init_metrics(app)
+    init_tracing(app, 'gateway')
     
     # Register routes
     from app.routes import inventory_proxy, billing_proxy, health_bp
@@ -0,0 +1,469 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+
+import aiohttp
+from aiohttp import web
+
+from app.config import Config
+from app.metrics import REGISTRY, CONTENT_TYPE, REQUEST_DURATION, REQUESTS_IN_FLIGHT
+from app.cache import (
+    CachedResponse,
+    ResponseCache,
+    movie_cache,
+    is_cacheable,
+    is_conditional,
+    reads_own_writes,
+)
+from app.singleflight import AsyncSingleFlight
+from app.spool import SpoolUnavailable, get_spool, spool_stats
+from app.resilience import (
+    UpstreamUnavailable,
+    inventory_guard,
+    rabbitmq_guard,
+    is_upstream_failure,
+)
+from app.async_publisher import create_async_publisher
+from app.routes.billing_proxy import (
+    validate_billing_data,
+    validate_billing_batch,
+    record_batch_outcomes,
+    summarize_billing_batch,
+    parse_billing_batch,
+    new_message_id,
+    IDEMPOTENCY_HEADER,
+)
+from app.upstream import (
+    forwardable_request_headers,
+    forwardable_response_headers,
+    replayable_headers,
+    with_trace_headers,
+)
+from app.tracing import (
+    AMQP_SAMPLED_HEADER,
+    REQUEST_ID_HEADER,
+    SAMPLED_HEADER,
+    current_trace,
+    end_trace,
+    message_trace,
+    should_sample,
+    span,
+    start_trace,
+)
+
+upstream_session_key = web.AppKey('upstream_session', aiohttp.ClientSession)
+publisher_key = web.AppKey('publisher', object)
+inflight_reads_key = web.AppKey('inflight_reads', AsyncSingleFlight)
+
+
+def create_async_app():
+    """
+    Create the asyncio flavour of the gateway.
+
+    Serves the same routes as create_app(), but the inventory proxy uses a
+    pooled aiohttp client and billing messages go through an aio-pika
+    publisher, so a waiting upstream call never ties up a thread.
+    """
+    app = web.Application(
+        middlewares=[metrics_middleware, tracing_middleware, cors_middleware],
+        client_max_size=Config.ASYNC_MAX_BODY_SIZE
+    )
+
+    app.router.add_route('GET', '/api/movies', forward_to_inventory)
+    app.router.add_route('POST', '/api/movies', forward_to_inventory)
+    app.router.add_route('DELETE', '/api/movies', forward_to_inventory)
+    app.router.add_route('POST', '/api/movies/{id:bulk}', forward_to_inventory)
+    app.router.add_route('GET', '/api/movies/{id}', forward_to_inventory)
+    app.router.add_route('PUT', '/api/movies/{id}', forward_to_inventory)
+    app.router.add_route('DELETE', '/api/movies/{id}', forward_to_inventory)
+    app.router.add_route('POST', '/api/billing', proxy_billing)
+    app.router.add_route('POST', '/api/billing/batch', proxy_billing_batch)
+    app.router.add_route('GET', '/health', health_check)
+    app.router.add_route('GET', '/health/cache', cache_stats)
+    app.router.add_route('GET', '/health/upstreams', upstream_stats)
+    app.router.add_route('GET', '/metrics', metrics)
+
+    app[inflight_reads_key] = AsyncSingleFlight()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+
+    return app
+
+
+async def on_startup(app):
+    connector = aiohttp.TCPConnector(
+        limit=Config.UPSTREAM_POOL_MAXSIZE * Config.UPSTREAM_POOL_CONNECTIONS,
+        limit_per_host=Config.UPSTREAM_POOL_MAXSIZE,
+    )
+    app[upstream_session_key] = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(
+            sock_connect=Config.UPSTREAM_CONNECT_TIMEOUT,
+            sock_read=Config.UPSTREAM_READ_TIMEOUT
+        ),
+        # Relay bodies as the upstream encoded them, and never share cookies
+        # set by upstream responses between callers
+        auto_decompress=False,
+        cookie_jar=aiohttp.DummyCookieJar()
+    )
+    app[publisher_key] = await create_async_publisher().start()
+
+
+async def on_cleanup(app):
+    await app[publisher_key].close()
+    await app[upstream_session_key].close()
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """Record request latency and in-flight requests, as init_metrics() does for Flask"""
+    started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        # The route pattern, not the path, so ids do not multiply the series
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else 'unmatched'
+        REQUEST_DURATION.labels(request.method, route, str(status)).observe(time.perf_counter() - started)
+
+
+@web.middleware
+async def tracing_middleware(request, handler):
+    """Trace every request, as init_tracing() does for Flask"""
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else 'unmatched'
+    trace, token = start_trace(
+        'gateway',
+        f'{request.method} {route}',
+        request.headers.get(REQUEST_ID_HEADER),
+        should_sample(request.headers.get(SAMPLED_HEADER))
+    )
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        # A streamed response got its headers before it was prepared
+        if not response.prepared:
+            add_trace_headers(response, trace)
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        trace.finish(status=status)
+        end_trace(token)
+
+
+def add_trace_headers(response, trace):
+    for name, value in trace.response_headers():
+        if name == REQUEST_ID_HEADER:
+            response.headers[name] = value
+        else:
+            response.headers.add(name, value)
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    """Allow any origin, matching flask_cors' defaults in the sync gateway"""
+    if request.method == 'OPTIONS' and 'Access-Control-Request-Method' in request.headers:
+        response = web.Response(status=200)
+        response.headers['Access-Control-Allow-Methods'] = request.headers['Access-Control-Request-Method']
+        if 'Access-Control-Request-Headers' in request.headers:
+            response.headers['Access-Control-Allow-Headers'] = request.headers['Access-Control-Request-Headers']
+    else:
+        response = await handler(request)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+async def forward_to_inventory(request):
+    url = f"{Config.INVENTORY_API_URL}/api/movies"
+    movie_id = request.match_info.get('id')
+    if movie_id:
+        url += f"/{movie_id}"
+
+    read_key = None
+    if (request.method == 'GET' and not is_conditional(request.headers)
+            and not reads_own_writes(request.cookies)
+            and (movie_cache is not None or Config.INVENTORY_COALESCE_ENABLED)):
+        read_key = ResponseCache.make_key(request.path, request.query.items())
+
+    generation = None
+    if movie_cache is not None and read_key is not None:
+        generation = movie_cache.generation
+        cached = movie_cache.get(read_key)
+        if cached is not None:
+            return replay_response(cached, 'HIT')
+
+    # Identical reads already on their way upstream are shared, not repeated
+    inflight = request.app[inflight_reads_key]
+    call = None
+    if Config.INVENTORY_COALESCE_ENABLED and read_key is not None:
+        call, leader = inflight.begin(read_key)
+        if not leader:
+            shared = await inflight.wait(
+                call, timeout=Config.UPSTREAM_CONNECT_TIMEOUT + Config.UPSTREAM_READ_TIMEOUT
+            )
+            if shared is not None:
+                return replay_response(shared, 'COALESCED')
+            call = None
+
+    shared = None
+    try:
+        try:
+            started = inventory_guard.acquire()
+        except UpstreamUnavailable as e:
+            return shed_response(e)
+        ok = False
+        try:
+            response, shared = await relay_upstream(request, url, read_key, generation, call is not None)
+            ok = not is_upstream_failure(response.status)
+            return response
+        except (ConnectionResetError, asyncio.CancelledError):
+            # The caller went away; that says nothing about the upstream
+            ok = True
+            raise
+        finally:
+            inventory_guard.release(ok, started)
+    finally:
+        if call is not None:
+            inflight.finish(read_key, call, shared)
+
+
+async def relay_upstream(request, url, read_key, generation, coalescing):
+    """
+    Forward the request and stream the upstream response back.
+
+    Returns (response, shared) where shared is the buffered response for
+    coalesced waiters, or None when the body was too large or not a read.
+    """
+    session = request.app[upstream_session_key]
+    data = await request.read()
+    try:
+        # Until the upstream's headers arrive; the body is streamed afterwards
+        with span('inventory'):
+            upstream = await session.request(
+                request.method,
+                url,
+                headers=with_trace_headers(forwardable_request_headers(request.headers.items())),
+                data=data,
+                cookies=request.cookies,
+                params=request.query
+            )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return web.json_response({
+            "error": "Error connecting to Inventory API",
+            "details": str(e)
+        }, status=503), None
+
+    if movie_cache is not None and request.method != 'GET':
+        movie_cache.invalidate_write(request.method, request.path)
+
+    # Relay the body chunk by chunk instead of buffering it, collecting it
+    # on the side when it is small enough to cache or share
+    async with upstream:
+        relayed = forwardable_response_headers(upstream.headers)
+        headers = replayable_headers(relayed)
+        cacheable = movie_cache is not None and read_key is not None and is_cacheable(upstream.status, upstream.headers)
+        limit = Config.INVENTORY_COALESCE_MAX_BYTES if coalescing else 0
+        if cacheable:
+            limit = max(limit, Config.INVENTORY_CACHE_MAX_ENTRY_BYTES)
+        collected = [] if read_key is not None and limit else None
+        size = 0
+
+        response = web.StreamResponse(status=upstream.status)
+        for key, value in relayed:
+            response.headers.add(key, value)
+        if read_key is not None:
+            response.headers['X-Cache'] = 'MISS'
+        trace = current_trace()
+        if trace is not None:
+            add_trace_headers(response, trace)
+        await response.prepare(request)
+        async for chunk in upstream.content.iter_chunked(Config.UPSTREAM_STREAM_CHUNK_SIZE):
+            if collected is not None:
+                size += len(chunk)
+                if size > limit:
+                    collected = None
+                else:
+                    collected.append(chunk)
+            await response.write(chunk)
+        await response.write_eof()
+
+    if collected is None:
+        return response, None
+    body = b''.join(collected)
+    if cacheable:
+        movie_cache.put(read_key, upstream.status, headers, body, generation=generation)
+    return response, CachedResponse(upstream.status, headers, body, None)
+
+
+async def run_blocking(func, *args):
+    """Run a blocking call (disk fsync) without stalling the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def shed_response(error):
+    """Fast 503 for a call rejected before reaching the upstream"""
+    return web.json_response(
+        error.to_dict(),
+        status=503,
+        headers={'Retry-After': str(error.retry_after)}
+    )
+
+
+def replay_response(cached, source):
+    """Build a response from a buffered upstream response"""
+    response = web.Response(body=cached.body, status=cached.status)
+    for key, value in cached.headers:
+        response.headers.add(key, value)
+    response.headers['X-Cache'] = source
+    return response
+
+
+async def proxy_billing(request):
+    """
+    Handle POST requests to /api/billing and send them to RabbitMQ
+    """
+    try:
+        try:
+            billing_data = await request.json()
+        except ValueError:
+            billing_data = None
+
+        error = validate_billing_data(billing_data)
+        if error:
+            return web.json_response({"error": error}, status=400)
+
+        message_id = new_message_id(request.headers.get(IDEMPOTENCY_HEADER))
+
+        # With the spool on, the order is acknowledged once it is on disk
+        if Config.SPOOL_ENABLED:
+            try:
+                correlation_id, trace_headers = message_trace()
+                with span('spool'):
+                    await run_blocking(get_spool().append, json.dumps(billing_data).encode('utf-8'), message_id,
+                                       correlation_id, AMQP_SAMPLED_HEADER in trace_headers)
+            except SpoolUnavailable as e:
+                return shed_response(UpstreamUnavailable('Billing spool', str(e)))
+            return web.json_response(
+                {"message": "Message posted to billing queue", "message_id": message_id}, status=200
+            )
+
+        try:
+            started = rabbitmq_guard.acquire()
+        except UpstreamUnavailable as e:
+            return shed_response(e)
+
+        ok = False
+        try:
+            with span('rabbitmq'):
+                await request.app[publisher_key].publish(json.dumps(billing_data), message_id=message_id)
+            ok = True
+        except Exception as e:
+            raise Exception(f"Failed to send message to RabbitMQ: {str(e)}")
+        finally:
+            rabbitmq_guard.release(ok, started)
+
+        return web.json_response(
+            {"message": "Message posted to billing queue", "message_id": message_id}, status=200
+        )
+
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=500)
+
+
+async def proxy_billing_batch(request):
+    """
+    Handle POST requests to /api/billing/batch (JSON array or NDJSON)
+    """
+    try:
+        orders, error = parse_billing_batch(await request.read(), request.content_type)
+        if error:
+            return web.json_response({"error": error}, status=400)
+
+        if len(orders) > Config.BILLING_BATCH_MAX_ITEMS:
+            return web.json_response({
+                "error": f"Batch exceeds {Config.BILLING_BATCH_MAX_ITEMS} orders"
+            }, status=413)
+
+        results, valid = validate_billing_batch(orders)
+        message_ids = [new_message_id() for _ in valid]
+        if valid and Config.SPOOL_ENABLED:
+            try:
+                correlation_id, trace_headers = message_trace()
+                with span('spool'):
+                    await run_blocking(
+                        get_spool().append_many,
+                        [json.dumps(orders[index]).encode('utf-8') for index in valid],
+                        message_ids,
+                        correlation_id,
+                        AMQP_SAMPLED_HEADER in trace_headers
+                    )
+            except SpoolUnavailable as e:
+                return shed_response(UpstreamUnavailable('Billing spool', str(e)))
+            record_batch_outcomes(results, valid, [None] * len(valid), message_ids)
+        elif valid:
+            try:
+                started = rabbitmq_guard.acquire()
+            except UpstreamUnavailable as e:
+                return shed_response(e)
+
+            outcomes = []
+            try:
+                with span('rabbitmq'):
+                    outcomes = await request.app[publisher_key].publish_batch(
+                        [json.dumps(orders[index]) for index in valid],
+                        message_ids=message_ids
+                    )
+            finally:
+                rabbitmq_guard.release(any(outcome is None for outcome in outcomes), started)
+            record_batch_outcomes(results, valid, outcomes, message_ids)
+
+        body, status = summarize_billing_batch(results)
+        return web.json_response(body, status=status)
+
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=500)
+
+
+async def health_check(request):
+    """Health check endpoint for Docker container monitoring"""
+    return web.json_response({
+        'status': 'healthy',
+        'timestamp': datetime.utcnow().isoformat(),
+        'service': 'api-gateway-app'
+    }, status=200)
+
+
+async def cache_stats(request):
+    """Hit/miss counters of the gateway's movie response cache and read coalescing"""
+    stats = {'enabled': False}
+    if movie_cache is not None:
+        stats = dict(enabled=True, **movie_cache.stats())
+    stats['coalescing'] = request.app[inflight_reads_key].stats()
+    return web.json_response(stats, status=200)
+
+
+async def metrics(request):
+    """Runtime metrics in the Prometheus text format"""
+    return web.Response(body=REGISTRY.exposition().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def upstream_stats(request):
+    """Circuit breaker state and load-shedding counters per upstream"""
+    return web.json_response({
+        'inventory': inventory_guard.stats(),
+        'rabbitmq': rabbitmq_guard.stats(),
+        'spool': spool_stats()
+    }, status=200)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from urllib.parse import quote
+
+import aio_pika
+from aio_pika.pool import Pool
+
+from app.config import Config
+from app.publisher import CONFIRM_MODES, CONFIRM_NONE, CONFIRM_WINDOW, PublishError, published_at_headers
+from app.tracing import message_trace
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRabbitPublisher:
+    """
+    Non-blocking counterpart of RabbitPublisher for the asyncio gateway.
+
+    Uses aio-pika robust connections, which reconnect and reopen their
+    channels on their own, behind a connection pool and a channel pool. The
+    confirm modes behave as in the threaded publisher: 'message' awaits the
+    broker confirm, 'window' returns at once while fewer than
+    `confirm_window` messages are unconfirmed, 'none' disables confirms.
+    """
+
+    def __init__(self, url, queue, pool_size=1, channels_per_connection=1,
+                 confirm_mode='message', confirm_window=1000, timeout=5.0):
+        if confirm_mode not in CONFIRM_MODES:
+            raise ValueError(f"Unknown confirm mode: {confirm_mode}")
+        self.url = url
+        self.queue = queue
+        self.confirm_mode = confirm_mode
+        self.timeout = timeout
+        self._pool_size = max(1, pool_size)
+        self._channels_per_connection = max(1, channels_per_connection)
+        self._confirm_window = max(1, confirm_window)
+        self._window = None
+        self._connections = None
+        self._channels = None
+        self._declared = False
+        self._in_flight = set()
+
+    async def start(self):
+        self._window = asyncio.Semaphore(self._confirm_window)
+        self._connections = Pool(self._get_connection, max_size=self._pool_size)
+        self._channels = Pool(
+            self._get_channel,
+            max_size=self._pool_size * self._channels_per_connection
+        )
+        return self
+
+    async def close(self):
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        if self._channels is not None:
+            await self._channels.close()
+        if self._connections is not None:
+            await self._connections.close()
+
+    async def _get_connection(self):
+        return await aio_pika.connect_robust(self.url, timeout=self.timeout)
+
+    async def _get_channel(self):
+        async with self._connections.acquire() as connection:
+            channel = await connection.channel(
+                publisher_confirms=self.confirm_mode != CONFIRM_NONE
+            )
+            # Declared once per process rather than once per message
+            if not self._declared:
+                await channel.declare_queue(self.queue, durable=True)
+                self._declared = True
+            return channel
+
+    async def _publish(self, message):
+        async with self._channels.acquire() as channel:
+            await channel.default_exchange.publish(message, routing_key=self.queue)
+
+    async def publish(self, body, headers=None, message_id=None):
+        """
+        Publish one message to the configured queue.
+
+        Raises PublishError when the message could not be published or, in
+        'message' mode, was not confirmed in time.
+        """
+        message = _message(body, headers, message_id)
+
+        if self.confirm_mode == CONFIRM_WINDOW:
+            try:
+                await asyncio.wait_for(self._window.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                raise PublishError('Too many unconfirmed messages in flight')
+            task = asyncio.ensure_future(self._publish(message))
+            self._in_flight.add(task)
+            task.add_done_callback(self._on_window_done)
+            return
+
+        try:
+            await asyncio.wait_for(self._publish(message), self.timeout)
+        except asyncio.TimeoutError:
+            raise PublishError('Timed out waiting for RabbitMQ to confirm the message')
+        except Exception as e:
+            raise PublishError(str(e))
+
+    async def publish_batch(self, bodies, headers=None, message_ids=None):
+        """
+        Publish many messages on one channel and wait for all their confirms.
+
+        Returns None for each confirmed message and the exception for each
+        failed one, in input order.
+        """
+        if not bodies:
+            return []
+        message_ids = message_ids or [None] * len(bodies)
+        messages = [_message(body, headers, message_id) for body, message_id in zip(bodies, message_ids)]
+
+        async def publish_all():
+            async with self._channels.acquire() as channel:
+                exchange = channel.default_exchange
+                return await asyncio.gather(
+                    *(exchange.publish(message, routing_key=self.queue) for message in messages),
+                    return_exceptions=True
+                )
+
+        try:
+            outcomes = await asyncio.wait_for(publish_all(), self.timeout)
+        except asyncio.TimeoutError:
+            return [PublishError('Timed out waiting for RabbitMQ to confirm the message')] * len(bodies)
+        except Exception as e:
+            return [PublishError(str(e))] * len(bodies)
+        return [outcome if isinstance(outcome, BaseException) else None for outcome in outcomes]
+
+    def _on_window_done(self, task):
+        self._in_flight.discard(task)
+        self._window.release()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Unconfirmed billing message lost: {task.exception()}")
+
+
+def _message(body, headers=None, message_id=None):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    # Built in the publishing request's task, so this is that request's trace
+    correlation_id, trace_headers = message_trace()
+    return aio_pika.Message(
+        body,
+        headers=dict(headers or {}, **published_at_headers(), **trace_headers),
+        message_id=message_id,
+        correlation_id=correlation_id,
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT  # Make message persistent
+    )
+
+
+def create_async_publisher():
+    """Build an AsyncRabbitPublisher from the gateway configuration."""
+    url = 'amqp://{user}:{password}@{host}:{port}/?heartbeat={heartbeat}'.format(
+        user=quote(Config.RABBITMQ_USER, safe=''),
+        password=quote(Config.RABBITMQ_PASSWORD, safe=''),
+        host=Config.RABBITMQ_HOST,
+        port=Config.RABBITMQ_PORT,
+        heartbeat=Config.RABBITMQ_HEARTBEAT,
+    )
+    return AsyncRabbitPublisher(
+        url,
+        queue=Config.RABBITMQ_QUEUE,
+        pool_size=Config.RABBITMQ_POOL_SIZE,
+        channels_per_connection=Config.RABBITMQ_CHANNELS_PER_CONNECTION,
+        confirm_mode=Config.RABBITMQ_CONFIRM_MODE,
+        confirm_window=Config.RABBITMQ_CONFIRM_WINDOW,
+        timeout=Config.RABBITMQ_PUBLISH_TIMEOUT,
+    )
@@ -0,0 +1,182 @@
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from app.config import Config
+from app.metrics import Callback
+
+MOVIES_PATH = '/api/movies'
+MOVIES_BULK_PATH = '/api/movies/bulk'
+MOVIES_CHANGES_PATH = '/api/movies/changes'
+# Set by the Inventory API on a client that has just written, so that its
+# reads go to the primary database for a few seconds
+STICKY_PRIMARY_COOKIE = 'db-primary'
+
+
+class CachedResponse:
+    """A fully buffered upstream response that can be replayed."""
+
+    __slots__ = ('status', 'headers', 'body', 'expires_at')
+
+    def __init__(self, status, headers, body, expires_at):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache with a per-entry TTL for upstream GET responses.
+
+    Keys are (path, normalized query string). Safe to share between threads.
+    """
+
+    def __init__(self, max_entries=1024, ttl=5.0, max_entry_bytes=1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._generation = 0
+
+    @staticmethod
+    def make_key(path, query_pairs):
+        """Build a cache key from a path and its (name, value) query pairs."""
+        return path, urlencode(sorted(query_pairs))
+
+    @property
+    def generation(self):
+        """Bumped by every invalidation; see put()."""
+        return self._generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, status, headers, body, generation=None):
+        """
+        Store a response.
+
+        Pass the generation read before the upstream call: if a write has
+        invalidated the cache since then, the response may predate it and is
+        not stored.
+        """
+        if len(body) > self.max_entry_bytes:
+            return
+        entry = CachedResponse(status, headers, body, time.monotonic() + self.ttl)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_write(self, method, path):
+        """
+        Drop the entries a forwarded write may have made stale.
+
+        Any write changes the listings and searches under /api/movies and the
+        change feed at /api/movies/changes; a write to /api/movies/<id> also
+        changes that movie, and DELETE /api/movies and any write to
+        /api/movies/bulk may touch every movie.
+        """
+        with self._lock:
+            if (path == MOVIES_PATH and method == 'DELETE') or path == MOVIES_BULK_PATH:
+                stale = list(self._entries)
+            else:
+                stale = [key for key in self._entries if key[0] in (MOVIES_PATH, MOVIES_CHANGES_PATH, path)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+def is_conditional(headers):
+    """
+    Conditional reads go straight upstream, which can answer 304 cheaply.
+
+    They are neither served from nor stored in the cache, nor coalesced with
+    unconditional reads that expect a full body.
+    """
+    return 'If-None-Match' in headers or 'If-Modified-Since' in headers
+
+
+def reads_own_writes(cookies):
+    """
+    Reads of a client that has just written go straight upstream.
+
+    The client expects to see its own write, which a cached or shared
+    response may predate, so these reads are neither served from nor stored
+    in the cache, nor coalesced.
+    """
+    return STICKY_PRIMARY_COOKIE in cookies
+
+
+def is_cacheable(status, headers):
+    """Only successful, public responses that don't set cookies are cached."""
+    if status != 200:
+        return False
+    if 'Set-Cookie' in headers:
+        return False
+    cache_control = headers.get('Cache-Control', '').lower()
+    return 'no-store' not in cache_control and 'private' not in cache_control
+
+
+# One cache per gateway worker process, shared by the sync and async proxies
+movie_cache = ResponseCache(
+    max_entries=Config.INVENTORY_CACHE_MAX_ENTRIES,
+    ttl=Config.INVENTORY_CACHE_TTL,
+    max_entry_bytes=Config.INVENTORY_CACHE_MAX_ENTRY_BYTES
+) if Config.INVENTORY_CACHE_ENABLED else None
+
+
+def _cache_samples(*keys):
+    def collect():
+        if movie_cache is None:
+            return []
+        stats = movie_cache.stats()
+        return [((label,), stats[key]) for key, label in keys]
+    return collect
+
+
+Callback('movie_cache_lookups', 'Movie response cache lookups', 'counter', ('result',),
+         _cache_samples(('hits', 'hit'), ('misses', 'miss')))
+Callback('movie_cache_entries', 'Responses held by the movie response cache', 'gauge', (),
+         lambda: [((), movie_cache.stats()['entries'])] if movie_cache is not None else [])
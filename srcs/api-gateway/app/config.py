@@ -7,10 +7,86 @@ load_dotenv()
 # Configuration settings
 class Config:
     INVENTORY_API_URL = os.getenv('INVENTORY_API_URL', 'http://localhost:8080')
+    # Upstream HTTP client: keep-alive pool per worker and timeouts in seconds
+    UPSTREAM_POOL_CONNECTIONS = int(os.getenv('UPSTREAM_POOL_CONNECTIONS', 4))
+    UPSTREAM_POOL_MAXSIZE = int(os.getenv('UPSTREAM_POOL_MAXSIZE', 32))
+    UPSTREAM_POOL_BLOCK = os.getenv('UPSTREAM_POOL_BLOCK', 'False').lower() in ['true', '1', 'yes']
+    UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+    UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', 30))
+    UPSTREAM_STREAM_CHUNK_SIZE = int(os.getenv('UPSTREAM_STREAM_CHUNK_SIZE', 64 * 1024))
+    # Share one upstream call between identical concurrent GET /api/movies* requests
+    INVENTORY_COALESCE_ENABLED = os.getenv('INVENTORY_COALESCE_ENABLED', 'True').lower() in ['true', '1', 'yes']
+    INVENTORY_COALESCE_MAX_BYTES = int(os.getenv('INVENTORY_COALESCE_MAX_BYTES', 4 * 1024 * 1024))
+    # Load shedding: max concurrent calls per upstream, beyond which the gateway answers 503
+    INVENTORY_MAX_CONCURRENCY = int(os.getenv('INVENTORY_MAX_CONCURRENCY', 64))
+    RABBITMQ_MAX_CONCURRENCY = int(os.getenv('RABBITMQ_MAX_CONCURRENCY', 64))
+    # Circuit breaker per upstream: opens after N consecutive failures, probes again after the reset timeout
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+    BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', 10))
+    BREAKER_HALF_OPEN_MAX_CALLS = int(os.getenv('BREAKER_HALF_OPEN_MAX_CALLS', 1))
+    # Gateway-side LRU cache for GET /api/movies* responses
+    INVENTORY_CACHE_ENABLED = os.getenv('INVENTORY_CACHE_ENABLED', 'True').lower() in ['true', '1', 'yes']
+    INVENTORY_CACHE_MAX_ENTRIES = int(os.getenv('INVENTORY_CACHE_MAX_ENTRIES', 1024))
+    INVENTORY_CACHE_TTL = float(os.getenv('INVENTORY_CACHE_TTL', 5))
+    INVENTORY_CACHE_MAX_ENTRY_BYTES = int(os.getenv('INVENTORY_CACHE_MAX_ENTRY_BYTES', 1024 * 1024))
     RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'localhost')
+    RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT', 5672))
+    RABBITMQ_USER = os.getenv('RABBITMQ_USER', 'guest')
+    RABBITMQ_PASSWORD = os.getenv('RABBITMQ_PASSWORD', 'guest')
     RABBITMQ_QUEUE = os.getenv('RABBITMQ_QUEUE', 'billing_queue')
+    RABBITMQ_HEARTBEAT = int(os.getenv('RABBITMQ_HEARTBEAT', 60))
+    # Publisher pool: long-lived connections per worker and channels per connection
+    RABBITMQ_POOL_SIZE = int(os.getenv('RABBITMQ_POOL_SIZE', 1))
+    RABBITMQ_CHANNELS_PER_CONNECTION = int(os.getenv('RABBITMQ_CHANNELS_PER_CONNECTION', 4))
+    # Publisher confirms: 'none', 'message' (wait per message) or 'window' (async, bounded)
+    RABBITMQ_CONFIRM_MODE = os.getenv('RABBITMQ_CONFIRM_MODE', 'message').lower()
+    RABBITMQ_CONFIRM_WINDOW = int(os.getenv('RABBITMQ_CONFIRM_WINDOW', 1000))
+    RABBITMQ_PUBLISH_TIMEOUT = float(os.getenv('RABBITMQ_PUBLISH_TIMEOUT', 5))
+    # Local write-ahead spool: acknowledge billing orders once fsynced to disk and
+    # forward them to RabbitMQ in the background
+    SPOOL_ENABLED = os.getenv('SPOOL_ENABLED', 'False').lower() in ['true', '1', 'yes']
+    SPOOL_DIR = os.getenv('SPOOL_DIR', 'logs/spool')
+    SPOOL_SEGMENT_BYTES = int(os.getenv('SPOOL_SEGMENT_BYTES', 64 * 1024 * 1024))
+    SPOOL_MAX_BYTES = int(os.getenv('SPOOL_MAX_BYTES', 1024 * 1024 * 1024))
+    SPOOL_FSYNC_INTERVAL_MS = float(os.getenv('SPOOL_FSYNC_INTERVAL_MS', 5))
+    SPOOL_DRAIN_BATCH = int(os.getenv('SPOOL_DRAIN_BATCH', 500))
+    # Upper bound on orders accepted by POST /api/billing/batch
+    BILLING_BATCH_MAX_ITEMS = int(os.getenv('BILLING_BATCH_MAX_ITEMS', 10000))
     API_GATEWAY_PORT = int(os.getenv('API_GATEWAY_PORT', 3000))
     DEBUG = os.getenv('DEBUG', 'False').lower() in ['true', '1', 'yes']
     # Server configuration
+    # 'sync' serves the Flask app, 'async' the aiohttp app from app.async_app
+    SERVER_MODE = os.getenv('GATEWAY_SERVER_MODE', 'sync').lower()
+    # Largest request body the async server accepts (batch billing uploads)
+    ASYNC_MAX_BODY_SIZE = int(os.getenv('ASYNC_MAX_BODY_SIZE', 64 * 1024 * 1024))
+
+    # Request tracing: fraction of requests whose spans are exported (callers
+    # can force it with X-Trace-Sampled), where to ('none', 'file', 'log' or
+    # 'module:factory') and whether responses carry Server-Timing
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.0))
+    TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'file')
+    TRACE_FILE = os.getenv('TRACE_FILE', '/tmp/gateway-traces.jsonl')
+    SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'True').lower() in ['true', '1', 'yes']
+
+    # Production serving with gunicorn (see gunicorn.conf.py): worker
+    # processes (0: 2 x CPUs + 1), threads per worker, keep-alive seconds,
+    # and requests after which a worker is replaced (plus random jitter)
+    GUNICORN_WORKERS = int(os.getenv('GUNICORN_WORKERS', 0))
+    GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', 4))
+    GUNICORN_KEEPALIVE = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+    GUNICORN_MAX_REQUESTS = int(os.getenv('GUNICORN_MAX_REQUESTS', 10000))
+    GUNICORN_MAX_REQUESTS_JITTER = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+    # Seconds a silent worker is allowed before it is killed, and seconds a
+    # stopping worker gets to finish its requests
+    GUNICORN_TIMEOUT = int(os.getenv('GUNICORN_TIMEOUT', 60))
+    GUNICORN_GRACEFUL_TIMEOUT = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+    # Build the app once in the master and fork it into the workers
+    GUNICORN_PRELOAD = os.getenv('GUNICORN_PRELOAD', 'True').lower() in ['true', '1', 'yes']
+    # Access log destination ('-' for stdout); off when empty
+    GUNICORN_ACCESS_LOG = os.getenv('GUNICORN_ACCESS_LOG', '')
+    # Seconds between the metrics snapshots through which every worker's
+    # /metrics also serves the other workers' samples
+    GUNICORN_METRICS_SNAPSHOT_SECONDS = float(os.getenv('GUNICORN_METRICS_SNAPSHOT_SECONDS', 5))
+
     HOST = os.getenv('HOST', '0.0.0.0')
     PORT = int(os.getenv('API_GATEWAY_PORT', 3000))
\ No newline at end of file
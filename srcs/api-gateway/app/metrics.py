@@ -0,0 +1,452 @@
+"""
+Prometheus metrics without a client library.
+
+Copied verbatim into every service (see the top-level README); keep the
+copies in step. Under gunicorn each worker process has its own registry;
+share_across_workers() lets any of them serve all the workers' samples.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; suits request latencies from a millisecond to a few seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Fold the values of finished threads once this many per-thread shards exist
+_MAX_SHARDS = 64
+
+
+class _Shards:
+    """
+    Per-thread value arrays, summed when metrics are scraped.
+
+    Every thread writes only to its own array, so recording needs neither a
+    lock nor an allocation once the thread's array exists. The values of
+    threads that have finished are folded into one array so that servers
+    running a thread per request do not accumulate arrays.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = [0] * size
+
+    def mine(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = [0] * self.size
+            with self._lock:
+                if len(self._shards) >= _MAX_SHARDS:
+                    self._fold()
+                self._shards.append((threading.current_thread(), values))
+            self._local.values = values
+            return values
+
+    def _fold(self):
+        live = []
+        for thread, values in self._shards:
+            if thread.is_alive():
+                live.append((thread, values))
+            else:
+                for index, value in enumerate(values):
+                    self._retired[index] += value
+        self._shards = live
+
+    def totals(self):
+        with self._lock:
+            self._fold()
+            totals = list(self._retired)
+            shards = [values for _, values in self._shards]
+        for values in shards:
+            for index, value in enumerate(values):
+                totals[index] += value
+        return totals
+
+
+class _CounterChild:
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount=1):
+        self._shards.mine()[0] += amount
+
+    def samples(self, name):
+        yield name + '_total', (), self._shards.totals()[0]
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._shards = _Shards(1)
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        self._shards.mine()[0] += amount
+
+    def dec(self, amount=1):
+        self._shards.mine()[0] -= amount
+
+    def samples(self, name):
+        yield name, (), self._value + self._shards.totals()[0]
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._bounds = buckets
+        # One count per bucket, one for +Inf, then the sum
+        self._shards = _Shards(len(buckets) + 2)
+
+    def observe(self, value):
+        values = self._shards.mine()
+        values[bisect.bisect_left(self._bounds, value)] += 1
+        values[-1] += value
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self, name):
+        totals = self._shards.totals()
+        cumulative = 0
+        for bound, count in zip(self._bounds + (float('inf'),), totals):
+            cumulative += count
+            yield name + '_bucket', (('le', _format_value(bound)),), cumulative
+        yield name + '_count', (), cumulative
+        yield name + '_sum', (), totals[-1]
+
+
+class _Timer:
+    """Context manager that observes the seconds spent in its block."""
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._started)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values):
+        """
+        The child for these label values, created on first use.
+
+        Callers on a hot path keep the child instead of looking it up for
+        every observation.
+        """
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            labels = tuple(zip(self.labelnames, values))
+            for name, extra, value in child.samples(self.name):
+                yield name, labels + extra, value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._children[()].set(value)
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def dec(self, amount=1):
+        self._children[()].dec(amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+
+class Callback(_Metric):
+    """
+    Metric whose values are read when it is scraped.
+
+    collect() returns (label values, value) pairs. Suits numbers that are
+    already kept elsewhere (pool usage, cache counters), at no cost
+    between scrapes.
+    """
+
+    def __init__(self, name, documentation, kind, labelnames, collect, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._collect = collect
+        (registry or REGISTRY).register(self)
+
+    def samples(self):
+        name = self.name + '_total' if self.kind == 'counter' else self.name
+        for values, value in self._collect():
+            yield name, tuple(zip(self.labelnames, values)), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._workers = None
+
+    def register(self, metric):
+        # Re-registering a name (e.g. a second create_app()) replaces it
+        with self._lock:
+            self._metrics[metric.name] = metric
+
+    def collect(self):
+        """(family, kind, documentation, samples) of every metric, sorted by name."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        families = []
+        for metric in metrics:
+            family = metric.name + '_total' if metric.kind == 'counter' else metric.name
+            families.append((family, metric.kind, metric.documentation, list(metric.samples())))
+        return families
+
+    def exposition(self):
+        """Every metric in the Prometheus text exposition format."""
+        families = self.collect()
+        if self._workers is not None:
+            families = self._workers.merge(families)
+        lines = []
+        for family, kind, documentation, samples in families:
+            lines.append(f'# HELP {family} {_escape_help(documentation)}')
+            lines.append(f'# TYPE {family} {kind}')
+            for name, labels, value in samples:
+                if labels:
+                    rendered = ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels)
+                    lines.append(f'{name}{{{rendered}}} {_format_value(value)}')
+                else:
+                    lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def share_across_workers(self, directory, worker, interval=5.0):
+        """
+        Serve the metrics of every worker process from any of them.
+
+        Each worker writes its samples to `directory` every `interval`
+        seconds; exposition() adds the other workers' latest snapshots to
+        this process's live samples, every sample labelled with its worker.
+        """
+        self._workers = _WorkerSnapshots(self, directory, str(worker), interval)
+        self._workers.start()
+
+
+class _WorkerSnapshots:
+    """The snapshot files that the worker processes of one server share."""
+
+    def __init__(self, registry, directory, worker, interval):
+        self.registry = registry
+        self.directory = directory
+        self.worker = worker
+        self.interval = interval
+
+    def path(self, worker):
+        return os.path.join(self.directory, f'{worker}.json')
+
+    def start(self):
+        self.write()
+        threading.Thread(target=self._write_forever, name='metrics-snapshot', daemon=True).start()
+
+    def _write_forever(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except OSError as e:
+                logger.warning(f"Writing the metrics snapshot failed: {e}")
+
+    def write(self):
+        # Written aside and renamed, so readers never see half a snapshot
+        path = self.path(self.worker)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.registry.collect(), file)
+        os.replace(path + '.tmp', path)
+
+    def merge(self, families):
+        merged = {}
+        for family, kind, documentation, samples in families:
+            merged[family] = (kind, documentation, self._labelled(self.worker, samples))
+        for worker, snapshot in self._others():
+            for family, kind, documentation, samples in snapshot:
+                samples = self._labelled(worker, [(name, tuple(map(tuple, labels)), value)
+                                                  for name, labels, value in samples])
+                if family in merged:
+                    merged[family][2].extend(samples)
+                else:
+                    merged[family] = (kind, documentation, samples)
+        return [(family, *merged[family]) for family in sorted(merged)]
+
+    def _others(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            worker, extension = os.path.splitext(name)
+            if extension != '.json' or worker == self.worker:
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    yield worker, json.load(file)
+            except (OSError, ValueError):
+                # The worker just exited and its file was removed
+                continue
+
+    @staticmethod
+    def _labelled(worker, samples):
+        return [(name, (('worker', worker),) + labels, value) for name, labels, value in samples]
+
+
+def forget_worker(directory, worker):
+    """Drop the snapshot of a worker that exited, so its series stop being served."""
+    try:
+        os.remove(os.path.join(directory, f'{worker}.json'))
+    except FileNotFoundError:
+        pass
+
+
+REGISTRY = Registry()
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+# HTTP metrics shared by every service
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route',
+    ('method', 'route', 'status')
+)
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests being handled')
+
+
+def init_metrics(app):
+    """Record request latency and in-flight requests of a Flask app, and serve /metrics."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.get('metrics_started')
+        if started is not None:
+            # The rule, not the path, so ids do not multiply the series
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            REQUEST_DURATION.labels(request.method, route, str(response.status_code)).observe(
+                time.perf_counter() - started
+            )
+        return response
+
+    @app.teardown_request
+    def end_request(exc):
+        if g.pop('metrics_started', None) is not None:
+            REQUESTS_IN_FLIGHT.dec()
+
+    def metrics():
+        return Response(REGISTRY.exposition(), mimetype=CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """Serve /metrics from a daemon thread, for processes without a web app."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    return server
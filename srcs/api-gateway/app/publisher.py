@@ -0,0 +1,429 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import pika
+from pika.spec import Basic
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+CONFIRM_NONE = 'none'
+CONFIRM_MESSAGE = 'message'
+CONFIRM_WINDOW = 'window'
+CONFIRM_MODES = (CONFIRM_NONE, CONFIRM_MESSAGE, CONFIRM_WINDOW)
+
+# Epoch milliseconds at which the gateway published a billing message; the
+# consumer measures its processing lag from it
+PUBLISHED_AT_HEADER = 'x-published-at'
+
+
+def published_at_headers():
+    return {PUBLISHED_AT_HEADER: int(time.time() * 1000)}
+
+
+class PublishError(Exception):
+    """Raised when a message could not be handed to (or confirmed by) RabbitMQ."""
+
+
+class ConnectionLost(PublishError):
+    """Raised for messages that were in flight when the connection dropped."""
+
+
+class _ChannelState:
+    """Book-keeping for one open channel: next delivery tag and unconfirmed messages."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.next_tag = 1
+        self.pending = {}
+
+
+class _Link:
+    """
+    One long-lived AMQP connection and its channels.
+
+    The connection is a pika SelectConnection driven by a dedicated I/O thread,
+    so callers on any thread hand messages over with add_callback_threadsafe and
+    get a Future back that is resolved by the broker's publisher confirm.
+    """
+
+    def __init__(self, publisher, index):
+        self._publisher = publisher
+        self._index = index
+        self._connection = None
+        self._channels = []
+        self._rr = 0
+        self._ready = threading.Event()
+        self._opened = False
+        self._declared = False
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name=f'rabbitmq-publisher-{index}', daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def wait_ready(self, timeout):
+        return self._ready.wait(timeout)
+
+    def submit(self, body, properties, future):
+        self.submit_many([(body, properties)], [future])
+
+    def submit_many(self, messages, futures):
+        """Hand a list of (body, properties) over to the I/O thread in one callback."""
+        connection = self._connection
+        if connection is None or not self._ready.is_set():
+            for future in futures:
+                future.set_exception(ConnectionLost('Not connected to RabbitMQ'))
+            return
+        try:
+            connection.ioloop.add_callback_threadsafe(
+                lambda: self._do_publish_many(messages, futures)
+            )
+        except Exception as e:
+            for future in futures:
+                future.set_exception(ConnectionLost(str(e)))
+
+    def stop(self):
+        self._stopping = True
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(self._close)
+            except Exception:
+                pass
+        self._thread.join(timeout=5)
+
+    # -- I/O thread -------------------------------------------------------
+
+    def _run(self):
+        delay = self._publisher.reconnect_delay
+        while not self._stopping:
+            self._opened = False
+            self._connection = pika.SelectConnection(
+                self._publisher.parameters,
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_error,
+                on_close_callback=self._on_connection_closed,
+            )
+            try:
+                self._connection.ioloop.start()
+            except Exception as e:
+                logger.error(f"RabbitMQ publisher I/O loop crashed: {e}")
+            self._fail_pending(ConnectionLost('Connection to RabbitMQ lost'))
+            self._connection = None
+            if self._opened:
+                delay = self._publisher.reconnect_delay
+            if not self._stopping:
+                time.sleep(delay)
+                delay = min(delay * 2, self._publisher.reconnect_max_delay)
+
+    def _on_connection_open(self, connection):
+        self._opened = True
+        self._declared = False
+        self._channels = []
+        for _ in range(self._publisher.channels_per_connection):
+            connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_error(self, connection, error):
+        logger.error(f"Could not connect to RabbitMQ: {error}")
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        self._ready.clear()
+        if not self._stopping:
+            logger.warning(f"RabbitMQ publisher connection closed: {reason}")
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        state = _ChannelState(channel)
+        channel.add_on_close_callback(lambda ch, reason: self._on_channel_closed(state, reason))
+        if self._publisher.confirm_mode != CONFIRM_NONE:
+            channel.confirm_delivery(lambda frame: self._on_confirm(state, frame))
+        # The queue only needs declaring once per connection, not per message
+        if not self._declared:
+            self._declared = True
+            channel.queue_declare(
+                queue=self._publisher.queue,
+                durable=True,
+                callback=lambda frame: self._on_queue_declared(state),
+            )
+        else:
+            self._add_channel(state)
+
+    def _on_queue_declared(self, state):
+        self._add_channel(state)
+
+    def _add_channel(self, state):
+        self._channels.append(state)
+        if len(self._channels) == self._publisher.channels_per_connection:
+            self._ready.set()
+
+    def _on_channel_closed(self, state, reason):
+        logger.warning(f"RabbitMQ publisher channel closed: {reason}")
+        self._fail_channel(state, ConnectionLost(f'Channel closed: {reason}'))
+        if state in self._channels:
+            self._channels.remove(state)
+        # A channel closed by the broker takes its confirms with it; start over
+        # on a fresh connection rather than running with a short pool.
+        if self._connection is not None and self._connection.is_open and not self._stopping:
+            self._ready.clear()
+            self._connection.close()
+
+    def _do_publish_many(self, messages, futures):
+        if not self._channels:
+            for future in futures:
+                future.set_exception(ConnectionLost('No open channel to RabbitMQ'))
+            return
+        # A batch stays on one channel so the broker can confirm it with a
+        # single multiple=True ack
+        state = self._channels[self._rr % len(self._channels)]
+        self._rr += 1
+        for (body, properties), future in zip(messages, futures):
+            try:
+                state.channel.basic_publish(
+                    exchange='',
+                    routing_key=self._publisher.queue,
+                    body=body,
+                    properties=properties,
+                )
+            except Exception as e:
+                future.set_exception(PublishError(str(e)))
+                continue
+            if self._publisher.confirm_mode == CONFIRM_NONE:
+                future.set_result(None)
+            else:
+                state.pending[state.next_tag] = future
+                state.next_tag += 1
+
+    def _on_confirm(self, state, frame):
+        method = frame.method
+        nacked = isinstance(method, Basic.Nack)
+        if method.multiple:
+            tags = [tag for tag in state.pending if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        for tag in tags:
+            future = state.pending.pop(tag, None)
+            if future is None:
+                continue
+            if nacked:
+                future.set_exception(PublishError('Message was nacked by RabbitMQ'))
+            else:
+                future.set_result(None)
+
+    def _fail_channel(self, state, error):
+        pending, state.pending = state.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _fail_pending(self, error):
+        for state in self._channels:
+            self._fail_channel(state, error)
+        self._channels = []
+
+    def _close(self):
+        self._ready.clear()
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+        elif self._connection is not None:
+            self._connection.ioloop.stop()
+
+
+class RabbitPublisher:
+    """
+    Pooled, long-lived RabbitMQ publisher.
+
+    Keeps `pool_size` connections with `channels_per_connection` channels each
+    open for the lifetime of the worker process and reconnects on its own when
+    the broker goes away. The confirm mode decides what publish() waits for:
+
+    - 'none':    no publisher confirms; returns once the frame is written.
+    - 'message': waits for the broker to confirm each message.
+    - 'window':  returns immediately while fewer than `confirm_window` messages
+                 are unconfirmed, and blocks only once the window is full.
+    """
+
+    def __init__(self, parameters, queue, pool_size=1, channels_per_connection=1,
+                 confirm_mode=CONFIRM_MESSAGE, confirm_window=1000, timeout=5.0,
+                 reconnect_delay=0.5, reconnect_max_delay=10.0):
+        if confirm_mode not in CONFIRM_MODES:
+            raise ValueError(f"Unknown confirm mode: {confirm_mode}")
+        self.parameters = parameters
+        self.queue = queue
+        self.channels_per_connection = max(1, channels_per_connection)
+        self.confirm_mode = confirm_mode
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self._window_size = max(1, confirm_window)
+        self._window = threading.BoundedSemaphore(self._window_size)
+        self._links = [_Link(self, i) for i in range(max(1, pool_size))]
+        self._next_link = itertools.cycle(self._links)
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                for link in self._links:
+                    link.start()
+                self._started = True
+        return self
+
+    def close(self, timeout=0):
+        """
+        Close every connection.
+
+        In 'window' mode, first waits up to timeout seconds for the broker
+        to confirm the messages still in flight, so that a worker shutting
+        down does not lose them.
+        """
+        if self.confirm_mode == CONFIRM_WINDOW and timeout > 0:
+            deadline = time.monotonic() + timeout
+            taken = 0
+            while taken < self._window_size and self._window.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                taken += 1
+            for _ in range(taken):
+                self._window.release()
+            if taken < self._window_size:
+                logger.warning(f"Closing with {self._window_size - taken} billing message(s) unconfirmed")
+        for link in self._links:
+            link.stop()
+
+    def publish(self, body, properties=None):
+        """
+        Publish one message to the configured queue.
+
+        Returns a Future that resolves once the broker has confirmed the
+        message. In 'message' and 'none' modes the Future is already resolved
+        when this returns; errors are raised as PublishError.
+        """
+        if properties is None:
+            properties = pika.BasicProperties(delivery_mode=2)
+        try:
+            return self._publish(body, properties)
+        except ConnectionLost:
+            # The connection dropped under us; one transparent retry on a
+            # freshly (re)connected link before giving up.
+            return self._publish(body, properties)
+
+    def _publish(self, body, properties):
+        with self._lock:
+            link = next(self._next_link)
+        if not link.wait_ready(self.timeout):
+            raise ConnectionLost('Timed out waiting for a RabbitMQ connection')
+
+        future = Future()
+        if self.confirm_mode == CONFIRM_WINDOW:
+            if not self._window.acquire(timeout=self.timeout):
+                raise PublishError('Too many unconfirmed messages in flight')
+            future.add_done_callback(self._on_window_done)
+
+        link.submit(body, properties, future)
+
+        if self.confirm_mode != CONFIRM_WINDOW:
+            try:
+                future.result(self.timeout)
+            except FutureTimeoutError:
+                raise PublishError('Timed out waiting for RabbitMQ to confirm the message')
+        return future
+
+    def publish_batch(self, bodies, properties=None):
+        """
+        Publish many messages in one publish-and-confirm cycle.
+
+        All messages go out on one channel in a single hand-over to the I/O
+        thread, and the call waits for every confirm regardless of the confirm
+        mode, so the caller gets a definite outcome per message. properties
+        is either shared by all messages or a list with one entry per message.
+        Returns a list with None for each confirmed message and the exception
+        for each failed one, in input order.
+        """
+        if not bodies:
+            return []
+        if properties is None:
+            properties = pika.BasicProperties(delivery_mode=2)
+        if not isinstance(properties, list):
+            properties = [properties] * len(bodies)
+
+        with self._lock:
+            link = next(self._next_link)
+        if not link.wait_ready(self.timeout):
+            raise ConnectionLost('Timed out waiting for a RabbitMQ connection')
+
+        futures = [Future() for _ in bodies]
+        link.submit_many(list(zip(bodies, properties)), futures)
+
+        deadline = time.monotonic() + self.timeout
+        results = []
+        for future in futures:
+            try:
+                future.result(max(0, deadline - time.monotonic()))
+                results.append(None)
+            except FutureTimeoutError:
+                results.append(PublishError('Timed out waiting for RabbitMQ to confirm the message'))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _on_window_done(self, future):
+        self._window.release()
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Unconfirmed billing message lost: {error}")
+
+
+_publisher = None
+_publisher_pid = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher():
+    """
+    Return this worker process's publisher, creating it on first use.
+
+    The publisher owns sockets and threads, so it is recreated if the process
+    has been forked since it was built.
+    """
+    global _publisher, _publisher_pid
+    pid = os.getpid()
+    if _publisher is not None and _publisher_pid == pid:
+        return _publisher
+    with _publisher_lock:
+        if _publisher is None or _publisher_pid != pid:
+            credentials = pika.PlainCredentials(Config.RABBITMQ_USER, Config.RABBITMQ_PASSWORD)
+            parameters = pika.ConnectionParameters(
+                host=Config.RABBITMQ_HOST,
+                port=Config.RABBITMQ_PORT,
+                credentials=credentials,
+                heartbeat=Config.RABBITMQ_HEARTBEAT,
+                blocked_connection_timeout=Config.RABBITMQ_PUBLISH_TIMEOUT,
+            )
+            _publisher = RabbitPublisher(
+                parameters,
+                queue=Config.RABBITMQ_QUEUE,
+                pool_size=Config.RABBITMQ_POOL_SIZE,
+                channels_per_connection=Config.RABBITMQ_CHANNELS_PER_CONNECTION,
+                confirm_mode=Config.RABBITMQ_CONFIRM_MODE,
+                confirm_window=Config.RABBITMQ_CONFIRM_WINDOW,
+                timeout=Config.RABBITMQ_PUBLISH_TIMEOUT,
+            ).start()
+            _publisher_pid = pid
+    return _publisher
+
+
+def close_publisher(timeout=0):
+    """Close this worker process's publisher, if it has one (see RabbitPublisher.close)."""
+    global _publisher
+    with _publisher_lock:
+        if _publisher is not None and _publisher_pid == os.getpid():
+            _publisher.close(timeout)
+        _publisher = None
@@ -0,0 +1,200 @@
+import threading
+import time
+
+from app.config import Config
+from app.metrics import Callback, Histogram
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+UPSTREAM_CALL_DURATION = Histogram(
+    'upstream_call_duration_seconds',
+    'Duration of calls to upstream services and the broker, from acquire() to release()',
+    ('upstream', 'outcome')
+)
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when a call is shed before reaching the upstream."""
+
+    def __init__(self, upstream, reason, retry_after=1):
+        super().__init__(f"{upstream} unavailable: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        return {
+            "error": f"{self.upstream} unavailable",
+            "details": self.reason
+        }
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker with half-open probing.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    are rejected for `reset_timeout` seconds. It then lets up to
+    `half_open_max_calls` probe calls through; a successful probe closes the
+    circuit again and a failed one re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0, half_open_max_calls=1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.opened_count = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def allow(self):
+        """Return True if a call may go ahead now."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            return False
+
+    def retry_after(self):
+        """Seconds until the circuit will let a probe through."""
+        with self._lock:
+            if self._state != OPEN:
+                return 1
+            return max(1, int(self.reset_timeout - (time.monotonic() - self._opened_at)) + 1)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            state = self._current_state()
+            if state == HALF_OPEN or (state == CLOSED and self._failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self.opened_count += 1
+
+
+class UpstreamGuard:
+    """
+    Concurrency limit plus circuit breaker in front of one upstream.
+
+    acquire() never waits: once `max_concurrency` calls are in flight, or
+    while the circuit is open, it raises UpstreamUnavailable straight away so
+    the gateway can answer 503 instead of queueing workers behind a slow
+    upstream. Every successful acquire() must be paired with release(); the
+    time between the two is recorded as the duration of the call.
+    """
+
+    def __init__(self, name, max_concurrency, breaker, label):
+        self.name = name
+        self.label = label
+        self._ok_duration = UPSTREAM_CALL_DURATION.labels(label, 'ok')
+        self._error_duration = UPSTREAM_CALL_DURATION.labels(label, 'error')
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.rejected_concurrency = 0
+        self.rejected_open = 0
+        self.failures = 0
+
+    def acquire(self):
+        """Take a slot; returns the start time to hand back to release()."""
+        with self._lock:
+            if self._in_flight >= self.max_concurrency:
+                self.rejected_concurrency += 1
+                raise UpstreamUnavailable(self.name, 'too many concurrent requests')
+            self._in_flight += 1
+        if not self.breaker.allow():
+            with self._lock:
+                self._in_flight -= 1
+                self.rejected_open += 1
+            raise UpstreamUnavailable(self.name, 'circuit open', self.breaker.retry_after())
+        return time.perf_counter()
+
+    def release(self, ok, started=None):
+        """Give the slot back and tell the breaker whether the call succeeded."""
+        if started is not None:
+            (self._ok_duration if ok else self._error_duration).observe(time.perf_counter() - started)
+        with self._lock:
+            self._in_flight -= 1
+            if not ok:
+                self.failures += 1
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def stats(self):
+        with self._lock:
+            in_flight = self._in_flight
+            rejected_concurrency = self.rejected_concurrency
+            rejected_open = self.rejected_open
+            failures = self.failures
+        return {
+            'state': self.breaker.state,
+            'in_flight': in_flight,
+            'max_concurrency': self.max_concurrency,
+            'rejected_concurrency': rejected_concurrency,
+            'rejected_circuit_open': rejected_open,
+            'failures': failures,
+            'circuit_opened': self.breaker.opened_count
+        }
+
+
+def is_upstream_failure(status_code):
+    """5xx answers from an upstream count against its circuit."""
+    return status_code >= 500
+
+
+def _guard(name, max_concurrency, label):
+    return UpstreamGuard(name, max_concurrency, CircuitBreaker(
+        failure_threshold=Config.BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=Config.BREAKER_RESET_TIMEOUT,
+        half_open_max_calls=Config.BREAKER_HALF_OPEN_MAX_CALLS
+    ), label)
+
+
+inventory_guard = _guard('Inventory API', Config.INVENTORY_MAX_CONCURRENCY, 'inventory')
+rabbitmq_guard = _guard('RabbitMQ', Config.RABBITMQ_MAX_CONCURRENCY, 'rabbitmq')
+
+
+def _guard_samples(*keys):
+    def collect():
+        for guard in (inventory_guard, rabbitmq_guard):
+            stats = guard.stats()
+            for key in keys:
+                yield (guard.label,) + key[1:], stats[key[0]]
+    return collect
+
+
+Callback('upstream_in_flight', 'Calls in flight per upstream', 'gauge', ('upstream',),
+         _guard_samples(('in_flight',)))
+Callback('upstream_rejected', 'Calls shed before reaching the upstream', 'counter', ('upstream', 'reason'),
+         _guard_samples(('rejected_concurrency', 'concurrency'), ('rejected_circuit_open', 'circuit_open')))
+Callback('upstream_failures', 'Calls that failed or got a 5xx answer', 'counter', ('upstream',),
+         _guard_samples(('failures',)))
+Callback('upstream_circuit_opened', 'Times the circuit breaker opened', 'counter', ('upstream',),
+         _guard_samples(('circuit_opened',)))
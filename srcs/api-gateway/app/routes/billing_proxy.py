@@ -1,10 +1,49 @@
 import json
+import uuid
 import pika
 from flask import Blueprint, request, jsonify
 from app.config import Config
+from app.publisher import get_publisher, published_at_headers
+from app.resilience import UpstreamUnavailable, rabbitmq_guard
+from app.spool import SpoolUnavailable, get_spool
+from app.tracing import AMQP_SAMPLED_HEADER, message_trace, span
 
 bp = Blueprint('billing_proxy', __name__)
 
+REQUIRED_FIELDS = ['user_id', 'number_of_items', 'total_amount']
+
+# A client retrying POST /api/billing with the same key gets the same message
+# id, so billing-app stores the order only once
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_NAMESPACE = uuid.UUID('6f1c7a52-3a8e-4d8e-9a57-2f0b6c1d9e41')
+
+def new_message_id(idempotency_key=None):
+    """
+    Message id billing-app deduplicates orders on
+    """
+    if idempotency_key:
+        return str(uuid.uuid5(IDEMPOTENCY_NAMESPACE, idempotency_key))
+    return str(uuid.uuid4())
+
+class ParseError(str):
+    """Placeholder for an NDJSON line that is not valid JSON"""
+
+def validate_billing_data(billing_data):
+    """
+    Return an error message for an invalid order, or None if it is valid
+    """
+    if not billing_data:
+        return "No data provided"
+
+    if not isinstance(billing_data, dict):
+        return "Order must be a JSON object"
+
+    for field in REQUIRED_FIELDS:
+        if field not in billing_data:
+            return f"Missing required field: {field}"
+
+    return None
+
 @bp.route('/api/billing', methods=['POST'])
 def proxy_billing():
     """
@@ -13,53 +52,238 @@ def proxy_billing():
     try:
         # Get the request data
         billing_data = request.get_json()
-        
-        if not billing_data:
-            return jsonify({"error": "No data provided"}), 400
-        
+
         # Validate required fields
-        required_fields = ['user_id', 'number_of_items', 'total_amount']
-        for field in required_fields:
-            if field not in billing_data:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
-        
+        error = validate_billing_data(billing_data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        message_id = new_message_id(request.headers.get(IDEMPOTENCY_HEADER))
+
+        # With the spool on, the order is acknowledged once it is on disk
+        # and forwarded to RabbitMQ in the background
+        if Config.SPOOL_ENABLED:
+            try:
+                correlation_id, trace_headers = message_trace()
+                with span('spool'):
+                    get_spool().append(json.dumps(billing_data).encode('utf-8'), message_id,
+                                       correlation_id, AMQP_SAMPLED_HEADER in trace_headers)
+            except SpoolUnavailable as e:
+                return shed_response(UpstreamUnavailable('Billing spool', str(e)))
+            return jsonify({"message": "Message posted to billing queue", "message_id": message_id}), 200
+
+        # Shed load straight away while the broker is struggling
+        try:
+            started = rabbitmq_guard.acquire()
+        except UpstreamUnavailable as e:
+            return shed_response(e)
+
         # Send the data to RabbitMQ
-        send_to_rabbitmq(billing_data)
-        
-        return jsonify({"message": "Message posted to billing queue"}), 200
-        
+        ok = False
+        try:
+            with span('rabbitmq'):
+                send_to_rabbitmq(billing_data, message_id)
+            ok = True
+        finally:
+            rabbitmq_guard.release(ok, started)
+
+        return jsonify({"message": "Message posted to billing queue", "message_id": message_id}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/api/billing/batch', methods=['POST'])
+def proxy_billing_batch():
+    """
+    Handle POST requests to /api/billing/batch.
+
+    Accepts a JSON array of orders, or NDJSON (one order per line) when the
+    Content-Type is application/x-ndjson. Valid orders are published in one
+    batched publish-and-confirm cycle; the response lists the outcome of
+    every item in input order.
+    """
+    try:
+        orders, error = parse_billing_batch(request.get_data(cache=False), request.mimetype)
+        if error:
+            return jsonify({"error": error}), 400
+
+        if len(orders) > Config.BILLING_BATCH_MAX_ITEMS:
+            return jsonify({
+                "error": f"Batch exceeds {Config.BILLING_BATCH_MAX_ITEMS} orders"
+            }), 413
+
+        results, valid = validate_billing_batch(orders)
+        message_ids = [new_message_id() for _ in valid]
+        if valid and Config.SPOOL_ENABLED:
+            try:
+                correlation_id, trace_headers = message_trace()
+                with span('spool'):
+                    get_spool().append_many(
+                        [json.dumps(orders[index]).encode('utf-8') for index in valid], message_ids,
+                        correlation_id, AMQP_SAMPLED_HEADER in trace_headers
+                    )
+            except SpoolUnavailable as e:
+                return shed_response(UpstreamUnavailable('Billing spool', str(e)))
+            record_batch_outcomes(results, valid, [None] * len(valid), message_ids)
+        elif valid:
+            try:
+                started = rabbitmq_guard.acquire()
+            except UpstreamUnavailable as e:
+                return shed_response(e)
+
+            outcomes = []
+            try:
+                with span('rabbitmq'):
+                    outcomes = send_batch_to_rabbitmq([orders[index] for index in valid], message_ids)
+            finally:
+                rabbitmq_guard.release(any(outcome is None for outcome in outcomes), started)
+            record_batch_outcomes(results, valid, outcomes, message_ids)
+
+        body, status = summarize_billing_batch(results)
+        return jsonify(body), status
+
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def send_to_rabbitmq(data):
+def shed_response(error):
     """
-    Send data to RabbitMQ queue
+    Fast 503 for an order rejected before reaching the broker or spool
+    """
+    resp = jsonify(error.to_dict())
+    resp.status_code = 503
+    resp.headers['Retry-After'] = str(error.retry_after)
+    return resp
+
+def validate_billing_batch(orders):
+    """
+    Validate every order of a batch.
+
+    Returns (results, valid) where results holds a rejection entry for each
+    invalid order (None elsewhere) and valid lists the indexes to publish.
+    """
+    results = [None] * len(orders)
+    valid = []
+    for index, order in enumerate(orders):
+        item_error = order if isinstance(order, ParseError) else validate_billing_data(order)
+        if item_error:
+            results[index] = {"index": index, "status": "rejected", "error": str(item_error)}
+        else:
+            valid.append(index)
+    return results, valid
+
+def record_batch_outcomes(results, valid, outcomes, message_ids):
+    """
+    Fill in the publish outcome (None or an error) of each valid order
+    """
+    for index, outcome, message_id in zip(valid, outcomes, message_ids):
+        if outcome is None:
+            results[index] = {"index": index, "status": "queued", "message_id": message_id}
+        else:
+            results[index] = {"index": index, "status": "failed", "error": str(outcome)}
+
+def summarize_billing_batch(results):
+    """
+    Build the batch response body and status code from per-item results
+    """
+    queued = sum(1 for result in results if result["status"] == "queued")
+    rejected = sum(1 for result in results if result["status"] == "rejected")
+    body = {
+        "queued": queued,
+        "rejected": rejected,
+        "failed": len(results) - queued - rejected,
+        "results": results
+    }
+    if queued == len(results):
+        status = 200
+    elif queued:
+        # 207 Multi-Status when only some of the orders made it to the queue
+        status = 207
+    elif rejected == len(results):
+        # Nothing was accepted and resending the same batch cannot help
+        status = 400
+    else:
+        # Nothing was accepted because publishing failed; worth retrying
+        status = 503
+    return body, status
+
+def parse_billing_batch(raw, mimetype):
+    """
+    Parse a request body as a JSON array or as NDJSON.
+
+    Returns (orders, error). An unparseable NDJSON line becomes a ParseError
+    entry so it is reported per item instead of failing the whole batch.
+    """
+    content_type = (mimetype or '').lower()
+
+    if content_type in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        orders = []
+        for line in raw.splitlines():
+            if not line.strip():
+                continue
+            try:
+                orders.append(json.loads(line))
+            except ValueError as e:
+                orders.append(ParseError(f"Invalid JSON: {e}"))
+        if not orders:
+            return None, "No data provided"
+        return orders, None
+
+    try:
+        orders = json.loads(raw) if raw else None
+    except ValueError as e:
+        return None, f"Invalid JSON: {e}"
+
+    if not orders:
+        return None, "No data provided"
+    if not isinstance(orders, list):
+        return None, "Expected a JSON array of orders"
+    return orders, None
+
+def send_to_rabbitmq(data, message_id):
+    """
+    Send data to RabbitMQ queue through the worker's pooled publisher
     """
     try:
         # Convert the data to a JSON string
         message = json.dumps(data)
-        
-        # Connect to RabbitMQ
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host=Config.RABBITMQ_HOST)
-        )
-        channel = connection.channel()
-        
-        # Declare the queue (creates it if it doesn't exist)
-        channel.queue_declare(queue=Config.RABBITMQ_QUEUE, durable=True)
-        
-        # Publish the message
-        channel.basic_publish(
-            exchange='',
-            routing_key=Config.RABBITMQ_QUEUE,
-            body=message,
+        correlation_id, trace_headers = message_trace()
+
+        # Publish the message over a long-lived connection; the queue has
+        # already been declared when the connection was opened
+        get_publisher().publish(
+            message,
             properties=pika.BasicProperties(
                 delivery_mode=2,  # Make message persistent
+                message_id=message_id,
+                correlation_id=correlation_id,
+                headers=dict(published_at_headers(), **trace_headers)
             )
         )
-        
-        # Close the connection
-        connection.close()
-        
+
+    except Exception as e:
+        raise Exception(f"Failed to send message to RabbitMQ: {str(e)}")
+
+def send_batch_to_rabbitmq(items, message_ids):
+    """
+    Send many orders to RabbitMQ in one publish-and-confirm cycle.
+
+    Returns None for each confirmed order and the error for each failed one.
+    """
+    messages = [json.dumps(item) for item in items]
+    correlation_id, trace_headers = message_trace()
+    try:
+        return get_publisher().publish_batch(
+            messages,
+            properties=[
+                pika.BasicProperties(
+                    delivery_mode=2,  # Make message persistent
+                    message_id=message_id,
+                    correlation_id=correlation_id,
+                    headers=dict(published_at_headers(), **trace_headers)
+                )
+                for message_id in message_ids
+            ]
+        )
     except Exception as e:
-        raise Exception(f"Failed to send message to RabbitMQ: {str(e)}")
\ No newline at end of file
+        error = Exception(f"Failed to send message to RabbitMQ: {str(e)}")
+        return [error] * len(messages)
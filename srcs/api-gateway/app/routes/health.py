@@ -1,5 +1,9 @@
 from flask import Blueprint, jsonify
 from datetime import datetime
+from app.cache import movie_cache
+from app.routes.inventory_proxy import inflight_reads
+from app.resilience import inventory_guard, rabbitmq_guard
+from app.spool import spool_stats
 
 health_bp = Blueprint('health', __name__)
 
@@ -17,4 +21,23 @@ def health_check():
             'status': 'unhealthy',
             'timestamp': datetime.utcnow().isoformat(),
             'error': str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+@health_bp.route('/health/cache', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters of the gateway's movie response cache and read coalescing"""
+    stats = {'enabled': False}
+    if movie_cache is not None:
+        stats = dict(enabled=True, **movie_cache.stats())
+    stats['coalescing'] = inflight_reads.stats()
+    return jsonify(stats), 200
+
+
+@health_bp.route('/health/upstreams', methods=['GET'])
+def upstream_stats():
+    """Circuit breaker state and load-shedding counters per upstream"""
+    return jsonify({
+        'inventory': inventory_guard.stats(),
+        'rabbitmq': rabbitmq_guard.stats(),
+        'spool': spool_stats()
+    }), 200
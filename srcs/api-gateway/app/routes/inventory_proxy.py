@@ -1,26 +1,193 @@
 import requests
-from flask import Blueprint, request, Response
+from flask import Blueprint, request, Response, jsonify
 from app.config import Config
+from app.cache import CachedResponse, ResponseCache, movie_cache, is_cacheable, is_conditional, reads_own_writes
+from app.singleflight import SingleFlight
+from app.resilience import UpstreamUnavailable, inventory_guard, is_upstream_failure
+from app.upstream import (
+    get_session,
+    upstream_timeout,
+    forwardable_request_headers,
+    forwardable_response_headers,
+    replayable_headers,
+    with_trace_headers,
+)
+from app.tracing import span
 
 bp = Blueprint('inventory_proxy', __name__)
 
+# GET requests to the inventory API currently in flight in this worker
+inflight_reads = SingleFlight()
+
 @bp.route('/api/movies', methods=['GET', 'POST', 'DELETE'])
+@bp.route('/api/movies/bulk', methods=['POST', 'PUT', 'DELETE'], defaults={'id': 'bulk'})
 @bp.route('/api/movies/<id>', methods=['GET', 'PUT', 'DELETE'])
 def forward_to_inventory(id=None):
     url = f"{Config.INVENTORY_API_URL}/api/movies"
     if id:
         url += f"/{id}"
     
-    response = requests.request(
-        method=request.method,
-        url=url,
-        headers={key: value for key, value in request.headers if key != 'Host'},
-        data=request.get_data(),
-        cookies=request.cookies,
-        params=request.args
-    )
+    read_key = None
+    if (request.method == 'GET' and not is_conditional(request.headers)
+            and not reads_own_writes(request.cookies)
+            and (movie_cache is not None or Config.INVENTORY_COALESCE_ENABLED)):
+        read_key = ResponseCache.make_key(request.path, request.args.items(multi=True))
+    
+    # Serve reads from the gateway cache when possible
+    generation = None
+    if movie_cache is not None and read_key is not None:
+        generation = movie_cache.generation
+        cached = movie_cache.get(read_key)
+        if cached is not None:
+            return replay_response(cached, 'HIT')
+    
+    # Identical reads already on their way upstream are shared, not repeated
+    call = None
+    if Config.INVENTORY_COALESCE_ENABLED and read_key is not None:
+        call, leader = inflight_reads.begin(read_key, max_age=upstream_deadline())
+        if not leader:
+            shared = inflight_reads.wait(call, timeout=upstream_deadline())
+            if shared is not None:
+                return replay_response(shared, 'COALESCED')
+            # The leader had nothing shareable; make our own call
+            call = None
+    
+    try:
+        started = inventory_guard.acquire()
+    except UpstreamUnavailable as e:
+        if call is not None:
+            inflight_reads.finish(read_key, call, None)
+        return shed_response(e)
+    
+    try:
+        # Until the upstream's headers arrive; the body is streamed afterwards
+        with span('inventory'):
+            response = get_session().request(
+                method=request.method,
+                url=url,
+                headers=with_trace_headers(forwardable_request_headers(request.headers)),
+                data=request.get_data(),
+                cookies=request.cookies,
+                params=request.args,
+                timeout=upstream_timeout(),
+                stream=True
+            )
+    except requests.exceptions.RequestException as e:
+        inventory_guard.release(ok=False, started=started)
+        if call is not None:
+            inflight_reads.finish(read_key, call, None)
+        return jsonify({
+            "error": "Error connecting to Inventory API",
+            "details": str(e)
+        }), 503
+    
+    # Writes make cached listings and the touched movie stale
+    if movie_cache is not None and request.method != 'GET':
+        movie_cache.invalidate_write(request.method, request.path)
     
-    return response.content, response.status_code
+    # The concurrency slot is held until the body has been relayed
+    def on_close(upstream_ok):
+        inventory_guard.release(ok=upstream_ok and not is_upstream_failure(response.status_code), started=started)
+    
+    if read_key is None:
+        return stream_upstream_response(response, on_close=on_close)
+    
+    status = response.status_code
+    headers = replayable_headers(forwardable_response_headers(response.headers))
+    cacheable = movie_cache is not None and is_cacheable(status, response.headers)
+    
+    def on_finish(body):
+        shared = None
+        if body is not None:
+            shared = CachedResponse(status, headers, body, None)
+            if cacheable:
+                movie_cache.put(read_key, status, headers, body, generation=generation)
+        if call is not None:
+            inflight_reads.finish(read_key, call, shared)
+    
+    limit = Config.INVENTORY_COALESCE_MAX_BYTES if call is not None else 0
+    if cacheable:
+        limit = max(limit, Config.INVENTORY_CACHE_MAX_ENTRY_BYTES)
+    
+    resp = stream_upstream_response(response, on_finish, limit, on_close)
+    resp.headers['X-Cache'] = 'MISS'
+    return resp
+
+
+def upstream_deadline():
+    """Longest a read can reasonably take upstream, in seconds"""
+    return Config.UPSTREAM_CONNECT_TIMEOUT + Config.UPSTREAM_READ_TIMEOUT
+
+
+def shed_response(error):
+    """Fast 503 for a call rejected before reaching the upstream"""
+    resp = jsonify(error.to_dict())
+    resp.status_code = 503
+    resp.headers['Retry-After'] = str(error.retry_after)
+    return resp
+
+
+def replay_response(cached, source):
+    """Build a response from a buffered upstream response"""
+    resp = Response(cached.body, status=cached.status, headers=cached.headers)
+    resp.headers['X-Cache'] = source
+    return resp
+
+
+def stream_upstream_response(response, on_finish=None, collect_limit=0, on_close=None):
+    """
+    Relay an upstream response chunk by chunk with its status and headers.
+
+    The body is passed through undecoded, so Content-Encoding and
+    Content-Length stay valid, and the connection goes back to the pool once
+    the last chunk has been sent. If on_finish is given, the chunks are also
+    collected up to collect_limit bytes, and on_finish is called exactly once
+    with the whole body, or with None if the body was larger than the limit
+    or was not relayed completely. on_close is called exactly once with
+    False if reading from the upstream failed and True otherwise (a caller
+    hanging up early is not the upstream's fault).
+    """
+    finished = []
+    
+    def finish(body, upstream_ok=True):
+        if finished:
+            return
+        finished.append(True)
+        if on_finish is not None:
+            on_finish(body)
+        if on_close is not None:
+            on_close(upstream_ok)
+    
+    def generate():
+        collected = [] if on_finish is not None else None
+        size = 0
+        try:
+            for chunk in response.raw.stream(Config.UPSTREAM_STREAM_CHUNK_SIZE, decode_content=False):
+                if collected is not None:
+                    size += len(chunk)
+                    if size > collect_limit:
+                        collected = None
+                    else:
+                        collected.append(chunk)
+                yield chunk
+        except Exception:
+            finish(None, upstream_ok=False)
+            raise
+        else:
+            finish(b''.join(collected) if collected is not None else None)
+        finally:
+            response.close()
+            finish(None)
+    
+    resp = Response(
+        generate(),
+        status=response.status_code,
+        headers=forwardable_response_headers(response.headers),
+        direct_passthrough=True
+    )
+    # Covers responses that are closed before their body is ever iterated
+    resp.call_on_close(lambda: (response.close(), finish(None)))
+    return resp
 
 
 # @bp.route('/api/movies', methods=['GET', 'POST', 'DELETE'])
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+
+class _Call:
+    """One in-flight upstream call that other requests may wait on."""
+
+    __slots__ = ('event', 'result', 'started')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.started = time.monotonic()
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls across threads.
+
+    The first caller for a key becomes the leader and performs the call;
+    callers arriving while it is in flight wait for the leader's result
+    instead of issuing their own. A leader that cannot produce a shareable
+    result finishes with None and its followers fall back to calling
+    upstream themselves.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def begin(self, key, max_age=None):
+        """
+        Return (call, is_leader) for key.
+
+        A call older than max_age seconds is treated as abandoned and a new
+        leader takes over, so a leader that never finishes cannot block a key.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and max_age is not None and time.monotonic() - call.started > max_age:
+                call = None
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = _Call()
+            self._calls[key] = call
+            self.leaders += 1
+            return call, True
+
+    def wait(self, call, timeout=None):
+        """Block until the leader finishes; returns its result or None."""
+        if not call.event.wait(timeout):
+            return None
+        return call.result
+
+    def finish(self, key, call, result):
+        """Publish the leader's result (None if it is not shareable)."""
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.result = result
+        call.event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced
+            }
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines running on one event loop."""
+
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def begin(self, key):
+        """Return (future, is_leader) for key."""
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future, False
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.leaders += 1
+        return future, True
+
+    async def wait(self, future, timeout=None):
+        """Wait for the leader to finish; returns its result or None."""
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def finish(self, key, future, result):
+        """Publish the leader's result (None if it is not shareable)."""
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.done():
+            future.set_result(result)
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced
+        }
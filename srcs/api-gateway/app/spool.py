@@ -0,0 +1,698 @@
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+import pika
+
+from app.config import Config
+from app.metrics import Callback
+from app.publisher import PUBLISHED_AT_HEADER
+from app.tracing import AMQP_SAMPLED_HEADER
+
+logger = logging.getLogger(__name__)
+
+# Record layout: body length and CRC32 of the body, then the body: 16-byte
+# message id, accept time (epoch ms), trace-sampled flag, length of the
+# correlation id, the correlation id and the payload
+RECORD_HEADER = struct.Struct('>II')
+RECORD_META = struct.Struct('>16sQBB')
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+OFFSET_FILE = 'drained.json'
+LOCK_FILE = '.lock'
+QUARANTINE_DIR = 'quarantine'
+# Each worker's spool is SPOOL_DIR/spool-<n>
+SPOOL_PREFIX = 'spool-'
+
+
+class SpoolUnavailable(Exception):
+    """The spool cannot accept records; the order should be refused (503)."""
+
+
+class SpoolFull(SpoolUnavailable):
+    """Raised when the spool holds more undrained data than it is allowed to."""
+
+
+class SpoolClosed(SpoolUnavailable):
+    """Raised on appends to a spool that was closed (its worker is stopping)."""
+
+
+class SpoolSyncFailed(SpoolUnavailable):
+    """Raised when records could not be fsynced, so they may not be on disk."""
+
+
+def _segment_name(seq):
+    return f"{SEGMENT_PREFIX}{seq:020d}{SEGMENT_SUFFIX}"
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _pack_record(message_id, payload, correlation_id, accepted_at, sampled):
+    correlation = (correlation_id or '').encode('ascii')[:255]
+    body = RECORD_META.pack(message_id.bytes, accepted_at, 1 if sampled else 0, len(correlation)) + correlation + payload
+    return RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def _valid_record_at(data, offset):
+    """Whether a complete record with a matching checksum starts at data[offset:]."""
+    if len(data) - offset < RECORD_HEADER.size:
+        return False
+    length, crc = RECORD_HEADER.unpack_from(data, offset)
+    body = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+    return len(body) == length and length >= RECORD_META.size and zlib.crc32(body) == crc
+
+
+class SpooledRecord:
+    """A record read back from the spool, with the position just after it."""
+
+    __slots__ = ('position', 'message_id', 'payload', 'correlation_id', 'accepted_at', 'sampled')
+
+    def __init__(self, position, body):
+        id_bytes, accepted_at, sampled, correlation_length = RECORD_META.unpack_from(body)
+        start = RECORD_META.size + correlation_length
+        self.position = position
+        self.message_id = str(uuid.UUID(bytes=id_bytes))
+        self.correlation_id = body[RECORD_META.size:start].decode('ascii') or None
+        self.accepted_at = accepted_at
+        self.sampled = bool(sampled)
+        self.payload = body[start:]
+
+    def properties(self):
+        """AMQP properties as if the order had been published when it was accepted."""
+        headers = {PUBLISHED_AT_HEADER: self.accepted_at}
+        if self.sampled:
+            headers[AMQP_SAMPLED_HEADER] = 1
+        return pika.BasicProperties(
+            delivery_mode=2,
+            message_id=self.message_id,
+            correlation_id=self.correlation_id,
+            headers=headers
+        )
+
+
+class Spool:
+    """
+    Durable append-only log of accepted billing messages.
+
+    Records are appended to numbered segment files. Appenders are acknowledged
+    only once their record has been fsynced, but fsyncs are batched: a
+    flusher thread syncs whatever has been written every `fsync_interval`
+    seconds, so concurrent appends share one fsync. The position up to which
+    records have been forwarded to RabbitMQ is kept in drained.json, and
+    segments behind it are deleted.
+
+    A spool directory is owned by one process at a time (flock), so a
+    restarted worker picks up where the previous owner stopped. Records
+    that were published but not yet checkpointed when a process died are
+    published again; they carry the same message_id, and billing-app's
+    dedup index is what keeps them from being stored twice.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024,
+                 max_bytes=1024 * 1024 * 1024, fsync_interval=0.005):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self._lock_fd = None
+        self._write_lock = threading.Lock()
+        self._synced = threading.Condition()
+        self._fd = None
+        self._segment = 0
+        self._offset = 0
+        self._synced_pos = (0, 0)
+        self._written_pos = (0, 0)
+        self._drained_pos = (0, 0)
+        self._pending_bytes = 0
+        self._closed = False
+        self._sync_error = None
+        self._flusher = None
+        self.quarantined = 0
+
+    # -- lifecycle --------------------------------------------------------
+
+    def try_lock(self):
+        """Take ownership of the directory; returns False if another process has it."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def open(self):
+        """Recover state from disk and start the fsync flusher."""
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segments()
+        self._drained_pos = self._read_drained()
+        if segments:
+            last = segments[-1]
+            self._segment = last
+            self._offset = self._recover_tail(last)
+        else:
+            self._segment = max(self._drained_pos[0], 1)
+            self._offset = 0
+        # Segments that were fully drained before a crash may still be there
+        for seq in segments:
+            if seq < self._drained_pos[0]:
+                self._remove_segment(seq)
+        self._fd = os.open(
+            os.path.join(self.directory, _segment_name(self._segment)),
+            os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+        )
+        os.ftruncate(self._fd, self._offset)
+        self._written_pos = self._synced_pos = (self._segment, self._offset)
+        if self._drained_pos < (self._segments()[0], 0):
+            self._drained_pos = (self._segments()[0], 0)
+        self._pending_bytes = self._bytes_between(self._drained_pos, self._written_pos)
+        self._flusher = threading.Thread(target=self._flush_loop, name='spool-flusher', daemon=True)
+        self._flusher.start()
+        return self
+
+    def close(self):
+        self._closed = True
+        if self._flusher is not None:
+            self._flusher.join(timeout=1)
+        with self._write_lock:
+            if self._fd is not None:
+                try:
+                    os.fsync(self._fd)
+                except OSError as e:
+                    self._fail_sync(e)
+                os.close(self._fd)
+                self._fd = None
+            target = self._written_pos
+        # Release the appenders still waiting for the flusher
+        with self._synced:
+            if self._sync_error is None:
+                self._synced_pos = target
+            self._synced.notify_all()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    # -- appending --------------------------------------------------------
+
+    def append_many(self, payloads, message_ids=None, correlation_id=None, sampled=False):
+        """
+        Durably append payloads (bytes) and return their message ids.
+
+        message_ids, if given, are the ids (UUID strings) to publish the
+        payloads under; otherwise new ones are generated. The correlation id
+        (the request id), the trace sampling decision and the time of the
+        append are kept with each record and restored when it is published.
+        Blocks until the records are fsynced. Raises SpoolFull when the
+        undrained backlog is over the configured limit, SpoolClosed once the
+        spool is closed and SpoolSyncFailed when the records could not be
+        fsynced.
+        """
+        if self._pending_bytes >= self.max_bytes:
+            raise SpoolFull('Billing spool is full')
+        accepted_at = int(time.time() * 1000)
+        ids = []
+        with self._write_lock:
+            if self._closed or self._fd is None:
+                raise SpoolClosed('Billing spool is closed')
+            if self._sync_error is not None:
+                raise SpoolSyncFailed(f'Billing spool cannot sync: {self._sync_error}')
+            try:
+                for index, payload in enumerate(payloads):
+                    message_id = uuid.UUID(message_ids[index]) if message_ids else uuid.uuid4()
+                    record = _pack_record(message_id, payload, correlation_id, accepted_at, sampled)
+                    if self._offset and self._offset + len(record) > self.segment_bytes:
+                        self._roll()
+                    os.write(self._fd, record)
+                    self._offset += len(record)
+                    self._pending_bytes += len(record)
+                    ids.append(str(message_id))
+            except OSError as e:
+                self._fail_sync(e)
+                raise SpoolSyncFailed(f'Billing spool cannot write: {e}')
+            target = self._written_pos = (self._segment, self._offset)
+        with self._synced:
+            while self._synced_pos < target:
+                if self._sync_error is not None:
+                    raise SpoolSyncFailed(f'Billing spool cannot sync: {self._sync_error}')
+                self._synced.wait()
+        return ids
+
+    def append(self, payload, message_id=None, correlation_id=None, sampled=False):
+        return self.append_many([payload], [message_id] if message_id else None, correlation_id, sampled)[0]
+
+    def _roll(self):
+        """Close the full segment and continue in a new one (write lock held)."""
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._segment += 1
+        self._offset = 0
+        self._fd = os.open(
+            os.path.join(self.directory, _segment_name(self._segment)),
+            os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+        )
+        _fsync_dir(self.directory)
+
+    def _flush_loop(self):
+        while not self._closed and self._sync_error is None:
+            time.sleep(self.fsync_interval)
+            with self._write_lock:
+                target = self._written_pos
+                fd = self._fd
+            if target == self._synced_pos or fd is None:
+                continue
+            # fsync outside the write lock so appends keep flowing meanwhile
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                with self._write_lock:
+                    rolled = self._segment != target[0]
+                # The segment was rolled (or closed) in between, and
+                # _roll() or close() synced it before closing the fd
+                if not rolled and not self._closed:
+                    self._fail_sync(e)
+                    return
+            with self._synced:
+                self._synced_pos = target
+                self._synced.notify_all()
+
+    def _fail_sync(self, error):
+        """
+        Refuse every waiting and later append after a failed fsync.
+
+        The kernel may have dropped the unsynced pages, so a later fsync
+        succeeding would not prove those records are on disk.
+        """
+        logger.error(f"Billing spool fsync failed, refusing new orders: {error}")
+        with self._synced:
+            self._sync_error = error
+            self._synced.notify_all()
+
+    # -- draining ---------------------------------------------------------
+
+    @property
+    def pending_bytes(self):
+        return self._pending_bytes
+
+    def read_batch(self, max_records):
+        """
+        Read up to max_records fsynced, undrained records in order.
+
+        Returns a list of SpooledRecord. A record
+        that fails its checksum ends the batch; once it is the next record
+        to drain it is moved to the quarantine directory (see _quarantine)
+        and reading carries on behind it.
+        """
+        with self._synced:
+            limit = self._synced_pos
+        records = []
+        segment, offset = self._drained_pos
+        while len(records) < max_records and (segment, offset) < limit:
+            path = os.path.join(self.directory, _segment_name(segment))
+            end = limit[1] if segment == limit[0] else None
+            corrupt = False
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    while len(records) < max_records and (end is None or offset < end):
+                        header = f.read(RECORD_HEADER.size)
+                        if len(header) < RECORD_HEADER.size:
+                            break
+                        length, crc = RECORD_HEADER.unpack(header)
+                        body = f.read(length)
+                        if len(body) < length or length < RECORD_META.size or zlib.crc32(body) != crc:
+                            corrupt = True
+                            break
+                        offset += RECORD_HEADER.size + length
+                        records.append(SpooledRecord((segment, offset), body))
+            except FileNotFoundError:
+                pass
+            if corrupt:
+                if records:
+                    break
+                segment, offset = self._quarantine(segment, offset, end)
+                continue
+            if len(records) >= max_records or segment >= limit[0]:
+                break
+            # Reached the end of a finished segment; carry on in the next one
+            segment, offset = segment + 1, 0
+        return records
+
+    def _quarantine(self, segment, offset, end):
+        """
+        Move the corrupt record at (segment, offset) out of the drain path.
+
+        The checksum does not cover the length field, so the record alone is
+        quarantined only if a valid record (or the end of the data) follows
+        where its length says; otherwise everything up to end (or the end of
+        the segment) is. The bytes are fsynced to quarantine/ for inspection
+        and replay before the drained position moves past them, and the
+        billing_spool_quarantined counter goes up. Returns the new position.
+        """
+        path = os.path.join(self.directory, _segment_name(segment))
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(-1 if end is None else end - offset)
+        size = len(data)
+        if size >= RECORD_HEADER.size:
+            following = RECORD_HEADER.size + RECORD_HEADER.unpack_from(data)[0]
+            if following == size or (following < size and _valid_record_at(data, following)):
+                size = following
+
+        self._save_quarantined(segment, offset, data[:size])
+        position = (segment, offset + size)
+        self.commit(position)
+        return position
+
+    def _save_quarantined(self, segment, offset, data):
+        """Durably copy corrupt bytes found at (segment, offset) to quarantine/."""
+        directory = os.path.join(self.directory, QUARANTINE_DIR)
+        os.makedirs(directory, exist_ok=True)
+        target = os.path.join(directory, f"{_segment_name(segment)}.{offset}")
+        with open(target, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        _fsync_dir(directory)
+        self.quarantined += 1
+        logger.error(f"Corrupt billing spool record in {self.directory} at segment {segment}, "
+                     f"offset {offset}; moved {len(data)} bytes to {target}")
+
+    def commit(self, position):
+        """Record that everything before position has been published."""
+        if position <= self._drained_pos:
+            return
+        previous = self._drained_pos
+        tmp = os.path.join(self.directory, OFFSET_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'segment': position[0], 'offset': position[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.directory, OFFSET_FILE))
+        _fsync_dir(self.directory)
+        drained = self._bytes_between(previous, position)
+        with self._write_lock:
+            self._drained_pos = position
+            self._pending_bytes = max(0, self._pending_bytes - drained)
+        for seq in range(previous[0], position[0]):
+            self._remove_segment(seq)
+
+    # -- recovery helpers -------------------------------------------------
+
+    def _segments(self):
+        seqs = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                seqs.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+        return sorted(seqs)
+
+    def _read_drained(self):
+        try:
+            with open(os.path.join(self.directory, OFFSET_FILE)) as f:
+                data = json.load(f)
+            return (int(data['segment']), int(data['offset']))
+        except (FileNotFoundError, ValueError, KeyError):
+            return (0, 0)
+
+    def _recover_tail(self, seq):
+        """
+        Return the end of the last intact record, dropping a torn write.
+
+        A short record at the end was never fsynced, so never acknowledged,
+        and is dropped. A complete record that fails its checksum is left in
+        place for read_batch() to quarantine if a valid record follows it;
+        otherwise it and everything after it are quarantined before the
+        segment is truncated.
+        """
+        path = os.path.join(self.directory, _segment_name(seq))
+        offset = 0
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, crc = RECORD_HEADER.unpack(header)
+                body = f.read(length)
+                if len(body) < length:
+                    logger.warning(f"Dropping torn record at {path}:{offset}")
+                    break
+                following = offset + RECORD_HEADER.size + length
+                if length < RECORD_META.size or zlib.crc32(body) != crc:
+                    f.seek(offset)
+                    rest = f.read()
+                    if len(rest) == following - offset or _valid_record_at(rest, following - offset):
+                        f.seek(following)
+                    else:
+                        self._save_quarantined(seq, offset, rest)
+                        break
+                offset = following
+        return offset
+
+    def _remove_segment(self, seq):
+        try:
+            os.remove(os.path.join(self.directory, _segment_name(seq)))
+        except FileNotFoundError:
+            pass
+
+    def _bytes_between(self, start, end):
+        if end <= start:
+            return 0
+        total = 0
+        for seq in range(start[0], end[0] + 1):
+            path = os.path.join(self.directory, _segment_name(seq))
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            lo = start[1] if seq == start[0] else 0
+            hi = end[1] if seq == end[0] else size
+            total += max(0, hi - lo)
+        return total
+
+
+class SpoolDrainer:
+    """
+    Background thread forwarding spooled records to RabbitMQ in order.
+
+    Besides its own spool, the drainer adopts spool directories under the
+    same parent that no live process owns but that still hold records, for
+    example those of workers that are gone after a restart with fewer
+    workers. An adopted spool is released once it is empty.
+    """
+
+    def __init__(self, spool, publisher, batch_size=500, idle_interval=0.05,
+                 retry_delay=0.5, retry_max_delay=10.0, adopt_interval=30.0):
+        self.spool = spool
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self.idle_interval = idle_interval
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.adopt_interval = adopt_interval
+        self.adopted = []
+        self.published = 0
+        self.failures = 0
+        # Quarantined by adopted spools that have since been released
+        self.released_quarantined = 0
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='spool-drainer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join(timeout=5)
+        for spool in self.adopted:
+            spool.close()
+        self.adopted = []
+
+    def _run(self):
+        delay = self.retry_delay
+        next_adopt = 0.0
+        while not self._stopping.is_set():
+            if self.adopt_interval and time.monotonic() >= next_adopt:
+                self._adopt_orphans()
+                next_adopt = time.monotonic() + self.adopt_interval
+
+            busy = failed = False
+            for spool in [self.spool] + self.adopted:
+                records = spool.read_batch(self.batch_size)
+                if not records:
+                    if spool is not self.spool and not spool.pending_bytes:
+                        logger.info(f"Drained orphaned billing spool {spool.directory}")
+                        self.adopted.remove(spool)
+                        self.released_quarantined += spool.quarantined
+                        spool.close()
+                    continue
+                busy = True
+                if not self._drain(spool, records):
+                    failed = True
+                    break
+
+            if failed:
+                self.failures += 1
+                logger.error("Failed to drain billing spool to RabbitMQ, retrying")
+                self._stopping.wait(delay)
+                delay = min(delay * 2, self.retry_max_delay)
+            else:
+                delay = self.retry_delay
+                if not busy:
+                    self._stopping.wait(self.idle_interval)
+
+    def _drain(self, spool, records):
+        """Publish a batch of records; returns False unless all were confirmed."""
+        try:
+            outcomes = self.publisher.publish_batch(
+                [record.payload for record in records],
+                properties=[record.properties() for record in records]
+            )
+        except Exception as e:
+            outcomes = [e] * len(records)
+
+        # Only the confirmed prefix is committed, so order is kept and a
+        # failed record is retried before anything behind it
+        committed = None
+        for record, outcome in zip(records, outcomes):
+            if outcome is not None:
+                break
+            committed = record.position
+            self.published += 1
+        if committed is not None:
+            spool.commit(committed)
+        return committed == records[-1].position
+
+    def _adopt_orphans(self):
+        """Lock and start draining unowned spool directories that still hold records."""
+        parent = os.path.dirname(self.spool.directory)
+        owned = {spool.directory for spool in [self.spool] + self.adopted}
+        try:
+            names = sorted(os.listdir(parent))
+        except FileNotFoundError:
+            return
+        for name in names:
+            directory = os.path.join(parent, name)
+            if not name.startswith(SPOOL_PREFIX) or directory in owned or not os.path.isdir(directory):
+                continue
+            orphan = Spool(directory, segment_bytes=self.spool.segment_bytes,
+                           max_bytes=self.spool.max_bytes, fsync_interval=self.spool.fsync_interval)
+            if not orphan.try_lock():
+                continue
+            try:
+                orphan.open()
+            except OSError as e:
+                logger.error(f"Could not open orphaned billing spool {directory}: {e}")
+                orphan.close()
+                continue
+            if orphan.pending_bytes:
+                logger.warning(f"Adopting orphaned billing spool {directory} "
+                               f"({orphan.pending_bytes} bytes undrained)")
+                self.adopted.append(orphan)
+            else:
+                orphan.close()
+
+    def stats(self):
+        spools = [self.spool] + self.adopted
+        return {
+            'pending_bytes': sum(spool.pending_bytes for spool in spools),
+            'max_bytes': self.spool.max_bytes,
+            'published': self.published,
+            'failures': self.failures,
+            'quarantined': self.released_quarantined + sum(spool.quarantined for spool in spools),
+            'adopted': len(self.adopted)
+        }
+
+
+_spool = None
+_drainer = None
+_spool_pid = None
+_spool_lock = threading.Lock()
+
+
+def get_spool():
+    """
+    Return this worker process's spool, opening it and its drainer on first use.
+
+    Each worker takes the first free spool-<n> directory under SPOOL_DIR, so
+    spools left behind by stopped workers are drained by their successors;
+    any left over beyond the current number of workers are adopted by a
+    drainer (see SpoolDrainer).
+    """
+    global _spool, _drainer, _spool_pid
+    pid = os.getpid()
+    if _spool is not None and _spool_pid == pid:
+        return _spool
+    with _spool_lock:
+        if _spool is None or _spool_pid != pid:
+            from app.publisher import get_publisher
+
+            index = 0
+            while True:
+                spool = Spool(
+                    os.path.join(Config.SPOOL_DIR, f'{SPOOL_PREFIX}{index}'),
+                    segment_bytes=Config.SPOOL_SEGMENT_BYTES,
+                    max_bytes=Config.SPOOL_MAX_BYTES,
+                    fsync_interval=Config.SPOOL_FSYNC_INTERVAL_MS / 1000.0
+                )
+                if spool.try_lock():
+                    break
+                index += 1
+            _spool = spool.open()
+            _drainer = SpoolDrainer(
+                _spool, get_publisher(), batch_size=Config.SPOOL_DRAIN_BATCH
+            ).start()
+            _spool_pid = pid
+    return _spool
+
+
+def close_spool():
+    """
+    Stop this worker process's drainer and close its spool.
+
+    Records not yet drained stay on disk; the next worker to take the
+    spool directory publishes them.
+    """
+    global _spool, _drainer
+    with _spool_lock:
+        if _spool is not None and _spool_pid == os.getpid():
+            _drainer.stop()
+            _spool.close()
+        _spool = None
+        _drainer = None
+
+
+def spool_stats():
+    if _drainer is None or _spool_pid != os.getpid():
+        return {'enabled': Config.SPOOL_ENABLED, 'open': False}
+    return dict(enabled=True, open=True, **_drainer.stats())
+
+
+def _spool_samples(key):
+    def collect():
+        stats = spool_stats()
+        return [((), stats[key])] if stats.get('open') else []
+    return collect
+
+
+Callback('billing_spool_pending_bytes', 'Bytes of orders spooled but not yet confirmed by RabbitMQ', 'gauge', (),
+         _spool_samples('pending_bytes'))
+Callback('billing_spool_published', 'Spooled orders published to RabbitMQ', 'counter', (),
+         _spool_samples('published'))
+Callback('billing_spool_failures', 'Failed attempts to publish spooled orders', 'counter', (),
+         _spool_samples('failures'))
+Callback('billing_spool_quarantined', 'Corrupt spool records moved to quarantine instead of being published',
+         'counter', (), _spool_samples('quarantined'))
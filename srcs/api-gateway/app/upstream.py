@@ -0,0 +1,102 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.config import Config
+from app.tracing import REQUEST_ID_HEADER, current_trace
+
+# Headers that describe a single hop and must not be forwarded by a proxy
+HOP_BY_HOP_HEADERS = frozenset([
+    'connection',
+    'keep-alive',
+    'proxy-authenticate',
+    'proxy-authorization',
+    'te',
+    'trailers',
+    'transfer-encoding',
+    'upgrade',
+])
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return this worker process's pooled HTTP session for upstream services.
+
+    The session keeps connections to the upstreams alive between requests.
+    It is rebuilt after a fork so worker processes never share sockets.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=Config.UPSTREAM_POOL_CONNECTIONS,
+                pool_maxsize=Config.UPSTREAM_POOL_MAXSIZE,
+                pool_block=Config.UPSTREAM_POOL_BLOCK,
+                max_retries=0,
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            # The session is shared by every caller, so it must never keep
+            # cookies set by an upstream response; callers' cookies are
+            # forwarded per request instead
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            _session = session
+            _session_pid = pid
+    return _session
+
+
+def upstream_timeout():
+    """(connect, read) timeout tuple for upstream calls."""
+    return (Config.UPSTREAM_CONNECT_TIMEOUT, Config.UPSTREAM_READ_TIMEOUT)
+
+
+def forwardable_request_headers(headers):
+    """Copy incoming request headers, minus Host and hop-by-hop headers."""
+    return {
+        key: value for key, value in headers
+        if key.lower() != 'host' and key.lower() not in HOP_BY_HOP_HEADERS
+    }
+
+
+def with_trace_headers(headers):
+    """Request headers for an upstream call, carrying the current trace."""
+    trace = current_trace()
+    if trace is None:
+        return headers
+    propagated = trace.propagation_headers()
+    names = {key.lower() for key in propagated}
+    headers = {key: value for key, value in headers.items() if key.lower() not in names}
+    headers.update(propagated)
+    return headers
+
+
+def forwardable_response_headers(headers):
+    """Copy upstream response headers, minus hop-by-hop headers."""
+    return [
+        (key, value) for key, value in headers.items()
+        if key.lower() not in HOP_BY_HOP_HEADERS
+    ]
+
+
+def replayable_headers(headers):
+    """
+    Response headers to keep with a buffered response.
+
+    The request id and timings belong to the request that fetched it, not
+    to the requests it is later replayed to.
+    """
+    return [
+        (key, value) for key, value in headers
+        if key.lower() not in ('server-timing', REQUEST_ID_HEADER.lower())
+    ]
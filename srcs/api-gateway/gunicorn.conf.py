@@ -0,0 +1,83 @@
+"""
+gunicorn settings, read from the same environment as the app (app/config.py).
+
+    gunicorn --config gunicorn.conf.py
+
+TERM or INT stops gracefully: workers stop accepting connections and get
+GUNICORN_GRACEFUL_TIMEOUT seconds to finish their requests. HUP replaces
+every worker the same way, TTIN / TTOU add or remove a worker. With
+GUNICORN_PRELOAD the code is imported once in the master, so new code
+needs a restart (or USR2, then QUIT to the old master).
+"""
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from app.config import Config
+
+if Config.SERVER_MODE == 'async':
+    wsgi_app = 'app.async_app:create_async_app()'
+    worker_class = 'aiohttp.GunicornWebWorker'
+else:
+    wsgi_app = 'wsgi:app'
+    worker_class = 'gthread'
+    threads = Config.GUNICORN_THREADS
+bind = f'{Config.HOST}:{Config.PORT}'
+workers = Config.GUNICORN_WORKERS or multiprocessing.cpu_count() * 2 + 1
+keepalive = Config.GUNICORN_KEEPALIVE
+# Workers are replaced after this many requests, staggered by the jitter
+max_requests = Config.GUNICORN_MAX_REQUESTS
+max_requests_jitter = Config.GUNICORN_MAX_REQUESTS_JITTER
+timeout = Config.GUNICORN_TIMEOUT
+graceful_timeout = Config.GUNICORN_GRACEFUL_TIMEOUT
+preload_app = Config.GUNICORN_PRELOAD
+accesslog = Config.GUNICORN_ACCESS_LOG or None
+# Worker heartbeats and metrics snapshots in memory, not on a possibly slow
+# container filesystem
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Every worker keeps its own metrics. They share snapshots through this
+# directory, so /metrics, whichever worker answers, covers all of them with
+# a `worker` label (see app.metrics)
+metrics_dir = None
+
+# The upstream HTTP session, the RabbitMQ publisher and the spool are
+# created per process on first use (they check os.getpid()), so a forked
+# worker never shares the master's sockets or threads.
+
+
+def on_starting(server):
+    global metrics_dir
+    metrics_dir = tempfile.mkdtemp(prefix='gunicorn-metrics-', dir=worker_tmp_dir)
+
+
+def pre_fork(server, worker):
+    # The label is a slot that a replacement worker takes over, not the pid,
+    # so replacing workers does not multiply the series
+    taken = {other.metrics_slot for other in server.WORKERS.values()}
+    worker.metrics_slot = next(slot for slot in itertools.count() if slot not in taken)
+
+
+def post_fork(server, worker):
+    from app.metrics import REGISTRY
+    REGISTRY.share_across_workers(metrics_dir, worker.metrics_slot, Config.GUNICORN_METRICS_SNAPSHOT_SECONDS)
+
+
+def worker_exit(server, worker):
+    # Hand the spool back to disk and give in-flight publishes their confirms.
+    # The async server closes its publisher in its own cleanup.
+    from app.spool import close_spool
+    from app.publisher import close_publisher
+    close_spool()
+    close_publisher(Config.RABBITMQ_PUBLISH_TIMEOUT)
+
+
+def child_exit(server, worker):
+    from app.metrics import forget_worker
+    forget_worker(metrics_dir, worker.metrics_slot)
+
+
+def on_exit(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
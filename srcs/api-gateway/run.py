@@ -4,9 +4,19 @@ from app.config import Config
 app = create_app()
 
 if __name__ == '__main__':
-    # Use configuration from environment variables
-    app.run(
-        host=Config.HOST,
-        port=Config.PORT,
-        debug=Config.DEBUG
-    )
\ No newline at end of file
+    if Config.SERVER_MODE == 'async':
+        from aiohttp import web
+        from app.async_app import create_async_app
+
+        web.run_app(
+            create_async_app(),
+            host=Config.HOST,
+            port=Config.PORT
+        )
+    else:
+        # Use configuration from environment variables
+        app.run(
+            host=Config.HOST,
+            port=Config.PORT,
+            debug=Config.DEBUG
+        )
@@ -0,0 +1,144 @@
+import logging
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, Order, UserSummary, utcnow
+
+logger = logging.getLogger(__name__)
+
+# Columns GET /api/users/top can rank by
+RANKINGS = ('total_amount', 'order_count', 'total_items')
+
+UPSERT_DIALECTS = {'postgresql': postgresql, 'sqlite': sqlite}
+
+
+def order_insert():
+    """
+    INSERT for orders that skips rows whose message_id is already stored.
+
+    Returns (statement, returns_rows): where ON CONFLICT is available the
+    statement also RETURNs the orders it actually inserted, so duplicates
+    are not counted in the user summaries.
+    """
+    dialect = UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if dialect is None:
+        return db.insert(Order), False
+    stmt = (
+        dialect.insert(Order)
+        .on_conflict_do_nothing(index_elements=['message_id'])
+        .returning(Order.user_id, Order.number_of_items, Order.total_amount)
+    )
+    return stmt, True
+
+
+def summary_deltas(orders):
+    """Sum (user_id, number_of_items, total_amount) tuples per user."""
+    deltas = {}
+    for user_id, number_of_items, total_amount in orders:
+        delta = deltas.setdefault(user_id, [0, 0, 0.0])
+        delta[0] += 1
+        delta[1] += number_of_items
+        delta[2] += total_amount
+    return deltas
+
+
+def add_to_user_summaries(orders):
+    """
+    Add newly inserted orders to the summaries of their users.
+
+    One atomic upsert per user (INSERT ... ON CONFLICT DO UPDATE SET
+    x = x + excluded.x), so concurrent workers never lose an increment.
+    Users are handled in sorted order so two workers lock rows in the same
+    order and cannot deadlock. Runs in the caller's transaction.
+    """
+    deltas = summary_deltas(orders)
+    if not deltas:
+        return
+    now = utcnow()
+    rows = [
+        {'user_id': user_id, 'order_count': count, 'total_items': items,
+         'total_amount': amount, 'updated_at': now}
+        for user_id, (count, items, amount) in sorted(deltas.items())
+    ]
+    dialect = UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if dialect is not None:
+        stmt = dialect.insert(UserSummary)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id'],
+            set_={
+                'order_count': UserSummary.order_count + stmt.excluded.order_count,
+                'total_items': UserSummary.total_items + stmt.excluded.total_items,
+                'total_amount': UserSummary.total_amount + stmt.excluded.total_amount,
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        db.session.execute(stmt, rows)
+        return
+
+    # No upsert: increment in place, create the summaries that do not exist yet
+    for row in rows:
+        updated = db.session.execute(
+            db.update(UserSummary)
+            .where(UserSummary.user_id == row['user_id'])
+            .values(
+                order_count=UserSummary.order_count + row['order_count'],
+                total_items=UserSummary.total_items + row['total_items'],
+                total_amount=UserSummary.total_amount + row['total_amount'],
+                updated_at=row['updated_at']
+            )
+        ).rowcount
+        if not updated:
+            db.session.execute(db.insert(UserSummary), [row])
+
+
+def store_orders(rows):
+    """
+    Insert orders and update the user summaries in the current transaction.
+
+    Returns the number of orders actually inserted. The caller commits.
+    """
+    stmt, returns_rows = order_insert()
+    if returns_rows:
+        inserted = db.session.execute(stmt, rows).all()
+    else:
+        db.session.execute(stmt, rows)
+        inserted = [(row['user_id'], row['number_of_items'], row['total_amount']) for row in rows]
+    add_to_user_summaries(inserted)
+    return len(inserted)
+
+
+def backfill_user_summaries():
+    """
+    Build the summaries from the orders table when they do not exist yet.
+
+    Runs at startup so that orders stored before the summaries were
+    introduced are counted. Does nothing once any summary exists.
+    """
+    if db.session.execute(db.select(UserSummary.user_id).limit(1)).first() is not None:
+        return
+    if db.session.execute(db.select(Order.id).limit(1)).first() is None:
+        return
+    try:
+        db.session.execute(
+            db.insert(UserSummary).from_select(
+                ['user_id', 'order_count', 'total_items', 'total_amount', 'updated_at'],
+                db.select(
+                    Order.user_id, db.func.count(Order.id), db.func.sum(Order.number_of_items),
+                    db.func.sum(Order.total_amount), db.literal(utcnow(), db.DateTime)
+                ).group_by(Order.user_id)
+            )
+        )
+        db.session.commit()
+        logger.info("Built user summaries from existing orders")
+    except IntegrityError:
+        # Another process built them first
+        db.session.rollback()
+
+
+def top_users(by, limit):
+    """The limit users with the highest value of the by column."""
+    column = getattr(UserSummary, by)
+    return db.session.execute(
+        db.select(UserSummary).order_by(column.desc(), UserSummary.user_id).limit(limit)
+    ).scalars().all()
@@ -1,6 +1,12 @@
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
+from app.database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def utcnow():
+    """Current UTC time as a naive datetime, as stored in the database."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 class Order(db.Model):
     """Order model for storing order related details."""
@@ -10,11 +16,25 @@ class Order(db.Model):
     user_id = db.Column(db.String(50), nullable=False)
     number_of_items = db.Column(db.Integer, nullable=False)
     total_amount = db.Column(db.Float, nullable=False)
+    # Id of the billing message the order came from; unique so a redelivered
+    # message is never stored twice (NULL for messages sent without one)
+    message_id = db.Column(db.String(64), nullable=True, unique=True, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    # One user's orders in time order, for GET /api/orders?user_id=
+    __table_args__ = (
+        db.Index('ix_orders_user_id_created_at', 'user_id', 'created_at'),
+    )
 
-    def __init__(self, user_id, number_of_items, total_amount):
+    def __init__(self, user_id, number_of_items, total_amount, message_id=None):
         self.user_id = user_id
         self.number_of_items = number_of_items
         self.total_amount = total_amount
+        self.message_id = message_id
+
+    # The columns to_dict() returns, and so the default projection of the
+    # fast GET /api/orders path (message_id is internal)
+    DEFAULT_FIELDS = ('id', 'user_id', 'number_of_items', 'total_amount', 'created_at')
 
     def to_dict(self):
         """Convert the model instance to a dictionary."""
@@ -22,7 +42,8 @@ class Order(db.Model):
             'id': self.id,
             'user_id': self.user_id,
             'number_of_items': self.number_of_items,
-            'total_amount': self.total_amount
+            'total_amount': self.total_amount,
+            'created_at': self.created_at.isoformat() + 'Z' if self.created_at else None
         }
     
     @staticmethod
@@ -32,4 +53,29 @@ class Order(db.Model):
             user_id=data.get('user_id'),
             number_of_items=int(data.get('number_of_items', 0)),
             total_amount=float(data.get('total_amount', 0.0))
-        )
\ No newline at end of file
+        )
+
+class UserSummary(db.Model):
+    """
+    Running totals of the orders of one user.
+
+    Maintained by the consumer in the same transaction as the order insert,
+    so a summary never disagrees with the orders table.
+    """
+    __tablename__ = 'user_summaries'
+
+    user_id = db.Column(db.String(50), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    total_items = db.Column(db.Integer, nullable=False, default=0, index=True)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0, index=True)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def to_dict(self):
+        """Convert the model instance to a dictionary."""
+        return {
+            'user_id': self.user_id,
+            'order_count': self.order_count,
+            'total_items': self.total_items,
+            'total_amount': self.total_amount,
+            'updated_at': self.updated_at.isoformat() + 'Z'
+        }
@@ -0,0 +1,135 @@
+import time
+
+import pika
+from sqlalchemy.exc import DataError, IntegrityError
+
+# Header carrying how many times a message has already failed
+ATTEMPTS_HEADER = 'x-billing-attempts'
+# Headers added when a message is dead-lettered
+ERROR_HEADER = 'x-billing-error'
+FAILED_AT_HEADER = 'x-billing-failed-at'
+
+
+def retry_delays(config):
+    """
+    Delay in ms before each retry: the base delay, doubling every attempt,
+    capped at CONSUMER_RETRY_MAX_DELAY_MS. One entry per retry.
+    """
+    return [
+        min(config.CONSUMER_RETRY_BASE_DELAY_MS * 2 ** attempt, config.CONSUMER_RETRY_MAX_DELAY_MS)
+        for attempt in range(max(config.CONSUMER_MAX_ATTEMPTS - 1, 0))
+    ]
+
+
+def retry_queue_name(queue, delay_ms):
+    # The delay is part of the name: changing it declares a new queue
+    # instead of failing on a queue that already exists with another TTL
+    return f'{queue}.retry.{delay_ms}ms'
+
+
+def dead_letter_queue_name(queue):
+    return f'{queue}.dead'
+
+
+def declare_retry_topology(channel, queue, delays):
+    """
+    Declare the retry queues and the dead-letter queue for queue.
+
+    A retry queue has no consumers. Its messages expire after the queue's
+    TTL and the broker dead-letters them back into queue through the
+    default exchange. Every message in a retry queue has the same TTL, so
+    expiry order is arrival order and no message waits behind a longer one.
+    """
+    for delay_ms in sorted(set(delays)):
+        channel.queue_declare(
+            queue=retry_queue_name(queue, delay_ms),
+            durable=True,
+            arguments={
+                'x-message-ttl': delay_ms,
+                'x-dead-letter-exchange': '',
+                'x-dead-letter-routing-key': queue
+            }
+        )
+    channel.queue_declare(queue=dead_letter_queue_name(queue), durable=True)
+
+
+def is_permanent(error):
+    """
+    Whether storing the message would fail the same way on every retry.
+
+    Constraint violations (NOT NULL, CHECK, ...) and data errors (wrong
+    type, out of range, too long) depend only on the message. Connection,
+    lock and timeout errors are worth retrying.
+    """
+    return isinstance(error, (IntegrityError, DataError))
+
+
+def attempts(properties):
+    """How many times this message has failed before."""
+    headers = properties.headers or {}
+    try:
+        return int(headers.get(ATTEMPTS_HEADER, 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _properties(properties, headers):
+    return pika.BasicProperties(
+        content_type=properties.content_type,
+        delivery_mode=pika.DeliveryMode.Persistent,
+        message_id=properties.message_id,
+        correlation_id=properties.correlation_id,
+        timestamp=properties.timestamp,
+        headers=headers
+    )
+
+
+def retry_or_dead_letter(channel, queue, delays, properties, body, error):
+    """
+    Publish a failed message to its next retry queue, or to the dead-letter
+    queue once it has used up its retries. Returns the queue it went to.
+
+    The caller acks the original delivery afterwards. A crash in between
+    leaves two copies, which the message_id dedup stores only once.
+    """
+    failed = attempts(properties) + 1
+    headers = dict(properties.headers or {})
+    headers[ATTEMPTS_HEADER] = failed
+    if failed <= len(delays):
+        target = retry_queue_name(queue, delays[failed - 1])
+    else:
+        target = dead_letter_queue_name(queue)
+        headers[ERROR_HEADER] = str(error)[:1000]
+        headers[FAILED_AT_HEADER] = int(time.time())
+    channel.basic_publish(
+        exchange='',
+        routing_key=target,
+        body=body,
+        properties=_properties(properties, headers)
+    )
+    return target
+
+
+def dead_letter(channel, queue, properties, body, error):
+    """Publish a message that can never succeed straight to the dead-letter queue."""
+    headers = dict(properties.headers or {})
+    headers[ATTEMPTS_HEADER] = attempts(properties) + 1
+    headers[ERROR_HEADER] = str(error)[:1000]
+    headers[FAILED_AT_HEADER] = int(time.time())
+    channel.basic_publish(
+        exchange='',
+        routing_key=dead_letter_queue_name(queue),
+        body=body,
+        properties=_properties(properties, headers)
+    )
+
+
+def replay_properties(properties):
+    """Properties for sending a dead letter back to the main queue with fresh retries."""
+    headers = {
+        key: value for key, value in (properties.headers or {}).items()
+        if key not in (ATTEMPTS_HEADER, ERROR_HEADER, FAILED_AT_HEADER, 'x-death',
+                       'x-first-death-queue', 'x-first-death-reason', 'x-first-death-exchange',
+                       'x-last-death-queue', 'x-last-death-reason', 'x-last-death-exchange')
+    }
+    return _properties(properties, headers or None)
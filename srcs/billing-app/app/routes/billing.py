@@ -1,5 +1,10 @@
-from flask import Blueprint, jsonify
-from app.models import db, Order
+import base64
+import binascii
+from datetime import datetime, timezone
+from flask import Blueprint, request, jsonify, current_app
+from app.models import db, Order, UserSummary
+from app.aggregates import RANKINGS, top_users
+from app.serialization import json_response, parse_fields, select_fields, rows_to_dicts
 
 # Create a blueprint for billing routes
 billing_bp = Blueprint('billing', __name__)
@@ -7,12 +12,107 @@ billing_bp = Blueprint('billing', __name__)
 @billing_bp.route('/orders', methods=['GET'])
 def get_orders():
     """
-    Get all orders.
+    Get all orders, or one page of the orders matching filters.
     
     GET /api/orders
+    GET /api/orders?user_id=[id]&from=[time]&to=[time]&limit=[n]&cursor=[c]
+        (newest first, keyset pagination; from is inclusive, to exclusive)
+    GET /api/orders?fields=id,total_amount   (only these columns, with any of the above)
     """
-    orders = Order.query.all()
-    return jsonify([order.to_dict() for order in orders]), 200
+    try:
+        fields = parse_fields(Order, request.args.get('fields'), Order.DEFAULT_FIELDS)
+        filters = {
+            'user_id': request.args.get('user_id') or None,
+            'start': parse_time('from'),
+            'end': parse_time('to')
+        }
+        limit = parse_positive_int('limit')
+        cursor = parse_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    
+    if limit is not None or cursor is not None or any(value is not None for value in filters.values()):
+        return get_orders_page(filters, limit, cursor, fields)
+    
+    rows = db.session.execute(select_fields(Order, fields).order_by(Order.id)).all()
+    return json_response(rows_to_dicts(rows, fields))
+
+def parse_positive_int(name, minimum=1):
+    """
+    Read an optional integer query parameter.
+    """
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+    if number < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return number
+
+def parse_time(name):
+    """
+    Read an optional ISO 8601 query parameter as a naive UTC datetime.
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00').replace(' ', '+'))
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date or time")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def encode_cursor(row):
+    """Opaque cursor for the position after row: its created_at and id."""
+    raw = f"{row.created_at.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def parse_cursor(value):
+    """Decode a cursor from encode_cursor() into (created_at, id)."""
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode('utf-8')
+        created_at, order_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+def get_orders_page(filters, limit, cursor, fields):
+    """
+    One page of matching orders, newest first, with the cursor for the next page.
+    
+    Filtering on user_id and created_at and ordering by (created_at, id)
+    lets the (user_id, created_at) index serve the query: the page costs
+    the same however many orders the table holds.
+    """
+    limit = min(limit or current_app.config['ORDERS_PAGE_DEFAULT_LIMIT'],
+                current_app.config['ORDERS_PAGE_MAX_LIMIT'])
+    
+    query = select_fields(Order, fields, 'created_at', 'id').order_by(Order.created_at.desc(), Order.id.desc())
+    if filters['user_id'] is not None:
+        query = query.where(Order.user_id == filters['user_id'])
+    if filters['start'] is not None:
+        query = query.where(Order.created_at >= filters['start'])
+    if filters['end'] is not None:
+        query = query.where(Order.created_at < filters['end'])
+    if cursor is not None:
+        query = query.where(db.tuple_(Order.created_at, Order.id) < db.tuple_(*cursor))
+    
+    # Fetch one extra row to know whether there is a next page
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    return json_response({
+        'items': rows_to_dicts(rows, fields),
+        'next_cursor': encode_cursor(rows[-1]) if has_more else None
+    })
 
 @billing_bp.route('/orders/<int:id>', methods=['GET'])
 def get_order(id):
@@ -24,6 +124,36 @@ def get_order(id):
     order = Order.query.get_or_404(id)
     return jsonify(order.to_dict()), 200
 
+@billing_bp.route('/users/<user_id>/summary', methods=['GET'])
+def get_user_summary(user_id):
+    """
+    Get the order count, items and amount spent of one user.
+    
+    GET /api/users/:user_id/summary
+    """
+    summary = db.session.get(UserSummary, user_id)
+    if summary is None:
+        return jsonify({"message": "No orders for this user"}), 404
+    return json_response(summary.to_dict())
+
+@billing_bp.route('/users/top', methods=['GET'])
+def get_top_users():
+    """
+    Get the users with the highest totals.
+    
+    GET /api/users/top?by=total_amount&limit=10
+    (by: total_amount, order_count or total_items)
+    """
+    by = request.args.get('by', 'total_amount')
+    if by not in RANKINGS:
+        return jsonify({"message": f"by must be one of: {', '.join(RANKINGS)}"}), 400
+    try:
+        limit = parse_positive_int('limit')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    limit = min(limit or 10, current_app.config['USER_SUMMARY_TOP_MAX'])
+    return json_response([summary.to_dict() for summary in top_users(by, limit)])
+
 @billing_bp.route('/health', methods=['GET'])
 def health_check():
     """
@@ -1,4 +1,6 @@
 from flask import Blueprint, jsonify
+from app.models import db
+from app.database import pool_stats
 from datetime import datetime
 
 health_bp = Blueprint('health', __name__)
@@ -17,4 +19,9 @@ def health_check():
             'status': 'unhealthy',
             'timestamp': datetime.utcnow().isoformat(),
             'error': str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+@health_bp.route('/health/db', methods=['GET'])
+def db_pool_health():
+    """Connection pool usage per database, for sizing against max_connections"""
+    return jsonify(pool_stats(db)), 200
@@ -0,0 +1,57 @@
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.models import db, Order, utcnow
+
+logger = logging.getLogger(__name__)
+
+# Columns added to orders after it was first created:
+# name -> (SQL type, function giving the value for existing rows, or None).
+# A column the model declares NOT NULL is added nullable, backfilled, then
+# made NOT NULL where the database can alter that in place (PostgreSQL).
+# SQLite would need the table rebuilt, so there it stays nullable; the
+# model's default fills it on every insert anyway.
+ADDED_ORDER_COLUMNS = {
+    'message_id': ('VARCHAR(64)', None),
+    # Orders stored before created_at existed get the time of the upgrade
+    'created_at': ('TIMESTAMP', utcnow),
+}
+
+
+def upgrade_schema():
+    """
+    Bring an existing orders table up to date with the model.
+
+    db.create_all() only creates missing tables, so columns and indexes
+    added later are created here. Safe to run from several processes at
+    once: whatever another process already added is skipped.
+    """
+    existing = {column['name']: column for column in inspect(db.engine).get_columns(Order.__tablename__)}
+    table = Order.__table__
+    for name, (sql_type, fill) in ADDED_ORDER_COLUMNS.items():
+        # Also tightens columns added nullable by an earlier upgrade
+        set_not_null = (
+            db.engine.dialect.name == 'postgresql' and not table.c[name].nullable
+            and existing.get(name, {'nullable': True})['nullable']
+        )
+        if name in existing and not set_not_null:
+            continue
+        try:
+            with db.engine.begin() as connection:
+                if name not in existing:
+                    connection.execute(text(f'ALTER TABLE {Order.__tablename__} ADD COLUMN {name} {sql_type}'))
+                if fill is not None:
+                    connection.execute(
+                        table.update().where(table.c[name].is_(None)).values({name: fill()})
+                    )
+                if set_not_null:
+                    connection.execute(text(f'ALTER TABLE {Order.__tablename__} ALTER COLUMN {name} SET NOT NULL'))
+            logger.info(f"Added column {Order.__tablename__}.{name}" if name not in existing
+                        else f"Made column {Order.__tablename__}.{name} NOT NULL")
+        except SQLAlchemyError as e:
+            logger.warning(f"Could not upgrade column {Order.__tablename__}.{name}: {e}")
+
+    for index in table.indexes:
+        index.create(db.engine, checkfirst=True)
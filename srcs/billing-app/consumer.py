@@ -1,11 +1,25 @@
 import json
 import pika
-import sys
 import time
+import signal
 import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
 from app import create_app
 from app.models import db, Order
+from app.aggregates import store_orders
+from app.retry import (
+    retry_delays,
+    declare_retry_topology,
+    retry_or_dead_letter,
+    dead_letter,
+    dead_letter_queue_name,
+    is_permanent,
+)
 from app.config import Config
+from app.metrics import Counter, Histogram, start_metrics_server
+from app.tracing import AMQP_SAMPLED_HEADER, start_trace, end_trace
 
 # Configure logging
 logging.basicConfig(
@@ -14,42 +28,299 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def process_message(ch, method, properties, body):
+def parse_order(body, message_id=None):
     """
-    Process a message from RabbitMQ.
+    Decode a message body into the column values of one order.
     
-    Args:
-        ch: Channel
-        method: Method
-        properties: Properties
-        body: Message body
-    """
-    try:
-        # Parse the message body
-        message = json.loads(body.decode('utf-8'))
-        logger.info(f"Received message: {message}")
+    Raises ValueError (or TypeError) for a message that can never be stored.
+    """
+    message = json.loads(body.decode('utf-8'))
+    order = Order.from_dict(message)
+    return {
+        'user_id': order.user_id,
+        'number_of_items': order.number_of_items,
+        'total_amount': order.total_amount,
+        'message_id': message_id
+    }
+
+# Header the gateway stamps with the publish time in epoch milliseconds
+PUBLISHED_AT_HEADER = 'x-published-at'
+
+MESSAGES = Counter(
+    'billing_consumer_messages',
+    'Messages settled by the consumer, by outcome (stored, duplicate, retried, dead_lettered, requeued)',
+    ('worker', 'outcome')
+)
+BATCH_DURATION = Histogram(
+    'billing_consumer_batch_duration_seconds', 'Time to store one batch of orders', ('worker',)
+)
+BATCH_SIZE = Histogram(
+    'billing_consumer_batch_size', 'Orders per stored batch', ('worker',),
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+LAG = Histogram(
+    'billing_consumer_lag_seconds', 'Time from publishing at the gateway to the order being stored',
+    ('worker',), buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+)
+
+class RecentIds:
+    """
+    Bounded LRU set of the message ids this worker stored recently.
+    
+    Redeliveries usually arrive soon after the original, so most duplicates
+    are caught here without a database round trip. Ids that have fallen out
+    are still caught by the unique index on orders.message_id.
+    """
+    
+    def __init__(self, size):
+        self.size = size
+        self.ids = OrderedDict()
+    
+    def __contains__(self, message_id):
+        if message_id in self.ids:
+            self.ids.move_to_end(message_id)
+            return True
+        return False
+    
+    def add_many(self, message_ids):
+        for message_id in message_ids:
+            if message_id is None:
+                continue
+            self.ids[message_id] = None
+            self.ids.move_to_end(message_id)
+        while len(self.ids) > self.size:
+            self.ids.popitem(last=False)
+
+class BatchConsumer:
+    """
+    Collects deliveries and stores them as orders one batch at a time.
+    
+    A batch is flushed when it holds CONSUMER_BATCH_SIZE messages or when
+    CONSUMER_BATCH_TIMEOUT_MS has passed since its first message. The whole
+    batch is inserted in one transaction and acknowledged with a single
+    multiple=True ack. If that transaction fails, the batch is retried one
+    message at a time so only the messages that fail on their own are
+    retried later, while the rest are still stored.
+    
+    A failed message is not requeued (the broker would hand it straight
+    back). It goes to a retry queue and comes back after a delay that
+    doubles with every attempt, and to the dead-letter queue once
+    CONSUMER_MAX_ATTEMPTS is reached. Unparseable messages and messages
+    that fail on a constraint or data error go straight to the dead-letter
+    queue, since retrying cannot help them.
+    """
+    
+    def __init__(self, connection, channel, batch_size, batch_timeout, recent_ids,
+                 queue, retry_delays, worker='main'):
+        self.connection = connection
+        self.channel = channel
+        self.queue = queue
+        self.retry_delays = retry_delays
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.recent_ids = recent_ids
+        self.pending = []
+        self.timer = None
+        self.stored = 0
+        self.duplicates = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.requeued = 0
+        # Bound once, so recording is a plain increment per message
+        self.stored_metric = MESSAGES.labels(worker, 'stored')
+        self.duplicate_metric = MESSAGES.labels(worker, 'duplicate')
+        self.retried_metric = MESSAGES.labels(worker, 'retried')
+        self.dead_lettered_metric = MESSAGES.labels(worker, 'dead_lettered')
+        self.requeued_metric = MESSAGES.labels(worker, 'requeued')
+        self.batch_duration = BATCH_DURATION.labels(worker)
+        self.batch_size_metric = BATCH_SIZE.labels(worker)
+        self.lag = LAG.labels(worker)
+    
+    def on_message(self, ch, method, properties, body):
+        """
+        Add a delivery to the current batch.
+        
+        Args:
+            ch: Channel
+            method: Method
+            properties: Properties
+            body: Message body
+        """
+        self.pending.append((method.delivery_tag, properties, body))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.connection.call_later(self.batch_timeout, self.on_timeout)
+    
+    def on_timeout(self):
+        self.timer = None
+        self.flush()
+    
+    def flush(self):
+        """Store and settle every pending delivery."""
+        if self.timer is not None:
+            self.connection.remove_timeout(self.timer)
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
         
-        # Create a new order
-        order = Order.from_dict(message)
+        rows = []
+        deliveries = []
+        batch_ids = set()
+        for delivery in batch:
+            delivery_tag, properties, body = delivery
+            message_id = properties.message_id
+            # A redelivery of something already stored is acked and skipped
+            if message_id is not None and (message_id in batch_ids or message_id in self.recent_ids):
+                self.duplicates += 1
+                self.duplicate_metric.inc()
+                self.channel.basic_ack(delivery_tag=delivery_tag)
+                continue
+            try:
+                rows.append(parse_order(body, message_id))
+                deliveries.append(delivery)
+                batch_ids.add(message_id)
+            except (ValueError, TypeError, AttributeError) as e:
+                logger.error(f"Dead-lettering unparseable message: {body!r}")
+                self.set_aside(delivery, e, permanent=True)
+        if not rows:
+            return
         
-        # Add the order to the database
-        with app.app_context():
-            db.session.add(order)
-            db.session.commit()
-            logger.info(f"Created order: {order.to_dict()}")
+        # Messages whose request was sampled at the gateway get a trace of
+        # the batch that stored them
+        sampled = [delivery for delivery in deliveries if is_sampled(delivery[1])]
+        trace, token = start_trace('billing-consumer', 'store batch', sampled=True) if sampled else (None, None)
+        try:
+            with self.batch_duration.time():
+                insert_orders(rows)
+        except Exception as e:
+            logger.warning(f"Batch of {len(rows)} orders failed ({e}), retrying one by one")
+            self.store_one_by_one(rows, deliveries)
+            return
+        finally:
+            if token is not None:
+                end_trace(token)
+        
+        # Every earlier delivery on this channel is already settled
+        self.channel.basic_ack(delivery_tag=deliveries[-1][0], multiple=True)
+        self.recent_ids.add_many(row['message_id'] for row in rows)
+        self.stored += len(rows)
+        self.stored_metric.inc(len(rows))
+        self.batch_size_metric.observe(len(rows))
+        self.observe_lag(deliveries)
+        if sampled:
+            export_batch_trace(trace, sampled, len(rows))
+        logger.debug(f"Stored a batch of {len(rows)} orders")
+    
+    def store_one_by_one(self, rows, deliveries):
+        """
+        Store the messages of a failed batch one at a time.
         
-        # Acknowledge the message
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        Each message that still fails is sent to its next retry queue (or
+        to the dead-letter queue) and acked, so it neither blocks the queue
+        nor comes straight back. When the database itself is down every
+        message takes this path, and they all back off together.
+        """
+        stored = []
+        stored_deliveries = []
+        for row, delivery in zip(rows, deliveries):
+            delivery_tag, properties, body = delivery
+            try:
+                insert_orders([row])
+                stored.append(delivery_tag)
+                stored_deliveries.append(delivery)
+                self.recent_ids.add_many([row['message_id']])
+            except Exception as e:
+                target = self.set_aside(delivery, e, permanent=is_permanent(e))
+                logger.error(f"Error processing message {row}: {e}; sent to {target or 'the queue again'}")
         
-    except json.JSONDecodeError:
-        logger.error(f"Failed to parse message body: {body}")
-        # Negative acknowledgment
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        if stored:
+            self.channel.basic_ack(delivery_tag=stored[-1], multiple=True)
+            self.stored += len(stored)
+            self.stored_metric.inc(len(stored))
+            self.observe_lag(stored_deliveries)
+    
+    def set_aside(self, delivery, error, permanent=False):
+        """
+        Move a failed message to its next retry queue, or straight to the
+        dead-letter queue if it is permanent or out of retries, then ack it.
+        Returns the queue it went to.
         
-    except Exception as e:
-        logger.error(f"Error processing message: {e}")
-        # Negative acknowledgment and requeue
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        If the broker refuses that publish (nack or unroutable), the
+        delivery is nacked with requeue instead, so the message is
+        redelivered rather than lost and the worker keeps running; None is
+        returned. A lost channel or connection propagates to the worker,
+        which reconnects while the broker requeues every unacked delivery.
+        """
+        delivery_tag, properties, body = delivery
+        try:
+            if permanent:
+                dead_letter(self.channel, self.queue, properties, body, error)
+                target = dead_letter_queue_name(self.queue)
+            else:
+                target = retry_or_dead_letter(self.channel, self.queue, self.retry_delays, properties, body, error)
+        except (pika.exceptions.NackError, pika.exceptions.UnroutableError) as e:
+            logger.error(f"Broker refused to take message {properties.message_id} aside ({e!r}), requeueing it")
+            self.channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+            self.requeued += 1
+            self.requeued_metric.inc()
+            return None
+        self.channel.basic_ack(delivery_tag=delivery_tag)
+        if target == dead_letter_queue_name(self.queue):
+            self.dead_lettered += 1
+            self.dead_lettered_metric.inc()
+        else:
+            self.retried += 1
+            self.retried_metric.inc()
+        return target
+    
+    def observe_lag(self, deliveries):
+        """Record publish-to-stored lag for messages the gateway timestamped."""
+        now_ms = time.time() * 1000
+        for _, properties, _ in deliveries:
+            published_at = (properties.headers or {}).get(PUBLISHED_AT_HEADER)
+            if published_at is not None:
+                self.lag.observe(max(now_ms - published_at, 0) / 1000.0)
+
+def is_sampled(properties):
+    return bool((properties.headers or {}).get(AMQP_SAMPLED_HEADER))
+
+def export_batch_trace(trace, deliveries, batch_size):
+    """
+    Export the trace of a stored batch once per sampled message in it.
+    
+    Each record carries the message's request id (its correlation_id) and
+    how long it waited between the gateway publishing it and being stored.
+    """
+    now_ms = time.time() * 1000
+    for _, properties, _ in deliveries:
+        published_at = (properties.headers or {}).get(PUBLISHED_AT_HEADER)
+        trace.finish(
+            request_id=properties.correlation_id,
+            message_id=properties.message_id,
+            batch_size=batch_size,
+            queue_lag_ms=round(max(now_ms - published_at, 0), 3) if published_at is not None else None
+        )
+
+def insert_orders(rows):
+    """
+    Insert orders with one multi-row statement in one transaction.
+    
+    Orders whose message_id is already stored are skipped, so storing a
+    redelivered message again is harmless. The summaries of the users
+    involved are updated in the same transaction.
+    
+    Args:
+        rows: Column values of the orders
+    """
+    with app.app_context():
+        try:
+            store_orders(rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
 
 def setup_rabbitmq_connection():
     """
@@ -75,59 +346,189 @@ def setup_rabbitmq_connection():
     connection = pika.BlockingConnection(parameters)
     channel = connection.channel()
     
-    # Declare the queue
+    # Declare the queue, and the retry and dead-letter queues behind it
     channel.queue_declare(queue=config.RABBITMQ_QUEUE, durable=True)
+    declare_retry_topology(channel, config.RABBITMQ_QUEUE, retry_delays(config))
+    # Retried and dead-lettered messages are acked only once the broker has them
+    channel.confirm_delivery()
     
-    # Set QoS prefetch count to 1 to evenly distribute messages
-    channel.basic_qos(prefetch_count=1)
+    # Prefetch enough messages to fill whole batches
+    channel.basic_qos(prefetch_count=max(config.CONSUMER_PREFETCH_COUNT, config.CONSUMER_BATCH_SIZE))
     
     return connection, channel
 
-def start_consumer():
-    """Start the RabbitMQ consumer."""
-    connection = None
+class ConsumerWorker:
+    """
+    One consumer with its own connection, channel and database session.
     
-    try:
-        # Initialize Flask app for database access
-        global app
-        app = create_app()
-        
-        while True:
+    run() consumes until stop() is called, reconnecting after connection
+    errors. On stop it stops taking deliveries, stores and acks the batch
+    in progress and closes the connection, so the broker requeues only the
+    prefetched messages that were never handed to the batch.
+    """
+    
+    def __init__(self, name):
+        self.name = name
+        self.stopping = threading.Event()
+        self.stored = 0
+        # Kept across reconnects: redeliveries follow a lost connection
+        self.recent_ids = RecentIds(Config.CONSUMER_DEDUP_CACHE_SIZE)
+    
+    def stop(self):
+        # Only sets a flag, so it is safe to call from a signal handler
+        self.stopping.set()
+    
+    def run(self):
+        while not self.stopping.is_set():
+            connection = None
             try:
-                # Set up RabbitMQ connection
                 connection, channel = setup_rabbitmq_connection()
-                logger.info("Connected to RabbitMQ")
-                
-                # Set up consumer
-                channel.basic_consume(
-                    queue=Config().RABBITMQ_QUEUE,
-                    on_message_callback=process_message
+                logger.info(f"[{self.name}] Connected to RabbitMQ")
+                consumer = BatchConsumer(
+                    connection,
+                    channel,
+                    batch_size=Config.CONSUMER_BATCH_SIZE,
+                    batch_timeout=Config.CONSUMER_BATCH_TIMEOUT_MS / 1000.0,
+                    recent_ids=self.recent_ids,
+                    queue=Config.RABBITMQ_QUEUE,
+                    retry_delays=retry_delays(Config),
+                    worker=self.name
                 )
+                consumer_tag = channel.basic_consume(
+                    queue=Config.RABBITMQ_QUEUE,
+                    on_message_callback=consumer.on_message
+                )
+                logger.info(f"[{self.name}] Started consuming from {Config.RABBITMQ_QUEUE}")
+                self.consume(connection, consumer)
                 
-                logger.info(f"Started consuming from {Config().RABBITMQ_QUEUE}")
-                
-                # Start consuming
-                channel.start_consuming()
-                
-            except pika.exceptions.AMQPConnectionError:
-                logger.error("Lost connection to RabbitMQ, retrying in 5 seconds...")
-                time.sleep(5)
-                
-            except pika.exceptions.ChannelClosedByBroker:
-                logger.error("Channel closed by broker, retrying in 5 seconds...")
-                time.sleep(5)
-                
-            except KeyboardInterrupt:
-                logger.info("Interrupted by user, shutting down...")
-                if connection and connection.is_open:
+                # Drain: no new deliveries, finish the batch in hand
+                channel.basic_cancel(consumer_tag)
+                consumer.flush()
+                self.stored += consumer.stored
+                connection.close()
+                logger.info(f"[{self.name}] Stopped after storing {self.stored} orders")
+            
+            except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError) as e:
+                logger.error(f"[{self.name}] Lost connection to RabbitMQ ({e!r}), retrying in 5 seconds...")
+                if connection is not None and connection.is_open:
                     connection.close()
-                sys.exit(0)
+                self.stopping.wait(5)
     
-    except KeyboardInterrupt:
-        logger.info("Interrupted by user, shutting down...")
-        if connection and connection.is_open:
-            connection.close()
-        sys.exit(0)
+    def consume(self, connection, consumer):
+        """Deliver messages until stop() is called, logging the throughput."""
+        report_at = time.monotonic() + Config.CONSUMER_STATS_INTERVAL
+        reported = 0
+        while not self.stopping.is_set():
+            connection.process_data_events(time_limit=1)
+            now = time.monotonic()
+            if now >= report_at:
+                rate = (consumer.stored - reported) / Config.CONSUMER_STATS_INTERVAL
+                logger.info(f"[{self.name}] {rate:.1f} orders/s ({self.stored + consumer.stored} stored)")
+                reported = consumer.stored
+                report_at = now + Config.CONSUMER_STATS_INTERVAL
+
+def run_worker_process(index):
+    """Entry point of a worker process: its own app, engine and connection."""
+    global app
+    app = create_app()
+    if Config.CONSUMER_METRICS_PORT:
+        # One port per worker process: each has its own counters
+        start_metrics_server(Config.CONSUMER_METRICS_PORT + index)
+    worker = ConsumerWorker(f"worker-{index}")
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    worker.run()
+
+class WorkerThread(threading.Thread):
+    """Thread-mode worker; the shared app gives each thread its own session."""
+    
+    def __init__(self, index):
+        super().__init__(name=f"worker-{index}", daemon=True)
+        self.worker = ConsumerWorker(self.name)
+    
+    def run(self):
+        self.worker.run()
+    
+    def terminate(self):
+        self.worker.stop()
+    
+    def kill(self):
+        pass
+
+class Supervisor:
+    """
+    Runs CONSUMER_WORKERS consumers as processes or threads.
+    
+    Workers that exit unexpectedly are restarted, after a growing delay if
+    they keep crashing right after starting. SIGTERM or SIGINT stops every
+    worker gracefully; workers still running after
+    CONSUMER_SHUTDOWN_TIMEOUT seconds are killed.
+    """
+    
+    def __init__(self, count, mode):
+        self.count = count
+        self.mode = mode
+        self.stopping = threading.Event()
+        self.workers = {}
+        self.started_at = {}
+        self.backoff = {}
+    
+    def start_worker(self, index):
+        if self.mode == 'thread':
+            worker = WorkerThread(index)
+        else:
+            worker = multiprocessing.Process(target=run_worker_process, args=(index,), name=f"worker-{index}")
+        worker.start()
+        self.workers[index] = worker
+        self.started_at[index] = time.monotonic()
+        logger.info(f"Started {worker.name} ({self.mode})")
+    
+    def run(self):
+        global app
+        if self.mode == 'thread':
+            app = create_app()
+            if Config.CONSUMER_METRICS_PORT:
+                start_metrics_server(Config.CONSUMER_METRICS_PORT)
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stopping.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stopping.set())
+        
+        for index in range(self.count):
+            self.start_worker(index)
+        
+        restart_at = {}
+        while not self.stopping.wait(1):
+            now = time.monotonic()
+            for index, worker in list(self.workers.items()):
+                if worker.is_alive():
+                    continue
+                if index not in restart_at:
+                    # Crashing soon after starting doubles the delay, up to a minute
+                    quick = now - self.started_at[index] < 30
+                    self.backoff[index] = min(self.backoff.get(index, 0.5) * 2, 60) if quick else 1
+                    restart_at[index] = now + self.backoff[index]
+                    logger.error(f"{worker.name} exited ({getattr(worker, 'exitcode', None)}), "
+                                 f"restarting in {self.backoff[index]:.0f}s")
+                elif now >= restart_at[index]:
+                    del restart_at[index]
+                    self.start_worker(index)
+        
+        self.shutdown()
+    
+    def shutdown(self):
+        logger.info("Shutting down, draining in-flight messages...")
+        for worker in self.workers.values():
+            if worker.is_alive():
+                worker.terminate()
+        deadline = time.monotonic() + Config.CONSUMER_SHUTDOWN_TIMEOUT
+        for worker in self.workers.values():
+            worker.join(max(0, deadline - time.monotonic()))
+            if worker.is_alive():
+                logger.error(f"{worker.name} did not stop in time, killing it")
+                worker.kill()
+
+def start_consumer():
+    """Start the RabbitMQ consumer workers."""
+    Supervisor(Config.CONSUMER_WORKERS, Config.CONSUMER_WORKER_MODE).run()
 
 if __name__ == '__main__':
-    start_consumer()
\ No newline at end of file
+    start_consumer()
@@ -0,0 +1,103 @@
+"""
+Inspect, replay and purge the billing dead-letter queue.
+
+    python dead_letters.py list [--limit N]
+    python dead_letters.py replay [--limit N] [--message-id ID ...]
+    python dead_letters.py purge [--limit N] [--message-id ID ...]
+
+list prints one JSON object per dead letter and leaves them in place.
+replay sends dead letters back to the billing queue with fresh retries;
+purge drops them. Without --limit every dead letter present when the
+command starts is handled; with --message-id only those messages are.
+"""
+import sys
+import json
+import argparse
+from app.config import Config
+from app.retry import (
+    dead_letter_queue_name,
+    attempts,
+    replay_properties,
+    ERROR_HEADER,
+    FAILED_AT_HEADER,
+)
+from consumer import setup_rabbitmq_connection
+
+
+def describe(properties, body):
+    """A dead letter as a JSON-friendly dict."""
+    headers = properties.headers or {}
+    try:
+        payload = json.loads(body.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        payload = body.decode('utf-8', errors='replace')
+    return {
+        'message_id': properties.message_id,
+        'attempts': attempts(properties),
+        'error': headers.get(ERROR_HEADER),
+        'failed_at': headers.get(FAILED_AT_HEADER),
+        'body': payload
+    }
+
+
+def dead_letters(channel, queue, limit, message_ids):
+    """
+    Yield (delivery_tag, properties, body) for the dead letters to handle.
+
+    Messages are fetched unacknowledged. Those not yielded (other ids) and
+    those the caller does not ack go back to the queue when the connection
+    closes.
+    """
+    dead_queue = dead_letter_queue_name(queue)
+    # Only what is there now: never loop over messages that arrive meanwhile
+    remaining = channel.queue_declare(queue=dead_queue, durable=True, passive=True).method.message_count
+    handled = 0
+    while remaining > 0 and (limit is None or handled < limit):
+        method, properties, body = channel.basic_get(queue=dead_queue, auto_ack=False)
+        if method is None:
+            break
+        remaining -= 1
+        if message_ids and properties.message_id not in message_ids:
+            continue
+        handled += 1
+        yield method.delivery_tag, properties, body
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect, replay and purge billing dead letters")
+    parser.add_argument('command', choices=['list', 'replay', 'purge'])
+    parser.add_argument('--limit', type=int, default=None, help="handle at most this many messages")
+    parser.add_argument('--message-id', action='append', default=[], dest='message_ids',
+                        help="only handle the message with this id (repeatable)")
+    args = parser.parse_args(argv)
+
+    queue = Config.RABBITMQ_QUEUE
+    connection, channel = setup_rabbitmq_connection()
+    count = 0
+    try:
+        for delivery_tag, properties, body in dead_letters(channel, queue, args.limit, set(args.message_ids)):
+            if args.command == 'list':
+                print(json.dumps(describe(properties, body)))
+            elif args.command == 'replay':
+                channel.basic_publish(
+                    exchange='',
+                    routing_key=queue,
+                    body=body,
+                    properties=replay_properties(properties)
+                )
+                channel.basic_ack(delivery_tag=delivery_tag)
+            else:
+                channel.basic_ack(delivery_tag=delivery_tag)
+            count += 1
+    finally:
+        # Unacked messages (list, skipped ids) return to the dead-letter queue
+        connection.close()
+
+    if args.command != 'list':
+        verb = 'Replayed' if args.command == 'replay' else 'Purged'
+        print(f"{verb} {count} dead letter(s) from {dead_letter_queue_name(queue)}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,22 +1,35 @@
 from flask import Flask
 from app.config import Config
 from app.models import db
+from app.database import engine_options, replica_binds, init_routing, register_pool_metrics
+from app.metrics import init_metrics
+from app.tracing import init_tracing
 from app.routes import inventory_bp, health_bp
+from app.search import init_search
+from app.catalogue import ensure_version_row
 
 def create_app(config_class=Config):
     """Create and configure the Flask application."""
     app = Flask(__name__)
     app.config.from_object(config_class)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    app.config.setdefault('SQLALCHEMY_BINDS', replica_binds(app.config))
     
     # Initialize extensions
     db.init_app(app)
+    init_routing(app)
+    init_metrics(app)
+    init_tracing(app, 'inventory')
+    register_pool_metrics(app, db)
     
     # Register blueprints
     app.register_blueprint(inventory_bp, url_prefix='/api')
     app.register_blueprint(health_bp)
     
-    # Create database tables
+    # Create database tables, the catalogue version and the title search index
     with app.app_context():
         db.create_all()
+        ensure_version_row()
+        init_search(app)
     
     return app
\ No newline at end of file
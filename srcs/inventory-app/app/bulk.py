@@ -0,0 +1,256 @@
+import json
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.models import db, Movie
+from app.catalogue import bump_version
+from app.changes import record_changes, record_deletes, INSERT, UPDATE
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+TITLE_MAX_LENGTH = Movie.__table__.c.title.type.length
+
+
+class ParseError(str):
+    """An item of a bulk body that could not be parsed."""
+
+
+def parse_bulk_body(raw, mimetype):
+    """
+    Parse a request body as a JSON array or as NDJSON.
+
+    Returns (items, error). An unparseable NDJSON line becomes a ParseError
+    entry so it is reported per item instead of failing the whole request.
+    """
+    if (mimetype or '').lower() in NDJSON_MIMETYPES:
+        items = []
+        for line in raw.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(ParseError(f"Invalid JSON: {e}"))
+        return items, None
+
+    try:
+        items = json.loads(raw) if raw else None
+    except ValueError as e:
+        return None, f"Invalid JSON: {e}"
+
+    if not isinstance(items, list):
+        return None, "Expected a JSON array or NDJSON body"
+    return items, None
+
+
+def validate_new_movie(item):
+    """Same checks as POST /api/movies; returns an error message or None."""
+    if isinstance(item, ParseError):
+        return str(item)
+    if not isinstance(item, dict):
+        return "Expected a JSON object"
+    if 'title' not in item or item['title'] is None:
+        return "Missing required field: title"
+    if 'description' not in item or not item['description']:
+        return "Missing required field: description"
+    return _field_error(item)
+
+
+def validate_movie_update(item):
+    """Checks for one PUT /api/movies/bulk item; returns an error message or None."""
+    if isinstance(item, ParseError):
+        return str(item)
+    if not isinstance(item, dict):
+        return "Expected a JSON object"
+    if not _is_id(item.get('id')):
+        return "Missing required field: id"
+    if 'title' in item and item['title'] is None:
+        return "title cannot be null"
+    return _field_error(item)
+
+
+def _field_error(item):
+    """
+    Type and length checks, so that a bad item is rejected here instead of
+    failing the INSERT or UPDATE of its whole chunk.
+    """
+    if 'title' in item:
+        if not isinstance(item['title'], str):
+            return "title must be a string"
+        if len(item['title']) > TITLE_MAX_LENGTH:
+            return f"title must be at most {TITLE_MAX_LENGTH} characters"
+    if item.get('description') is not None and not isinstance(item['description'], str):
+        return "description must be a string"
+    return None
+
+
+def validate_movie_id(item):
+    """A DELETE /api/movies/bulk item is an id or an object with an id."""
+    if isinstance(item, ParseError):
+        return str(item)
+    if isinstance(item, dict):
+        item = item.get('id')
+    if not _is_id(item):
+        return "Expected a movie id"
+    return None
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_items(items, validate):
+    """
+    Validate every item of a bulk request.
+
+    Returns (results, valid) where results holds a rejection entry for each
+    invalid item (None elsewhere) and valid lists the indexes to write.
+    """
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        error = validate(item)
+        if error:
+            results[index] = {"index": index, "status": "rejected", "error": error}
+        else:
+            valid.append(index)
+    return results, valid
+
+
+def chunked(indexes, size):
+    for start in range(0, len(indexes), size):
+        yield indexes[start:start + size]
+
+
+def run_chunks(items, valid, results, chunk_size, write_chunk):
+    """
+    Write the valid items in chunks, one transaction per chunk.
+
+    write_chunk(items, indexes) issues the statements for one chunk and
+    returns {index: result}. A chunk that fails is rolled back and its
+    items are written again one at a time, so only the items the database
+    still refuses are reported as failed; later chunks still run.
+    """
+    for indexes in chunked(valid, chunk_size):
+        if not write_transaction(items, indexes, results, write_chunk) and len(indexes) > 1:
+            for index in indexes:
+                write_transaction(items, [index], results, write_chunk)
+
+
+def write_transaction(items, indexes, results, write_chunk):
+    """
+    Write these items in one transaction and fill in their results.
+
+    Returns False, with the items reported as failed, when the database
+    refused the transaction and it was rolled back.
+    """
+    try:
+        outcome = write_chunk(items, indexes)
+        bump_version()
+        record_chunk_changes(outcome)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        for index in indexes:
+            results[index] = {"index": index, "status": "failed", "error": str(e.__cause__ or e)}
+        return False
+    for index in indexes:
+        results[index] = dict(index=index, **outcome[index])
+    return True
+
+
+def record_chunk_changes(outcome):
+    """Add the rows a chunk wrote to the change log."""
+    ids = {}
+    for result in outcome.values():
+        ids.setdefault(result["status"], set()).add(result["id"])
+    record_changes(INSERT, ids.get("created", ()))
+    record_changes(UPDATE, ids.get("updated", ()))
+    record_deletes(sorted(ids.get("deleted", ())))
+
+
+def insert_chunk(items, indexes):
+    """One multi-row INSERT ... RETURNING id for the chunk."""
+    rows = [
+        {'title': items[index]['title'], 'description': items[index]['description']}
+        for index in indexes
+    ]
+    ids = db.session.execute(
+        db.insert(Movie).returning(Movie.id, sort_by_parameter_order=True),
+        rows
+    ).scalars().all()
+    outcome = {index: {"status": "created", "id": movie_id} for index, movie_id in zip(indexes, ids)}
+    return outcome
+
+
+def update_chunk(items, indexes):
+    """Bulk UPDATE by primary key for the ids that exist."""
+    existing = _existing_ids(items[index]['id'] for index in indexes)
+    outcome = {}
+    rows = []
+    for index in indexes:
+        item = items[index]
+        if item['id'] not in existing:
+            outcome[index] = {"status": "not_found", "id": item['id'], "error": "Movie not found"}
+            continue
+        row = {'id': item['id']}
+        for field in ('title', 'description'):
+            if field in item:
+                row[field] = item[field]
+        outcome[index] = {"status": "updated", "id": item['id']}
+        if len(row) > 1:
+            rows.append(row)
+    if rows:
+        # The ORM groups rows by the columns they set, one executemany per group
+        db.session.execute(db.update(Movie), rows)
+    return outcome
+
+
+def delete_chunk(items, indexes):
+    """One DELETE ... WHERE id IN (...) for the chunk."""
+    ids = {index: _item_id(items[index]) for index in indexes}
+    existing = _existing_ids(ids.values())
+    if existing:
+        db.session.execute(db.delete(Movie).where(Movie.id.in_(existing)))
+    outcome = {
+        index: {"status": "deleted", "id": movie_id} if movie_id in existing
+        else {"status": "not_found", "id": movie_id, "error": "Movie not found"}
+        for index, movie_id in ids.items()
+    }
+    return outcome
+
+
+def _item_id(item):
+    return item['id'] if isinstance(item, dict) else item
+
+
+def _existing_ids(ids):
+    ids = set(ids)
+    if not ids:
+        return set()
+    return set(db.session.execute(db.select(Movie.id).where(Movie.id.in_(ids))).scalars())
+
+
+def summarize(results, done_status):
+    """
+    Build the response body and status code from per-item results.
+    """
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    body = {
+        done_status: counts.get(done_status, 0),
+        "rejected": counts.get("rejected", 0),
+        "not_found": counts.get("not_found", 0),
+        "failed": counts.get("failed", 0),
+        "results": results
+    }
+    if counts.get(done_status, 0) == len(results):
+        status = 200
+    elif counts.get("rejected", 0) == len(results):
+        # Every item failed validation, as for the gateway's billing batch
+        status = 400
+    else:
+        # 207 Multi-Status when only some of the items were written
+        status = 207
+    return body, status
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import request, make_response
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, CatalogueVersion
+
+VERSION_ROW_ID = 1
+
+
+def _utcnow():
+    # Stored naive in UTC, with whole seconds like HTTP dates
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+def ensure_version_row():
+    """Create the counter row if this is a fresh database."""
+    if db.session.get(CatalogueVersion, VERSION_ROW_ID) is not None:
+        return
+    db.session.add(CatalogueVersion(id=VERSION_ROW_ID, version=0, updated_at=_utcnow(),
+                                    changes_pruned_through=0))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker created it first
+        db.session.rollback()
+
+
+def bump_version():
+    """
+    Advance the catalogue version as part of the current transaction.
+
+    Call it right before committing a movie write: the row lock it takes is
+    held until the commit, so writers are serialized only briefly.
+    """
+    table = CatalogueVersion.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.id == VERSION_ROW_ID)
+        .values(version=table.c.version + 1, updated_at=_utcnow())
+    )
+
+
+def current_version():
+    """(version, last modified) of the catalogue, from the counter row only."""
+    row = db.session.execute(
+        db.select(CatalogueVersion.version, CatalogueVersion.updated_at)
+        .where(CatalogueVersion.id == VERSION_ROW_ID)
+    ).one()
+    return row.version, row.updated_at.replace(tzinfo=timezone.utc)
+
+
+def not_modified(etag, last_modified):
+    """True if the request's validators match the current catalogue."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def conditional(view):
+    """
+    Answer GETs with ETag/Last-Modified taken from the catalogue version.
+
+    A request whose If-None-Match (or If-Modified-Since) still matches gets
+    a 304 before the view runs, so the movies table is not read at all.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version, last_modified = current_version()
+        etag = f'v{version}'
+        if not_modified(etag, last_modified):
+            resp = make_response('', 304)
+        else:
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code != 200:
+                return resp
+        resp.set_etag(etag)
+        resp.last_modified = last_modified
+        return resp
+    return wrapper
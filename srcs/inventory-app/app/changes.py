@@ -0,0 +1,191 @@
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.models import db, Movie, MovieChange, CatalogueVersion
+from app.catalogue import VERSION_ROW_ID
+
+logger = logging.getLogger(__name__)
+
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+DELETE_ALL = 'delete_all'
+
+LATEST = 'latest'
+
+
+class CursorExpired(Exception):
+    """The requested cursor points into a part of the log that was pruned."""
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def record_changes(op, ids):
+    """
+    Log an insert or update of the movies with these ids.
+
+    Copies the current rows with INSERT ... SELECT, so the log carries the
+    new state and callers do not need to pass it in. Call it right after
+    bump_version(): the catalogue version row lock is then held until the
+    commit, so change ids are handed out in commit order and a consumer
+    never skips an entry that commits late.
+    """
+    ids = list(ids)
+    if not ids:
+        return
+    db.session.execute(
+        db.insert(MovieChange).from_select(
+            ['movie_id', 'op', 'title', 'description', 'changed_at'],
+            db.select(
+                Movie.id, db.literal(op), Movie.title, Movie.description,
+                db.literal(_now(), db.DateTime)
+            ).where(Movie.id.in_(ids)).order_by(Movie.id)
+        )
+    )
+
+
+def record_deletes(ids):
+    """Log the deletion of the movies with these ids (same ordering rule)."""
+    now = _now()
+    rows = [{'movie_id': movie_id, 'op': DELETE, 'changed_at': now} for movie_id in ids]
+    if rows:
+        db.session.execute(db.insert(MovieChange), rows)
+
+
+def record_delete_all():
+    """Log DELETE /api/movies as one entry instead of one per movie."""
+    db.session.execute(db.insert(MovieChange), [{'movie_id': None, 'op': DELETE_ALL, 'changed_at': _now()}])
+
+
+def latest_cursor():
+    return db.session.execute(db.select(db.func.max(MovieChange.id))).scalar() or 0
+
+
+def read_changes(since, limit):
+    """
+    Up to limit log entries after the since cursor, oldest first.
+
+    Returns (rows, has_more). Raises CursorExpired when entries after since
+    were already pruned, in which case the consumer has to resync.
+    """
+    pruned_through = db.session.execute(
+        db.select(CatalogueVersion.changes_pruned_through).where(CatalogueVersion.id == VERSION_ROW_ID)
+    ).scalar() or 0
+    if since < pruned_through:
+        raise CursorExpired(f"Changes up to {pruned_through} have been pruned")
+
+    rows = db.session.execute(
+        db.select(
+            MovieChange.id, MovieChange.op, MovieChange.movie_id,
+            MovieChange.title, MovieChange.description, MovieChange.changed_at
+        )
+        .where(MovieChange.id > since)
+        .order_by(MovieChange.id)
+        .limit(limit + 1)
+    ).all()
+    return rows[:limit], len(rows) > limit
+
+
+def change_to_dict(row):
+    change = {'cursor': row.id, 'op': row.op, 'id': row.movie_id, 'changed_at': row.changed_at.isoformat() + 'Z'}
+    if row.op in (INSERT, UPDATE):
+        change['title'] = row.title
+        change['description'] = row.description
+    return change
+
+
+def compact_changes(retention_seconds, max_rows):
+    """
+    Keep the change log bounded.
+
+    Compaction drops entries a consumer can safely skip: everything before
+    the last delete_all, and every entry for a movie that has a later one.
+    That keeps at most one entry per movie and leaves every cursor valid.
+    Retention then drops entries older than retention_seconds or beyond the
+    newest max_rows, and moves the pruned watermark so that consumers still
+    behind it get a 410 and resync.
+    """
+    table = MovieChange.__table__
+    later = table.alias('later')
+
+    last_delete_all = db.session.execute(
+        db.select(db.func.max(table.c.id)).where(table.c.op == DELETE_ALL)
+    ).scalar()
+    if last_delete_all is not None:
+        db.session.execute(table.delete().where(table.c.id < last_delete_all))
+
+    db.session.execute(table.delete().where(
+        table.c.movie_id.is_not(None),
+        db.exists().where(later.c.movie_id == table.c.movie_id, later.c.id > table.c.id)
+    ))
+
+    latest = latest_cursor()
+    prune_through = 0
+    if max_rows:
+        # Ids are sparse after compaction, so count rows, not ids
+        prune_through = db.session.execute(
+            db.select(table.c.id).order_by(table.c.id.desc()).offset(max_rows).limit(1)
+        ).scalar() or 0
+    if retention_seconds:
+        cutoff = _now() - timedelta(seconds=retention_seconds)
+        expired = db.session.execute(
+            db.select(db.func.max(table.c.id)).where(table.c.changed_at < cutoff)
+        ).scalar()
+        prune_through = max(prune_through, expired or 0)
+
+    # The newest entry always stays, so ids are never handed out again (SQLite)
+    prune_through = min(prune_through, latest - 1)
+    if prune_through > 0:
+        db.session.execute(table.delete().where(table.c.id <= prune_through))
+        version = CatalogueVersion.__table__
+        db.session.execute(
+            version.update()
+            .where(version.c.id == VERSION_ROW_ID, version.c.changes_pruned_through < prune_through)
+            .values(changes_pruned_through=prune_through)
+        )
+    db.session.commit()
+
+
+_compactor_lock = threading.Lock()
+_compactor_pid = None
+
+
+def start_compactor(app):
+    """
+    Compact the log every MOVIE_CHANGES_COMPACT_INTERVAL seconds in a
+    background thread, so no request waits for it.
+
+    Starts once per process, lazily, so that gunicorn workers forked from a
+    preloaded master each get their own thread. Each worker's first run is
+    at a random point of the first interval, to spread the workers apart.
+    """
+    global _compactor_pid
+    interval = app.config['MOVIE_CHANGES_COMPACT_INTERVAL']
+    pid = os.getpid()
+    if interval <= 0 or _compactor_pid == pid:
+        return
+    with _compactor_lock:
+        if _compactor_pid == pid:
+            return
+        _compactor_pid = pid
+    threading.Thread(target=_compact_forever, args=(app, interval), name='change-log-compactor', daemon=True).start()
+
+
+def _compact_forever(app, interval):
+    time.sleep(random.uniform(0, interval))
+    while True:
+        with app.app_context():
+            try:
+                compact_changes(app.config['MOVIE_CHANGES_RETENTION_SECONDS'], app.config['MOVIE_CHANGES_MAX_ROWS'])
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                logger.warning(f"Change log compaction failed: {e}")
+        time.sleep(interval)
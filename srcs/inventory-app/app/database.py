@@ -0,0 +1,216 @@
+"""
+Engine options, read-replica routing, query timing and pool metrics.
+
+The same file in inventory-app and billing-app (see the top-level README);
+keep the copies in step.
+"""
+import random
+import threading
+import time
+
+from flask import g, request, has_request_context, current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+from app.metrics import Callback
+from app import tracing
+
+REPLICA_BIND_PREFIX = 'replica_'
+READ_METHODS = ('GET', 'HEAD')
+# Requests carrying this cookie read from the primary (read-your-writes)
+STICKY_COOKIE = 'db-primary'
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def stats(self):
+        capacity = self.size() + self._max_overflow
+        checked_out = self.checkedout()
+        with self._stats_lock:
+            checkouts = self.checkouts
+            total = self.wait_seconds_total
+            longest = self.wait_seconds_max
+            timeouts = self.timeouts
+        return {
+            'size': self.size(),
+            'max_overflow': self._max_overflow,
+            'checked_out': checked_out,
+            'checked_in': self.checkedin(),
+            'overflow': self.overflow(),
+            'utilization': round(checked_out / capacity, 3) if capacity > 0 else None,
+            'checkouts': checkouts,
+            'timeouts': timeouts,
+            'wait_seconds_avg': round(total / checkouts, 6) if checkouts else 0.0,
+            'wait_seconds_max': round(longest, 6)
+        }
+
+
+def engine_options(config, uri=None):
+    """Pool options from config for the primary, or for the database at uri."""
+    uri = uri or config['SQLALCHEMY_DATABASE_URI']
+    if uri.startswith('sqlite') and (':memory:' in uri or uri.rstrip('/') == 'sqlite:'):
+        # In-memory SQLite needs its single shared connection
+        return {}
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_use_lifo': config['DB_POOL_USE_LIFO']
+    }
+
+
+def replica_binds(config):
+    """SQLALCHEMY_BINDS entries for DATABASE_REPLICA_URIS, with the same pool options."""
+    return {
+        f'{REPLICA_BIND_PREFIX}{index}': dict(engine_options(config, uri), url=uri)
+        for index, uri in enumerate(config['DATABASE_REPLICA_URIS'])
+    }
+
+
+class RoutingSession(Session):
+    """
+    Session that sends the reads of GET/HEAD requests to a read replica.
+
+    Everything else (writes, flushes, work outside a request, requests that
+    carry the sticky cookie set after a write) uses the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing:
+            replica = _request_replica(self._db)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _request_replica(db):
+    if not has_request_context():
+        return None
+    if 'db_replica' not in g:
+        g.db_replica = None
+        keys = current_app.extensions.get('db_replica_keys')
+        if keys and request.method in READ_METHODS and STICKY_COOKIE not in request.cookies:
+            g.db_replica = random.choice(keys)
+    if g.db_replica is None:
+        return None
+    return db.engines[g.db_replica]
+
+
+def init_routing(app):
+    """Enable replica reads and read-your-writes stickiness for app."""
+    keys = sorted(key for key in app.config.get('SQLALCHEMY_BINDS', {})
+                  if key.startswith(REPLICA_BIND_PREFIX))
+    app.extensions['db_replica_keys'] = keys
+    if not keys:
+        return
+
+    @app.after_request
+    def stick_to_primary(response):
+        # After a write, this client reads from the primary until replicas catch up
+        if request.method not in READ_METHODS + ('OPTIONS',) and response.status_code < 400:
+            response.set_cookie(
+                STICKY_COOKIE, '1',
+                max_age=app.config['DB_STICKY_PRIMARY_SECONDS'],
+                httponly=True, samesite='Lax'
+            )
+        return response
+
+
+def dispose_engines(app, db, close=True):
+    """
+    Drop the pooled connections of every engine (primary and replicas).
+
+    A forked worker calls this with close=False first thing: the pools it
+    inherited hold the parent's sockets, which must be neither used nor
+    closed by the child. New connections are opened on demand.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+
+
+def pool_stats(db):
+    """Pool usage of the primary ('primary') and of every replica bind."""
+    stats = {}
+    for key, engine in db.engines.items():
+        name = 'primary' if key is None else key
+        pool = engine.pool
+        if isinstance(pool, TimedQueuePool):
+            stats[name] = pool.stats()
+        else:
+            stats[name] = {'pool': type(pool).__name__, 'status': pool.status()}
+    return stats
+
+
+def register_pool_metrics(app, db):
+    """Export the pool usage of every database of app on /metrics."""
+
+    def pools():
+        with app.app_context():
+            engines = dict(db.engines)
+        for key, engine in engines.items():
+            if isinstance(engine.pool, TimedQueuePool):
+                yield ('primary' if key is None else key), engine.pool
+
+    def collect(read):
+        return lambda: [((name,), read(pool)) for name, pool in pools()]
+
+    Callback('db_pool_size', 'Connections kept in the pool', 'gauge', ('database',),
+             collect(lambda pool: pool.size()))
+    Callback('db_pool_checked_out', 'Connections currently checked out', 'gauge', ('database',),
+             collect(lambda pool: pool.checkedout()))
+    Callback('db_pool_overflow', 'Connections open beyond the pool size', 'gauge', ('database',),
+             collect(lambda pool: max(pool.overflow(), 0)))
+    Callback('db_pool_checkouts', 'Connection checkouts', 'counter', ('database',),
+             collect(lambda pool: pool.checkouts))
+    Callback('db_pool_checkout_timeouts', 'Checkouts that timed out waiting for a connection', 'counter',
+             ('database',), collect(lambda pool: pool.timeouts))
+    Callback('db_pool_checkout_wait_seconds', 'Time spent waiting for a connection', 'counter',
+             ('database',), collect(lambda pool: pool.wait_seconds_total))
+
+
+# Every statement's time counts as the 'db' span of the current trace. The
+# start time lives on the statement's execution context, so a statement
+# that raises (and never reaches after_cursor_execute) leaves nothing behind
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.trace_query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'trace_query_started', None)
+    if started is not None:
+        tracing.record('db', started, time.perf_counter() - started)
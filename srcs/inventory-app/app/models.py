@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
+from app.database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Movie(db.Model):
     """Movie model for storing movie related details."""
@@ -28,4 +29,26 @@ class Movie(db.Model):
         return Movie(
             title=data.get('title'),
             description=data.get('description')
-        )  
\ No newline at end of file
+        )  
+
+class CatalogueVersion(db.Model):
+    """Single-row counter bumped in the same transaction as every movie write."""
+    __tablename__ = 'catalogue_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    # Change log entries up to this id have been pruned by retention
+    changes_pruned_through = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class MovieChange(db.Model):
+    """One entry of the catalogue change log, in commit order."""
+    __tablename__ = 'movie_changes'
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    movie_id = db.Column(db.Integer, nullable=True, index=True)
+    op = db.Column(db.String(16), nullable=False)
+    title = db.Column(db.String(255), nullable=True)
+    description = db.Column(db.Text, nullable=True)
+    changed_at = db.Column(db.DateTime, nullable=False, index=True)
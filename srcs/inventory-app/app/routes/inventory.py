@@ -1,25 +1,206 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
 from app.models import db, Movie
+from app.search import search_movies, matching_ids
+from app.catalogue import bump_version, conditional
+from app.changes import (
+    CursorExpired,
+    LATEST,
+    record_changes,
+    record_deletes,
+    record_delete_all,
+    read_changes,
+    latest_cursor,
+    change_to_dict,
+    start_compactor,
+    INSERT,
+    UPDATE,
+)
+from app.serialization import dumps, json_response, parse_fields, select_fields, rows_to_dicts
+from app.bulk import (
+    parse_bulk_body,
+    validate_items,
+    validate_new_movie,
+    validate_movie_update,
+    validate_movie_id,
+    run_chunks,
+    insert_chunk,
+    update_chunk,
+    delete_chunk,
+    summarize,
+)
 
 # Create a blueprint for inventory routes
 inventory_bp = Blueprint('inventory', __name__)
 
 @inventory_bp.route('/movies', methods=['GET'])
+@conditional
 def get_movies():
     """
     Get all movies or filter by title.
     
     GET /api/movies
-    GET /api/movies?title=[name]
+    GET /api/movies?title=[name]             (indexed, best match first)
+    GET /api/movies?limit=[n]&after_id=[id]  (keyset pagination)
+    GET /api/movies?stream=json|ndjson       (streamed from a server-side cursor)
+    GET /api/movies?fields=id,title          (only these columns, with any of the above)
     """
     title_filter = request.args.get('title')
     
+    try:
+        limit = parse_positive_int('limit')
+        after_id = parse_positive_int('after_id', minimum=0)
+        fields = parse_fields(Movie, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    
+    # Chosen by the query string only, never by Accept, so the URL alone
+    # determines the body (the gateway caches and coalesces by URL)
+    stream = request.args.get('stream')
+    if stream is not None:
+        if stream not in ('json', 'ndjson'):
+            return jsonify({"message": "stream must be 'json' or 'ndjson'"}), 400
+        return stream_movies(title_filter, after_id, fields, ndjson=(stream == 'ndjson'))
+    
+    if limit is not None or after_id is not None:
+        return get_movies_page(title_filter, limit, after_id, fields)
+    
+    if title_filter:
+        rows = search_movies(title_filter, current_app.config['MOVIE_SEARCH_LIMIT'])
+        return json_response([{field: getattr(row, field) for field in fields} for row in rows])
+    
+    rows = db.session.execute(movie_query(None, None, fields)).all()
+    return json_response(rows_to_dicts(rows, fields))
+
+def parse_positive_int(name, minimum=1):
+    """
+    Read an optional integer query parameter.
+    """
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+    if number < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return number
+
+def movie_query(title_filter, after_id, fields):
+    """
+    SELECT of the requested movie columns (plus id, last) in id order, optionally filtered.
+    """
+    query = select_fields(Movie, fields, 'id').order_by(Movie.id)
     if title_filter:
-        movies = Movie.query.filter(Movie.title.ilike(f'%{title_filter}%')).all()
+        query = query.where(Movie.title.ilike(f'%{title_filter}%'))
+    if after_id is not None:
+        query = query.where(Movie.id > after_id)
+    return query
+
+def movies_by_id_query(ids, fields):
+    """
+    SELECT of the requested movie columns (plus id, last) for these ids, in id order.
+    """
+    return select_fields(Movie, fields, 'id').where(Movie.id.in_(ids)).order_by(Movie.id)
+
+def get_movies_page(title_filter, limit, after_id, fields):
+    """
+    One page of movies after the after_id cursor, with the cursor for the next page.
+    """
+    limit = min(limit or current_app.config['MOVIES_PAGE_DEFAULT_LIMIT'],
+                current_app.config['MOVIES_PAGE_MAX_LIMIT'])
+    
+    # Fetch one extra row to know whether there is a next page. Without
+    # pg_trgm, title matches come from the in-process index
+    ids = matching_ids(title_filter, after_id) if title_filter else None
+    if ids is not None:
+        query = movies_by_id_query(ids[:limit + 1], fields)
     else:
-        movies = Movie.query.all()
+        query = movie_query(title_filter, after_id, fields).limit(limit + 1)
+    rows = db.session.execute(query).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     
-    return jsonify([movie.to_dict() for movie in movies]), 200
+    return json_response({
+        'items': rows_to_dicts(rows, fields),
+        'next_cursor': rows[-1].id if has_more else None
+    })
+
+def stream_movies(title_filter, after_id, fields, ndjson=False):
+    """
+    Stream every matching movie as a JSON array or as NDJSON.
+    
+    Rows come from a server-side cursor in batches of MOVIES_STREAM_BATCH_SIZE,
+    so memory stays flat however large the catalogue is. Without pg_trgm, a
+    title filter is answered by the in-process index and the matching rows
+    are fetched by id, one batch at a time.
+    """
+    batch_size = current_app.config['MOVIES_STREAM_BATCH_SIZE']
+    ids = matching_ids(title_filter, after_id) if title_filter else None
+    if ids is not None:
+        queries = [movies_by_id_query(ids[start:start + batch_size], fields)
+                   for start in range(0, len(ids), batch_size)]
+    else:
+        queries = [movie_query(title_filter, after_id, fields).execution_options(yield_per=batch_size)]
+    
+    def batches():
+        for query in queries:
+            result = db.session.execute(query)
+            try:
+                yield from result.partitions()
+            finally:
+                result.close()
+    
+    def generate():
+        if ndjson:
+            for rows in batches():
+                yield b''.join(dumps(item) + b'\n' for item in rows_to_dicts(rows, fields))
+        else:
+            separator = b'['
+            for rows in batches():
+                yield separator + b','.join(dumps(item) for item in rows_to_dicts(rows, fields))
+                separator = b','
+            yield b']\n' if separator == b',' else b'[]\n'
+    
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(stream_with_context(generate()), status=200, mimetype=mimetype)
+
+@inventory_bp.route('/movies/changes', methods=['GET'])
+def get_movie_changes():
+    """
+    Catalogue changes after a cursor, oldest first, for incremental sync.
+    
+    GET /api/movies/changes?since=[cursor]&limit=[n]
+    GET /api/movies/changes?since=latest   (current cursor, no changes)
+    """
+    since = request.args.get('since', '0')
+    if since == LATEST:
+        return json_response({'changes': [], 'next_cursor': latest_cursor(), 'has_more': False})
+    
+    try:
+        since = parse_positive_int('since', minimum=0) or 0
+        limit = parse_positive_int('limit')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    limit = min(limit or current_app.config['MOVIES_PAGE_DEFAULT_LIMIT'],
+                current_app.config['MOVIES_PAGE_MAX_LIMIT'])
+    
+    try:
+        rows, has_more = read_changes(since, limit)
+    except CursorExpired as e:
+        # Too far behind: reload GET /api/movies, then follow from since=latest
+        return jsonify({"message": str(e), "resync": True}), 410
+    
+    return json_response({
+        'changes': [change_to_dict(row) for row in rows],
+        'next_cursor': rows[-1].id if rows else since,
+        'has_more': has_more
+    })
+
+@inventory_bp.before_request
+def compact_change_log():
+    """Keep the change log bounded, from a background thread of this process."""
+    start_compactor(current_app._get_current_object())
 
 @inventory_bp.route('/movies', methods=['POST'])
 def create_movie():
@@ -42,10 +223,61 @@ def create_movie():
     movie = Movie.from_dict(data)
     
     db.session.add(movie)
+    db.session.flush()
+    bump_version()
+    record_changes(INSERT, [movie.id])
     db.session.commit()
     
     return jsonify(movie.to_dict()), 201
 
+@inventory_bp.route('/movies/bulk', methods=['POST'])
+def create_movies_bulk():
+    """
+    Create many movies at once.
+    
+    POST /api/movies/bulk  (JSON array or NDJSON of {title, description})
+    """
+    return apply_bulk(validate_new_movie, insert_chunk, 'created')
+
+@inventory_bp.route('/movies/bulk', methods=['PUT'])
+def update_movies_bulk():
+    """
+    Update many movies at once.
+    
+    PUT /api/movies/bulk  (JSON array or NDJSON of {id, title?, description?})
+    """
+    return apply_bulk(validate_movie_update, update_chunk, 'updated')
+
+@inventory_bp.route('/movies/bulk', methods=['DELETE'])
+def delete_movies_bulk():
+    """
+    Delete many movies at once.
+    
+    DELETE /api/movies/bulk  (JSON array or NDJSON of ids or {id})
+    """
+    return apply_bulk(validate_movie_id, delete_chunk, 'deleted')
+
+def apply_bulk(validate, write_chunk, done_status):
+    """
+    Validate a bulk body and write it in chunks of MOVIES_BULK_CHUNK_SIZE.
+    
+    Each chunk is one transaction with one multi-row statement per kind of
+    write. The response reports an id or an error for every item, in order.
+    """
+    items, error = parse_bulk_body(request.get_data(), request.mimetype)
+    if error:
+        return jsonify({"message": error}), 400
+    
+    max_items = current_app.config['MOVIES_BULK_MAX_ITEMS']
+    if len(items) > max_items:
+        return jsonify({"message": f"Too many items: at most {max_items} per request"}), 413
+    
+    results, valid = validate_items(items, validate)
+    run_chunks(items, valid, results, current_app.config['MOVIES_BULK_CHUNK_SIZE'], write_chunk)
+    
+    body, status = summarize(results, done_status)
+    return jsonify(body), status
+
 @inventory_bp.route('/movies', methods=['DELETE'])
 def delete_all_movies():
     """
@@ -54,11 +286,14 @@ def delete_all_movies():
     DELETE /api/movies
     """
     db.session.query(Movie).delete()
+    bump_version()
+    record_delete_all()
     db.session.commit()
     
     return jsonify({"message": "All movies have been deleted"}), 200
 
 @inventory_bp.route('/movies/<int:id>', methods=['GET'])
+@conditional
 def get_movie(id):
     """
     Get a specific movie by ID.
@@ -87,6 +322,9 @@ def update_movie(id):
     if 'description' in data:
         movie.description = data['description']
     
+    db.session.flush()
+    bump_version()
+    record_changes(UPDATE, [id])
     db.session.commit()
     
     return jsonify(movie.to_dict()), 200
@@ -101,6 +339,9 @@ def delete_movie(id):
     movie = Movie.query.get_or_404(id)
     
     db.session.delete(movie)
+    db.session.flush()
+    bump_version()
+    record_deletes([id])
     db.session.commit()
     
     return jsonify({"message": f"Movie with id {id} has been deleted"}), 200
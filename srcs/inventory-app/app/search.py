@@ -0,0 +1,247 @@
+import bisect
+import logging
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func, text
+
+from app.models import db, Movie
+from app.changes import CursorExpired, DELETE, DELETE_ALL, INSERT, UPDATE, latest_cursor, read_changes
+
+logger = logging.getLogger(__name__)
+
+TRIGRAM_INDEX_NAME = 'movies_title_trgm_idx'
+
+
+def trigrams(value):
+    """Distinct lower-cased 3-character substrings of value."""
+    value = value.lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def relevance(title, query):
+    """Sort key for a title known to contain query: exact, then prefix, then shortest."""
+    title = title.lower()
+    return (title != query, not title.startswith(query), len(title), title)
+
+
+class TrigramSearch:
+    """
+    Title search backed by Postgres pg_trgm.
+
+    A GIN trigram index lets `ILIKE '%q%'` use an index instead of a
+    sequential scan; results are ranked by trigram similarity.
+    """
+
+    name = 'pg_trgm'
+
+    def search(self, query, limit):
+        pattern = f'%{query}%'
+        stmt = (
+            db.select(Movie.id, Movie.title, Movie.description)
+            .where(Movie.title.ilike(pattern))
+            .order_by(func.similarity(Movie.title, query).desc(), Movie.id)
+            .limit(limit)
+        )
+        return db.session.execute(stmt).all()
+
+
+class NgramIndex:
+    """
+    In-process trigram index over movie titles, for databases without pg_trgm.
+
+    Maps every trigram to the ids of the titles containing it. A substring
+    query intersects the posting sets of its own trigrams and checks the few
+    remaining candidates, so the cost depends on the number of matches rather
+    than the size of the catalogue.
+
+    The index follows the catalogue change log (see app.changes): before
+    answering, it applies the entries committed since its cursor, so writes
+    made by any worker are seen at once and rolled-back writes never are.
+    Full rebuilds run in a background thread, when the log has been pruned
+    past the cursor and every `refresh_interval` seconds to pick up rows
+    written around the API; searches keep using the current index meanwhile.
+    """
+
+    name = 'ngram'
+
+    def __init__(self, app, refresh_interval=60.0, catch_up_batch=1000):
+        self.app = app
+        self.refresh_interval = refresh_interval
+        self.catch_up_batch = catch_up_batch
+        self._postings = {}
+        self._titles = {}
+        self._cursor = 0
+        # Guards the postings; _catch_up_lock serializes moving the cursor
+        self._lock = threading.RLock()
+        self._catch_up_lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._rebuilding = False
+        self._built_at = None
+
+    def build(self, batch_size=10000):
+        """Index every title; changes logged from here on are applied by catch_up()."""
+        self._built_at = time.monotonic()
+        cursor = latest_cursor()
+        postings = {}
+        titles = {}
+        result = db.session.execute(
+            db.select(Movie.id, Movie.title).execution_options(yield_per=batch_size)
+        )
+        for movie_id, title in result:
+            titles[movie_id] = title.lower()
+            for gram in trigrams(title):
+                postings.setdefault(gram, set()).add(movie_id)
+        # Entries after cursor may already be in the scan; applying them
+        # again in order leaves the same titles
+        with self._catch_up_lock, self._lock:
+            self._postings = postings
+            self._titles = titles
+            self._cursor = cursor
+
+    def rebuild_in_background(self):
+        """Start a full rebuild unless one is already running."""
+        with self._rebuild_lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, name='title-index-rebuild', daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            with self.app.app_context():
+                self.build()
+        except Exception as e:
+            logger.warning(f"Rebuilding the title index failed: {e}")
+        finally:
+            self._rebuilding = False
+
+    def catch_up(self):
+        """Apply the change log entries committed since the index's cursor."""
+        with self._catch_up_lock:
+            while True:
+                try:
+                    rows, has_more = read_changes(self._cursor, self.catch_up_batch)
+                except CursorExpired:
+                    self.rebuild_in_background()
+                    return
+                with self._lock:
+                    for row in rows:
+                        if row.op in (INSERT, UPDATE):
+                            self._add(row.movie_id, row.title)
+                        elif row.op == DELETE:
+                            self._discard(row.movie_id)
+                        elif row.op == DELETE_ALL:
+                            self._postings = {}
+                            self._titles = {}
+                if rows:
+                    self._cursor = rows[-1].id
+                if not has_more:
+                    return
+
+    def refresh(self):
+        if self._built_at is None or time.monotonic() - self._built_at > self.refresh_interval:
+            self._built_at = time.monotonic()
+            self.rebuild_in_background()
+        self.catch_up()
+
+    def _add(self, movie_id, title):
+        self._discard(movie_id)
+        self._titles[movie_id] = title.lower()
+        for gram in trigrams(title):
+            self._postings.setdefault(gram, set()).add(movie_id)
+
+    def _discard(self, movie_id):
+        old = self._titles.pop(movie_id, None)
+        if old is None:
+            return
+        for gram in trigrams(old):
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(movie_id)
+                if not ids:
+                    del self._postings[gram]
+
+    def _matches(self, query):
+        """(lower-cased title, id) of every title containing query."""
+        with self._lock:
+            grams = trigrams(query)
+            if grams:
+                sets = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+                candidates = set(sets[0]).intersection(*sets[1:])
+            else:
+                # Queries shorter than a trigram can only be answered by a scan
+                candidates = list(self._titles)
+            return [(self._titles[i], i) for i in candidates if query in self._titles[i]]
+
+    def match_ids(self, query, limit):
+        query = query.lower()
+        matches = self._matches(query)
+        matches.sort(key=lambda match: relevance(match[0], query))
+        return [movie_id for _, movie_id in matches[:limit]]
+
+    def ids_containing(self, query, after_id=None):
+        """Ids of every title containing query, in id order, after after_id if given."""
+        ids = sorted(movie_id for _, movie_id in self._matches(query.lower()))
+        if after_id is not None:
+            ids = ids[bisect.bisect_right(ids, after_id):]
+        return ids
+
+    def search(self, query, limit):
+        self.refresh()
+        ids = self.match_ids(query, limit)
+        if not ids:
+            return []
+        rows = db.session.execute(
+            db.select(Movie.id, Movie.title, Movie.description).where(Movie.id.in_(ids))
+        ).all()
+        order = {movie_id: position for position, movie_id in enumerate(ids)}
+        return sorted(rows, key=lambda row: order[row.id])
+
+
+def _enable_trigram_index():
+    """Create pg_trgm and the title index; returns False if that is not possible."""
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            connection.execute(text(
+                f'CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX_NAME} '
+                f'ON movies USING gin (title gin_trgm_ops)'
+            ))
+        return True
+    except Exception as e:
+        logger.warning(f"pg_trgm unavailable, falling back to in-process title index: {e}")
+        return False
+
+
+def init_search(app):
+    """
+    Pick the title search backend for this database and prepare it.
+
+    Must run inside an application context, after the tables exist.
+    """
+    if db.engine.dialect.name == 'postgresql' and _enable_trigram_index():
+        backend = TrigramSearch()
+    else:
+        backend = NgramIndex(app, refresh_interval=app.config['MOVIE_SEARCH_REFRESH_SECONDS'])
+        backend.build()
+    app.extensions['movie_search'] = backend
+    return backend
+
+
+def matching_ids(query, after_id=None):
+    """
+    Ids of every movie whose title contains query, in id order, from the
+    in-process index; None when the database indexes ILIKE itself (pg_trgm).
+    """
+    backend = current_app.extensions['movie_search']
+    if not isinstance(backend, NgramIndex):
+        return None
+    backend.refresh()
+    return backend.ids_containing(query, after_id)
+
+
+def search_movies(query, limit):
+    """Rows (id, title, description) whose title contains query, best match first."""
+    return current_app.extensions['movie_search'].search(query, limit)
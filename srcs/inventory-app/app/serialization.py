@@ -0,0 +1,87 @@
+"""
+JSON responses and column projection (`?fields=`).
+
+The same file in inventory-app and billing-app (see the top-level README);
+keep the copies in step.
+"""
+import json
+from datetime import datetime
+
+from flask import Response
+
+from app.models import db
+from app.tracing import span
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat() + 'Z'
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """
+    Encode obj as compact UTF-8 JSON bytes.
+
+    Naive datetimes are UTC (that is how they are stored) and come out as
+    ISO 8601 with a trailing Z.
+    """
+    with span('serialize'):
+        if orjson is not None:
+            return orjson.dumps(obj, option=orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z)
+        return json.dumps(obj, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def json_response(obj, status=200):
+    """Like jsonify, but encoded with orjson when it is available."""
+    return Response(dumps(obj), status=status, mimetype='application/json')
+
+
+def model_fields(model):
+    """Column names of a model, in table order."""
+    return [column.key for column in model.__table__.columns]
+
+
+def parse_fields(model, raw, default=None):
+    """
+    Parse a `?fields=a,b` projection for model.
+
+    Returns the list of column names to return: default (every column if
+    None) when raw is empty. Raises ValueError for names that are not
+    columns of model.
+    """
+    available = model_fields(model)
+    if not raw:
+        return list(default) if default is not None else available
+    fields = []
+    for name in raw.split(','):
+        name = name.strip()
+        if name and name not in fields:
+            fields.append(name)
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(available)}")
+    if not fields:
+        raise ValueError("fields must name at least one column")
+    return fields
+
+
+def select_fields(model, fields, *extra):
+    """
+    SELECT of plain column tuples: no ORM objects, no identity map.
+
+    Columns named in extra are appended after fields when missing, for
+    callers that need them (e.g. a pagination cursor) without returning them.
+    """
+    names = list(fields) + [name for name in extra if name not in fields]
+    return db.select(*[getattr(model, name) for name in names])
+
+
+def rows_to_dicts(rows, fields):
+    """Turn column tuples into dicts, dropping any trailing extra columns."""
+    return [dict(zip(fields, row)) for row in rows]
@@ -0,0 +1,284 @@
+"""
+Request tracing: request ids and sampling across services, and span export.
+
+Copied verbatim into every service (see the top-level README); keep the
+copies in step.
+"""
+import contextvars
+import importlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Request id accepted from callers and passed on to every downstream hop
+REQUEST_ID_HEADER = 'X-Request-ID'
+# '1' when the trace of this request is exported; downstream hops follow it
+SAMPLED_HEADER = 'X-Trace-Sampled'
+# Over AMQP the request id travels as the correlation_id, and this header
+# is set on messages whose trace is sampled
+AMQP_SAMPLED_HEADER = 'x-trace-sampled'
+
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+# Individual spans kept per trace; timings are still summed beyond that
+MAX_SPANS = 200
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+def accept_request_id(value):
+    """The caller's request id if it is reasonable, otherwise a new one."""
+    if value and _VALID_REQUEST_ID.match(value):
+        return value
+    return uuid.uuid4().hex
+
+
+def should_sample(flag=None):
+    """Follow an upstream sampling decision, or sample at TRACE_SAMPLE_RATE."""
+    if flag in ('1', '0'):
+        return flag == '1'
+    return Config.TRACE_SAMPLE_RATE > 0 and random.random() < Config.TRACE_SAMPLE_RATE
+
+
+class Trace:
+    """
+    Timings of one request (or message) in one service.
+
+    Spans with the same name are summed for the Server-Timing header. When
+    the trace is sampled, the individual spans are also kept, with their
+    offset from the start, and written to the exporter by finish().
+    """
+
+    __slots__ = ('service', 'name', 'request_id', 'sampled', 'started_at', 'started', 'totals', 'spans')
+
+    def __init__(self, service, name, request_id, sampled):
+        self.service = service
+        self.name = name
+        self.request_id = request_id
+        self.sampled = sampled
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.totals = {}
+        self.spans = [] if sampled else None
+
+    def add(self, name, started, duration):
+        self.totals[name] = self.totals.get(name, 0.0) + duration
+        if self.spans is not None and len(self.spans) < MAX_SPANS:
+            self.spans.append((name, started - self.started, duration))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Server-Timing value, every entry prefixed with the service name."""
+        entries = [f'{self.service}.{name};dur={duration * 1000:.2f}' for name, duration in self.totals.items()]
+        entries.append(f'{self.service}.total;dur={self.elapsed() * 1000:.2f}')
+        return ', '.join(entries)
+
+    def propagation_headers(self):
+        return {REQUEST_ID_HEADER: self.request_id, SAMPLED_HEADER: '1' if self.sampled else '0'}
+
+    def response_headers(self):
+        """(name, value) pairs that report this trace back to the caller."""
+        headers = [(REQUEST_ID_HEADER, self.request_id)]
+        if Config.SERVER_TIMING_ENABLED:
+            headers.append(('Server-Timing', self.server_timing()))
+        return headers
+
+    def finish(self, **attributes):
+        """Export the trace if it is sampled."""
+        if not self.sampled:
+            return
+        exporter = get_exporter()
+        if exporter is None:
+            return
+        record = {
+            'service': self.service,
+            'name': self.name,
+            'request_id': self.request_id,
+            'start': round(self.started_at, 6),
+            'duration_ms': round(self.elapsed() * 1000, 3),
+            'totals_ms': {name: round(duration * 1000, 3) for name, duration in self.totals.items()},
+            'spans': [
+                {'name': name, 'offset_ms': round(offset * 1000, 3), 'duration_ms': round(duration * 1000, 3)}
+                for name, offset, duration in self.spans
+            ]
+        }
+        record.update(attributes)
+        try:
+            exporter.export(record)
+        except Exception as e:
+            logger.warning(f"Trace export failed: {e}")
+
+
+def start_trace(service, name, request_id=None, sampled=None):
+    """Make a new trace the current one; returns (trace, token for end_trace)."""
+    trace = Trace(service, name, accept_request_id(request_id), should_sample() if sampled is None else sampled)
+    return trace, _current.set(trace)
+
+
+def end_trace(token):
+    _current.reset(token)
+
+
+def current_trace():
+    return _current.get()
+
+
+def message_trace():
+    """(correlation_id, headers) carrying the current trace across a broker hop."""
+    trace = _current.get()
+    if trace is None:
+        return None, {}
+    return trace.request_id, ({AMQP_SAMPLED_HEADER: 1} if trace.sampled else {})
+
+
+def record(name, started, duration):
+    """Add a timing measured elsewhere (e.g. by a database hook) to the current trace."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, started, duration)
+
+
+class span:
+    """
+    Time a block as a span of the current trace.
+
+        with span('db'):
+            ...
+
+    Costs two clock reads and a dict update; the span itself is only kept
+    when the trace is sampled.
+    """
+
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        trace = _current.get()
+        if trace is not None:
+            trace.add(self.name, self.started, time.perf_counter() - self.started)
+
+
+# Exporters
+
+class FileExporter:
+    """Appends one JSON object per trace to a file (JSON lines)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def export(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            # Reopened after a fork so worker processes never share a file offset
+            if self._file is None or self._pid != os.getpid():
+                self._file = open(self.path, 'a', buffering=1)
+                self._pid = os.getpid()
+            self._file.write(line)
+
+
+class LogExporter:
+    """Logs one JSON object per trace."""
+
+    def __init__(self):
+        self._logger = logging.getLogger('trace')
+
+    def export(self, record):
+        self._logger.info(json.dumps(record, separators=(',', ':')))
+
+
+def load_exporter(spec):
+    """
+    Build the exporter named by TRACE_EXPORTER.
+
+    'none' (or empty) disables export, 'file' writes TRACE_FILE, 'log' uses
+    the 'trace' logger, and 'package.module:factory' calls factory() for a
+    custom exporter: any object with an export(record) method.
+    """
+    spec = (spec or 'none').strip()
+    if spec == 'none':
+        return None
+    if spec == 'file':
+        return FileExporter(Config.TRACE_FILE)
+    if spec == 'log':
+        return LogExporter()
+    module_name, _, factory = spec.partition(':')
+    return getattr(importlib.import_module(module_name), factory or 'create_exporter')()
+
+
+_exporter = None
+_exporter_loaded = False
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    global _exporter, _exporter_loaded
+    if not _exporter_loaded:
+        with _exporter_lock:
+            if not _exporter_loaded:
+                try:
+                    _exporter = load_exporter(Config.TRACE_EXPORTER)
+                except Exception as e:
+                    logger.error(f"Could not load trace exporter {Config.TRACE_EXPORTER!r}: {e}")
+                _exporter_loaded = True
+    return _exporter
+
+
+def init_tracing(app, service):
+    """
+    Trace every request of a Flask app.
+
+    Accepts or creates the request id, returns it in X-Request-ID, adds a
+    Server-Timing header and exports sampled traces.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def begin():
+        rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        trace, g.trace_token = start_trace(
+            service,
+            f'{request.method} {rule}',
+            request.headers.get(REQUEST_ID_HEADER),
+            should_sample(request.headers.get(SAMPLED_HEADER))
+        )
+        g.trace = trace
+
+    @app.after_request
+    def add_headers(response):
+        trace = g.get('trace')
+        if trace is not None:
+            for name, value in trace.response_headers():
+                if name == REQUEST_ID_HEADER:
+                    response.headers[name] = value
+                else:
+                    # Added after any Server-Timing relayed from an upstream
+                    response.headers.add(name, value)
+            g.trace_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish(exc):
+        trace = g.pop('trace', None)
+        if trace is None:
+            return
+        trace.finish(status=g.pop('trace_status', 500))
+        end_trace(g.pop('trace_token'))